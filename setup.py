@@ -45,6 +45,8 @@ setup(
                                "simplejson", # for updates
                                "wxPython",
                                ],
+                      # Export of event data to Apache Parquet files
+                      'parquet': ["pyarrow"],
                       },
     install_requires=["appdirs",
                       "h5py",
@@ -53,6 +55,13 @@ setup(
                       "pyper",
                       "scipy>=0.13.0",
                       ] + release_deps,
+    entry_points={"console_scripts": [
+                      # Headless batch filtering
+                      "shapeout-batch = shapeout.batch.cli:main",
+                      "shapeout-batch-worker = "
+                      "shapeout.batch.cli:worker_main",
+                      ],
+                  },
     setup_requires=['pytest-runner'],
     tests_require=["pytest", "urllib3"],
     keywords=["RT-DC", "deformability", "cytometry", "zellmechanik"],
@@ -0,0 +1,3 @@
+#!/usr/bin/env python
+# This file was created automatically
+longversion = '2018.06.08-20-48-27'
@@ -0,0 +1,9 @@
+from .core import (CHIP_REGIONS, batch_filter, batch_sweep,  # noqa: F401
+                   compute_statistics, compute_statistics_sweep,
+                   filter_files, find_data_files, get_config_hash,
+                   iter_statistics, iter_statistics_sweep,
+                   load_filter_config, load_filter_configs)
+from .cache import BatchCache  # noqa: F401
+from .jobqueue import (JobQueue, JobQueueError,  # noqa: F401
+                       batch_filter_queue, run_worker)
+from .journal import BatchJournal, BatchResumeError  # noqa: F401
@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - persistent cache for batch statistics"""
+from __future__ import division, print_function, unicode_literals
+
+import json
+import pathlib
+import sqlite3
+import time
+
+import appdirs
+import dclab
+
+from ..cache_store import ACCESS_BATCH_SIZE
+
+#: default file name of the cache in the user cache directory
+CACHE_NAME = "shapeout_batch_results.db"
+
+
+class BatchCache(object):
+    def __init__(self, path=None):
+        """Persistent cache for the statistics of measurements
+
+        Entries are keyed by the data set hash, the filter configuration
+        hash (see `core.get_config_hash`), the features, the statistical
+        methods, and the version of dclab.
+
+        Parameters
+        ----------
+        path: str or None
+            Path of the SQLite database; defaults to `CACHE_NAME`
+            in the user cache directory.
+
+        Notes
+        -----
+        The access times of the entries read with `get` are written
+        in batches (see `cache_store.ACCESS_BATCH_SIZE`).
+        """
+        if path is None:
+            directory = pathlib.Path(appdirs.user_cache_dir())
+            if not directory.exists():
+                directory.mkdir(parents=True)
+            path = directory / CACHE_NAME
+        self.path = pathlib.Path(path)
+        self.version = dclab.__version__
+        #: access times not yet written {key: time}
+        self._accessed = {}
+        self._con = sqlite3.connect(str(self.path), timeout=60)
+        with self._con:
+            self._con.execute("CREATE TABLE IF NOT EXISTS results ("
+                              "dataset_hash TEXT, "
+                              "config_hash TEXT, "
+                              "features TEXT, "
+                              "methods TEXT, "
+                              "version TEXT, "
+                              "head TEXT, "
+                              "data TEXT, "
+                              "size INTEGER, "
+                              "created REAL, "
+                              "accessed REAL, "
+                              "PRIMARY KEY (dataset_hash, config_hash, "
+                              "features, methods, version))")
+            self._con.execute("CREATE INDEX IF NOT EXISTS results_accessed "
+                              "ON results (accessed)")
+
+    def __len__(self):
+        return self._con.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self._con.close()
+
+    def flush(self):
+        """Write the access times of the entries read with `get`"""
+        if self._accessed:
+            with self._con:
+                self._con.executemany(
+                    "UPDATE results SET accessed=? WHERE dataset_hash=? AND "
+                    "config_hash=? AND features=? AND methods=? AND "
+                    "version=?",
+                    [(tt,) + kk for kk, tt in self._accessed.items()])
+            self._accessed.clear()
+
+    def get(self, dataset_hash, config_hash, features, methods):
+        """Return the cached statistics or `None`
+
+        Returns
+        -------
+        head: list of str
+            Column names of the statistics
+        values: list of float
+            Statistics values
+        """
+        key = self._get_key(dataset_hash, config_hash, features, methods)
+        res = self._con.execute(
+            "SELECT head, data FROM results WHERE dataset_hash=? AND "
+            "config_hash=? AND features=? AND methods=? AND version=?",
+            key).fetchone()
+        if res is None:
+            return None
+        self._accessed[key] = time.time()
+        if len(self._accessed) >= ACCESS_BATCH_SIZE:
+            self.flush()
+        return json.loads(res[0]), json.loads(res[1])
+
+    def set(self, dataset_hash, config_hash, features, methods, head,
+            values):
+        """Store the statistics of a measurement"""
+        key = self._get_key(dataset_hash, config_hash, features, methods)
+        shead = json.dumps(head)
+        sdata = json.dumps(values)
+        now = time.time()
+        self._accessed.pop(key, None)
+        with self._con:
+            self._con.execute(
+                "INSERT OR REPLACE INTO results VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (shead, sdata, len(shead) + len(sdata), now, now))
+
+    def query(self, dataset_hash=None, config_hash=None):
+        """Return cache entries as a list of dictionaries
+
+        Parameters
+        ----------
+        dataset_hash: str or None
+            Only return entries of this data set
+        config_hash: str or None
+            Only return entries of this filter configuration
+        """
+        self.flush()
+        sql = ("SELECT dataset_hash, config_hash, features, methods, "
+               "version, head, data, created, accessed FROM results")
+        conds = []
+        args = []
+        if dataset_hash is not None:
+            conds.append("dataset_hash=?")
+            args.append(dataset_hash)
+        if config_hash is not None:
+            conds.append("config_hash=?")
+            args.append(config_hash)
+        if conds:
+            sql += " WHERE " + " AND ".join(conds)
+        sql += " ORDER BY created"
+        entries = []
+        for row in self._con.execute(sql, args):
+            entries.append({"dataset hash": row[0],
+                            "config hash": row[1],
+                            "features": json.loads(row[2]),
+                            "methods": json.loads(row[3]),
+                            "version": row[4],
+                            "head": json.loads(row[5]),
+                            "values": json.loads(row[6]),
+                            "created": row[7],
+                            "accessed": row[8],
+                            })
+        return entries
+
+    def prune(self, max_age=None, max_size=None):
+        """Remove cache entries
+
+        Parameters
+        ----------
+        max_age: float or None
+            Remove entries that have not been accessed for
+            `max_age` seconds.
+        max_size: int or None
+            Remove the least recently accessed entries until the
+            total size of the cached data is below `max_size` bytes.
+
+        Returns
+        -------
+        removed: int
+            Number of removed entries
+        """
+        self.flush()
+        size0 = len(self)
+        with self._con:
+            if max_age is not None:
+                self._con.execute("DELETE FROM results WHERE accessed<?",
+                                  (time.time() - max_age,))
+            if max_size is not None:
+                total = self.size()
+                rows = self._con.execute(
+                    "SELECT rowid, size FROM results ORDER BY accessed"
+                    ).fetchall()
+                remove = []
+                for rowid, size in rows:
+                    if total <= max_size:
+                        break
+                    remove.append((rowid,))
+                    total -= size
+                self._con.executemany("DELETE FROM results WHERE rowid=?",
+                                      remove)
+        removed = size0 - len(self)
+        if removed:
+            self._con.execute("VACUUM")
+        return removed
+
+    def size(self):
+        """Return the total size of the cached data [bytes]"""
+        total = self._con.execute("SELECT SUM(size) FROM results").fetchone()
+        return total[0] or 0
+
+    def _get_key(self, dataset_hash, config_hash, features, methods):
+        return (dataset_hash, config_hash, json.dumps(list(features)),
+                json.dumps(list(methods)), self.version)
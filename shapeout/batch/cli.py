@@ -0,0 +1,205 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - command line interface for batch filtering
+
+Example::
+
+    shapeout-batch /path/to/data -c session.zmso -o statistics.tsv \\
+        -f deform area_um -s Mean Median Events
+
+Several filter configurations (e.g. all measurements of a session
+with "-m all") are applied in a single pass over the data::
+
+    shapeout-batch /path/to/data -c gate1.txt gate2.txt -o sweep.tsv \\
+        -f deform area_um -s Mean Events
+
+Distributed processing with a job queue in a shared directory
+(workers are started on other machines with access to the share)::
+
+    shapeout-batch /share/data -c session.zmso -o statistics.tsv \\
+        -f deform -s Mean --queue /share/queue -j 4
+    shapeout-batch-worker /share/queue --wait 60
+"""
+from __future__ import division, print_function, unicode_literals
+
+import argparse
+import pathlib
+import sys
+
+import dclab
+
+from . import cache, core, jobqueue
+
+
+def get_parser():
+    """Return the argument parser of `shapeout-batch`"""
+    methods = sorted(dclab.statistics.Statistics.available_methods.keys())
+    parser = argparse.ArgumentParser(
+        prog="shapeout-batch",
+        description="Apply the filter settings of a ShapeOut session or "
+                    "configuration file to all measurements in a folder "
+                    "and save statistical parameters to a .tsv file.")
+    parser.add_argument("folder",
+                        help="folder containing RT-DC measurements")
+    parser.add_argument("-c", "--config", nargs="+", required=True,
+                        metavar="CONFIG",
+                        help="ShapeOut session (.zmso) or measurement "
+                             "configuration files with filter settings; "
+                             "several configuration files are applied "
+                             "in a single pass over the data (sweep)")
+    parser.add_argument("-o", "--output", required=True,
+                        help="output .tsv file")
+    parser.add_argument("-f", "--features", nargs="+", required=True,
+                        metavar="FEATURE",
+                        help="scalar features, e.g. deform area_um")
+    parser.add_argument("-s", "--statistics", nargs="+", default=methods,
+                        metavar="METHOD",
+                        help="statistical methods (default: all), one or "
+                             "more of: {}".format(", ".join(methods)))
+    parser.add_argument("-m", "--measurement", default="0",
+                        help="index or title of the session measurement "
+                             "whose filter settings are used or 'all' to "
+                             "sweep over all measurements (default: 0)")
+    parser.add_argument("-p", "--polygons",
+                        help="polygon filter file (.poly) for "
+                             "configuration files")
+    parser.add_argument("--flow-rate", type=float,
+                        help="only use measurements with this flow "
+                             "rate [µl/s]")
+    parser.add_argument("--region", choices=core.CHIP_REGIONS,
+                        help="only use measurements in this chip region")
+    parser.add_argument("-j", "--processes", type=int, default=1,
+                        help="number of worker processes (default: 1)")
+    parser.add_argument("--memory-limit", type=int, metavar="MB",
+                        help="maximum memory per worker process [MB]")
+    parser.add_argument("--cache", nargs="?", const="", metavar="PATH",
+                        help="cache statistics in an SQLite database "
+                             "(default: in the user cache directory) and "
+                             "only process new or modified measurements")
+    parser.add_argument("--resume", action="store_true",
+                        help="resume an interrupted batch run with the "
+                             "same output file and arguments")
+    parser.add_argument("--queue", metavar="DIR",
+                        help="distribute the measurements via a job queue "
+                             "in a shared directory; additional workers "
+                             "are started with 'shapeout-batch-worker DIR' "
+                             "and --processes sets the number of local "
+                             "workers (may be 0)")
+    parser.add_argument("--stale", type=float, metavar="SECONDS",
+                        help="requeue jobs of workers that did not finish "
+                             "within SECONDS (only with --queue)")
+    return parser
+
+
+def get_worker_parser():
+    """Return the argument parser of `shapeout-batch-worker`"""
+    parser = argparse.ArgumentParser(
+        prog="shapeout-batch-worker",
+        description="Process the jobs of a distributed batch run "
+                    "(see 'shapeout-batch --queue').")
+    parser.add_argument("queue",
+                        help="job queue directory")
+    parser.add_argument("--wait", type=float, default=0, metavar="SECONDS",
+                        help="wait SECONDS for new jobs when the queue "
+                             "is empty (default: 0)")
+    parser.add_argument("--memory-limit", type=int, metavar="MB",
+                        help="maximum memory of the worker process [MB]")
+    return parser
+
+
+def main(args=None):
+    """Entry point of `shapeout-batch`"""
+    parser = get_parser()
+    args = parser.parse_args(args)
+    for feat in args.features:
+        if feat not in dclab.dfn.scalar_feature_names:
+            parser.error("unknown feature: {}".format(feat))
+    for meth in args.statistics:
+        if meth not in dclab.statistics.Statistics.available_methods:
+            parser.error("unknown statistical method: {}".format(meth))
+    sessions = [cc for cc in args.config
+                if pathlib.Path(cc).suffix == ".zmso"]
+    if sessions and len(args.config) > 1:
+        # loading a session replaces all polygon filters
+        parser.error("a session cannot be combined with other "
+                     "configurations")
+    measurement = args.measurement
+    if measurement.isdigit():
+        measurement = int(measurement)
+    if measurement == "all" and not sessions:
+        parser.error("'-m all' requires a session (.zmso) file")
+    if sessions and measurement == "all":
+        sweep = core.load_filter_configs(sessions[0])
+    elif sessions:
+        sweep = [(measurement,
+                  core.load_filter_config(sessions[0],
+                                          measurement=measurement))]
+    else:
+        sweep = []
+        for cc in args.config:
+            sweep.append((cc, core.load_filter_config(
+                cc, polygon_file=args.polygons)))
+    if len(sweep) > 1 and (args.cache is not None or args.resume or
+                           args.queue):
+        parser.error("--cache, --resume, and --queue are not supported "
+                     "for several configurations")
+    if args.queue and (args.cache is not None or args.resume):
+        parser.error("--cache and --resume are not supported with --queue")
+    files = core.find_data_files(args.folder)
+    files = core.filter_files(files,
+                              flow_rate=args.flow_rate,
+                              region=args.region)
+    if args.queue:
+        jobqueue.batch_filter_queue(files=files,
+                                    config=sweep[0][1],
+                                    features=args.features,
+                                    methods=args.statistics,
+                                    out_tsv=args.output,
+                                    directory=args.queue,
+                                    processes=args.processes,
+                                    stale=args.stale)
+    elif len(sweep) > 1:
+        core.batch_sweep(files=files,
+                         configs=[ss[1] for ss in sweep],
+                         names=[ss[0] for ss in sweep],
+                         features=args.features,
+                         methods=args.statistics,
+                         out_tsv=args.output,
+                         processes=args.processes,
+                         memory_limit=args.memory_limit)
+    else:
+        if args.cache is None:
+            bcache = None
+        else:
+            bcache = cache.BatchCache(args.cache or None)
+        try:
+            core.batch_filter(files=files,
+                              config=sweep[0][1],
+                              features=args.features,
+                              methods=args.statistics,
+                              out_tsv=args.output,
+                              processes=args.processes,
+                              memory_limit=args.memory_limit,
+                              resume=args.resume,
+                              cache=bcache)
+        finally:
+            if bcache is not None:
+                bcache.close()
+    print("Wrote statistics of {} measurements to {}".format(len(files),
+                                                            args.output))
+    return 0
+
+
+def worker_main(args=None):
+    """Entry point of `shapeout-batch-worker`"""
+    parser = get_worker_parser()
+    args = parser.parse_args(args)
+    count = jobqueue.run_worker(args.queue,
+                                memory_limit=args.memory_limit,
+                                wait=args.wait)
+    print("Processed {} measurements".format(count))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,550 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - batch filtering and statistics of RT-DC measurements"""
+from __future__ import division, print_function, unicode_literals
+
+import io
+import json
+import multiprocessing as mp
+import os
+import pathlib
+
+import dclab
+import dclab.definitions as dfn
+from dclab.polygon_filter import PolygonFilter
+from dclab.rtdc_dataset import Configuration
+from dclab.rtdc_dataset.util import hashobj
+
+from .. import analysis
+from .. import meta_tool
+from ..session import rw
+from . import journal, pool
+
+
+#: chip regions that can be selected with `filter_files`
+CHIP_REGIONS = ["channel", "reservoir"]
+
+#: configuration sections applied by `analysis.Analysis.SetParameters`
+CONFIG_SECTIONS = ["filtering", "plotting", "analysis", "calculation"]
+
+
+def find_data_files(folder, index=None):
+    """Return all RT-DC measurement files in a folder (recursively)
+
+    See `shapeout.meta_tool.collect_data_tree` for `index`.
+    """
+    tree, _cols = meta_tool.collect_data_tree(folder, index=index)
+    # The first item of each tree entry is the project
+    return [item[1] for t in tree for item in t[1:]]
+
+
+def filter_files(files, flow_rate=None, region=None):
+    """Select measurement files by flow rate and chip region
+
+    Parameters
+    ----------
+    files: list of str
+        Measurement files
+    flow_rate: float or None
+        Only use files with this flow rate [µl/s]
+    region: str or None
+        Only use files recorded in this region
+        (one of `CHIP_REGIONS`)
+    """
+    if region is not None and region not in CHIP_REGIONS:
+        raise ValueError("`region` must be one of {}".format(CHIP_REGIONS))
+    selected = []
+    for tt in files:
+        meta = meta_tool.get_metadata(tt)
+        if flow_rate is not None and meta.flow_rate != flow_rate:
+            continue
+        if region is not None and meta.chip_region != region:
+            continue
+        selected.append(tt)
+    return selected
+
+
+def load_filter_config(path, measurement=0, polygon_file=None,
+                       search_path="."):
+    """Load the filter configuration from a session or a config file
+
+    Parameters
+    ----------
+    path: str
+        Path to a ShapeOut session (.zmso) or to a measurement
+        configuration file (e.g. "config.txt" in a session)
+    measurement: int or str
+        Index or title of the session measurement whose configuration
+        is used (ignored for configuration files)
+    polygon_file: str or None
+        Polygon filter file (.poly) to load for configuration files;
+        polygon filters of sessions are loaded automatically.
+    search_path: str
+        Search path for the measurement files of a session (see
+        `shapeout.session.rw.load`)
+
+    Returns
+    -------
+    config: dclab.rtdc_dataset.Configuration
+        The configuration containing the "filtering" section
+
+    Notes
+    -----
+    The polygon filters referenced by the configuration are registered
+    in `dclab.polygon_filter.PolygonFilter.instances`.
+    """
+    path = pathlib.Path(path)
+    configs = load_filter_configs(path,
+                                  polygon_file=polygon_file,
+                                  search_path=search_path)
+    if path.suffix != ".zmso":
+        return configs[0][1]
+    elif isinstance(measurement, int):
+        return configs[measurement][1]
+    else:
+        titles = [c[0] for c in configs]
+        if measurement not in titles:
+            raise ValueError("No measurement '{}' in {}".format(
+                measurement, path))
+        return configs[titles.index(measurement)][1]
+
+
+def load_filter_configs(path, polygon_file=None, search_path="."):
+    """Load the filter configurations of all measurements of a session
+
+    Parameters
+    ----------
+    path, polygon_file, search_path:
+        See `load_filter_config`
+
+    Returns
+    -------
+    configs: list of (str, dclab.rtdc_dataset.Configuration)
+        The measurement titles and configurations of the session;
+        for configuration files, a single entry with the file name
+        as title.
+    """
+    path = pathlib.Path(path)
+    if path.suffix == ".zmso":
+        # the measurements of the session are not opened
+        rtdc_list = rw.load(path, search_path=search_path, lazy=True)
+        return [(mm.title, mm.config) for mm in rtdc_list]
+    else:
+        if polygon_file is not None:
+            PolygonFilter.clear_all_filters()
+            PolygonFilter.import_all(polygon_file)
+        return [(path.name, Configuration(files=[path]))]
+
+
+def compute_statistics(path, config, features, methods):
+    """Filter a measurement file and compute its statistics
+
+    Parameters
+    ----------
+    path: str
+        Measurement file
+    config: dict-like
+        Configuration with the "filtering" section to apply
+    features: list of str
+        Scalar features for which the statistics are computed
+    methods: list of str
+        Statistical methods (see
+        `dclab.statistics.Statistics.available_methods`)
+
+    Returns
+    -------
+    head: list of str
+        Column names of the statistics
+    row: list
+        The measurement path, title, and statistics values
+    """
+    # Make analysis from data file
+    anal = analysis.Analysis([path], config=config)
+    mm = anal.measurements[0]
+    # Apply filters
+    mm.apply_filter()
+    # Get statistics
+    head, values = dclab.statistics.get_statistics(rtdc_ds=mm,
+                                                   methods=methods,
+                                                   features=features)
+    return head, [mm.path, mm.title] + values
+
+
+def compute_statistics_sweep(path, configs, features, methods):
+    """Compute the statistics of a measurement file for several filters
+
+    The measurement is loaded only once and each filter configuration
+    is applied to the feature data in memory.
+
+    Parameters
+    ----------
+    path: str
+        Measurement file
+    configs: list of dict-like
+        Configurations with the "filtering" section to apply
+    features, methods:
+        See `compute_statistics`
+
+    Returns
+    -------
+    results: list of (head, row)
+        For each configuration, the result of `compute_statistics`
+    """
+    anal = analysis.Analysis([path])
+    mm = anal.measurements[0]
+    if mm.format == "hdf5":
+        # scalar features are otherwise read from disk for each filter
+        mm._events = _MemoryEvents(mm._events)
+    # The configuration sections are reset before each filter, such
+    # that each configuration yields the same statistics as a
+    # separate call to `compute_statistics`.
+    base = mm.config.copy()
+    results = []
+    for config in configs:
+        for sec in CONFIG_SECTIONS:
+            if sec in base:
+                mm.config[sec].clear()
+                mm.config[sec].update(base[sec])
+        anal.SetParameters(config)
+        mm.apply_filter()
+        head, values = dclab.statistics.get_statistics(rtdc_ds=mm,
+                                                       methods=methods,
+                                                       features=features)
+        results.append((head, [mm.path, mm.title] + values))
+    return results
+
+
+class _MemoryEvents(object):
+    def __init__(self, events):
+        """Keep the scalar features of HDF5 event data in memory"""
+        self._events = events
+        self._scalar = {}
+
+    def __contains__(self, key):
+        return key in self._events
+
+    def __getitem__(self, key):
+        if key not in dfn.scalar_feature_names:
+            return self._events[key]
+        if key not in self._scalar:
+            self._scalar[key] = self._events[key]
+        return self._scalar[key]
+
+    def keys(self):
+        return self._events.keys()
+
+
+def batch_filter(files, config, features, methods, out_tsv, processes=1,
+                 memory_limit=None, resume=False, cache=None):
+    """Apply a filter configuration to measurements and save statistics
+
+    Parameters
+    ----------
+    files: list of str
+        Measurement files
+    config: dict-like
+        Configuration with the "filtering" section to apply
+    features: list of str
+        Scalar features for which the statistics are computed
+    methods: list of str
+        Statistical methods (see
+        `dclab.statistics.Statistics.available_methods`)
+    out_tsv: str
+        Path of the output .tsv file
+    processes: int
+        Number of worker processes (see `iter_statistics`)
+    memory_limit: int or None
+        Maximum memory per worker process [MB]
+    resume: bool
+        Resume an interrupted batch run with the same arguments;
+        measurements completed before are not processed again.
+    cache: shapeout.batch.cache.BatchCache or None
+        Cache for statistics; only measurements whose statistics
+        are not in the cache are processed.
+
+    Notes
+    -----
+    Each measurement is loaded separately to reduce memory usage.
+    The rows in `out_tsv` are in the order of `files`, independent
+    of the number of processes. Each row is written as soon as it
+    is available and recorded in the journal file `out_tsv` +
+    ".journal" (see `journal.BatchJournal`), which allows to
+    resume interrupted runs. The journal is removed when all rows
+    have been written.
+    """
+    if not files:
+        raise ValueError("No valid measurements with current selection!")
+    out_tsv = pathlib.Path(out_tsv)
+    jrn = journal.BatchJournal(path=get_journal_path(out_tsv),
+                               key=get_run_hash(config, features, methods),
+                               resume=resume)
+    todo = []
+    for path in files:
+        dhash = meta_tool.get_dataset_hash(path)
+        if not jrn.is_done(path, dhash):
+            todo.append((path, dhash))
+    # remove everything written after the last completed row
+    with io.open(str(out_tsv), "ab") as fd:
+        fd.truncate(jrn.offset)
+    if not todo:
+        jrn.remove()
+        return
+    # use cached statistics
+    cached = {}
+    if cache is not None:
+        chash = get_config_hash(config)
+        for path, dhash in todo:
+            res = cache.get(dhash, chash, features, methods)
+            if res is not None:
+                cached[path] = res
+    misses = [t[0] for t in todo if t[0] not in cached]
+    results = iter_statistics(files=misses,
+                              config=config,
+                              features=features,
+                              methods=methods,
+                              processes=processes,
+                              memory_limit=memory_limit)
+    head = None
+    with io.open(str(out_tsv), "ab") as fd:
+        for path, dhash in todo:
+            if path in cached:
+                h, values = cached[path]
+                row = [pathlib.Path(path), meta_tool.get_title(path)] + values
+            else:
+                h, row = next(results)
+                if cache is not None:
+                    cache.set(dhash, chash, features, methods, h,
+                              [float(v) for v in row[2:]])
+            if head is None:
+                head = h
+                if fd.tell() == 0:
+                    fd.write(format_header(head).encode("utf-8") + b"\n")
+            else:
+                assert h == head, "Problem with available methods/features!"
+            fd.write(format_row(row).encode("utf-8") + b"\n")
+            fd.flush()
+            os.fsync(fd.fileno())
+            jrn.add(path, dhash, fd.tell())
+    jrn.remove()
+
+
+def batch_sweep(files, configs, features, methods, out_tsv, names=None,
+                processes=1, memory_limit=None):
+    """Apply several filter configurations to measurements in one pass
+
+    Parameters
+    ----------
+    files: list of str
+        Measurement files
+    configs: list of dict-like
+        Configurations with the "filtering" section to apply
+    features, methods, processes, memory_limit:
+        See `batch_filter`
+    out_tsv: str
+        Path of the output .tsv file
+    names: list of str or None
+        Names of the configurations written to the "Configuration"
+        column; defaults to "1", "2", ...
+
+    Notes
+    -----
+    Each measurement is loaded once and filtered with all
+    configurations (see `compute_statistics_sweep`). The output
+    contains one row for each measurement and configuration, in the
+    order of `files` and `configs`. In contrast to `batch_filter`,
+    interrupted runs cannot be resumed and the statistics are not
+    cached.
+    """
+    if not files:
+        raise ValueError("No valid measurements with current selection!")
+    if not configs:
+        raise ValueError("No filter configurations given!")
+    if names is None:
+        names = ["{}".format(ii + 1) for ii in range(len(configs))]
+    elif len(names) != len(configs):
+        raise ValueError("`names` and `configs` must have the same length!")
+    results = iter_statistics_sweep(files=files,
+                                    configs=configs,
+                                    features=features,
+                                    methods=methods,
+                                    processes=processes,
+                                    memory_limit=memory_limit)
+    head = None
+    with io.open(str(out_tsv), "wb") as fd:
+        for sweep in results:
+            for name, (h, row) in zip(names, sweep):
+                if head is None:
+                    head = h
+                    header = format_header(["Configuration"] + head)
+                    fd.write(header.encode("utf-8") + b"\n")
+                else:
+                    assert h == head, "Problem with methods/features!"
+                row = row[:2] + [name] + row[2:]
+                fd.write(format_row(row, ntext=3).encode("utf-8") + b"\n")
+            fd.flush()
+
+
+def get_config_hash(config):
+    """Return a hash of the settings of a configuration
+
+    The hash includes all sections applied by `compute_statistics`
+    (see `CONFIG_SECTIONS`), e.g. the filters and the emodulus
+    settings, and the definitions of the polygon filters referenced
+    in the "filtering" section.
+    """
+    data = _get_worker_config(config)
+    pids = data.get("filtering", {}).get("polygon filters", [])
+    polygons = [pd for pd in pool.get_polygon_definitions()
+                if pd["unique_id"] in pids]
+    polygons.sort(key=lambda pd: pd["unique_id"])
+    data["polygons"] = polygons
+    return hashobj(json.dumps(data, sort_keys=True, default=str))
+
+
+def get_journal_path(out_tsv):
+    """Return the path of the checkpoint journal of a batch run"""
+    out_tsv = pathlib.Path(out_tsv)
+    return out_tsv.with_name(out_tsv.name + ".journal")
+
+
+def get_run_hash(config, features, methods):
+    """Return a hash identifying the results of a batch run"""
+    return hashobj([get_config_hash(config), features, methods])
+
+
+def iter_statistics(files, config, features, methods, processes=1,
+                    memory_limit=None):
+    """Compute the statistics of measurement files
+
+    Parameters
+    ----------
+    files: list of str
+        Measurement files
+    config: dict-like
+        Configuration with the "filtering" section to apply
+    features: list of str
+        Scalar features for which the statistics are computed
+    methods: list of str
+        Statistical methods
+    processes: int
+        Number of worker processes; if set to 1, the statistics
+        are computed in the current process.
+    memory_limit: int or None
+        Maximum memory per worker process [MB]; only used if
+        `processes` is larger than 1. A `MemoryError` is raised
+        if a worker exceeds the limit.
+
+    Yields
+    ------
+    head, row:
+        See `compute_statistics`; in the order of `files`
+    """
+    if processes <= 1:
+        jobs = [(path, config, features, methods) for path in files]
+    else:
+        jobs = [(path, _get_worker_config(config), features, methods)
+                for path in files]
+    for result in _imap(_compute_statistics_worker, jobs, processes,
+                        memory_limit):
+        yield result
+
+
+def iter_statistics_sweep(files, configs, features, methods, processes=1,
+                          memory_limit=None):
+    """Compute the statistics of measurement files for several filters
+
+    Parameters
+    ----------
+    configs: list of dict-like
+        Configurations with the "filtering" section to apply
+
+    Other Parameters
+    ----------------
+    files, features, methods, processes, memory_limit:
+        See `iter_statistics`
+
+    Yields
+    ------
+    results:
+        See `compute_statistics_sweep`; in the order of `files`
+    """
+    if processes > 1:
+        configs = [_get_worker_config(cfg) for cfg in configs]
+    jobs = [(path, configs, features, methods) for path in files]
+    for result in _imap(_compute_statistics_sweep_worker, jobs, processes,
+                        memory_limit):
+        yield result
+
+
+def _get_worker_config(config):
+    """Return the sections of `config` used by the worker processes"""
+    # Only the sections used by `analysis.Analysis.SetParameters`
+    # are passed to the workers (as plain dictionaries).
+    cfg = {}
+    for sec in CONFIG_SECTIONS:
+        if sec in config:
+            cfg[sec] = dict(config[sec])
+    return cfg
+
+
+def _imap(func, jobs, processes, memory_limit):
+    """Yield `func(job)` for all `jobs` (in order) using a process pool"""
+    if not jobs:
+        return
+    elif processes <= 1:
+        for job in jobs:
+            yield func(job)
+        return
+    mppool = mp.Pool(processes=processes,
+                     initializer=pool.init_worker,
+                     initargs=(pool.get_polygon_definitions(),
+                               memory_limit))
+    try:
+        # `imap` returns the results in the order of `jobs`
+        for result in mppool.imap(func, jobs):
+            yield result
+        mppool.close()
+    finally:
+        mppool.terminate()
+        mppool.join()
+
+
+def _compute_statistics_worker(args):
+    """Compute statistics in a worker process (see `iter_statistics`)"""
+    path = args[0]
+    try:
+        return compute_statistics(*args)
+    except MemoryError:
+        raise MemoryError("Memory limit exceeded for {}".format(path))
+
+
+def _compute_statistics_sweep_worker(args):
+    """Compute sweep statistics in a worker process
+
+    See `iter_statistics_sweep`.
+    """
+    path = args[0]
+    try:
+        return compute_statistics_sweep(*args)
+    except MemoryError:
+        raise MemoryError("Memory limit exceeded for {}".format(path))
+
+
+def format_header(head):
+    """Format the header line of batch statistics (without newline)"""
+    head = ["data file", "Title"] + head
+    return "# " + "\t".join(head)
+
+
+def format_row(row, ntext=2):
+    """Format a row of batch statistics (measurement path, title, values)
+
+    The first `ntext` entries of `row` are formatted as text.
+    """
+    path = row[0]
+    if isinstance(path, pathlib.Path):
+        path = str(path)
+    if isinstance(path, bytes):
+        path = path.decode("utf-8")
+    fmt = ["{:s}"]*ntext+["{:.10e}"]*(len(row) - ntext)
+    return "\t".join(fmt).format(path, *row[1:])
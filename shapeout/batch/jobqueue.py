@@ -0,0 +1,457 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - file system job queue for distributed batch filtering
+
+A coordinator submits one job per measurement to a queue directory
+on a shared file system. Workers on any machine with access to the
+directory claim jobs by moving them from "todo" to "claimed" (the
+atomic `os.rename` guarantees that each job is claimed by exactly
+one worker) and store their results in "done". The coordinator
+merges the results into the final .tsv file.
+
+Queue directory layout::
+
+    queue.json               run definition (filters, features, methods)
+    todo/N.json              jobs waiting for a worker
+    claimed/N.WORKER.json    jobs being processed by the worker WORKER
+    done/N.json              results
+    failed/N.json            jobs that raised an exception
+"""
+from __future__ import division, print_function, unicode_literals
+
+import io
+import json
+import multiprocessing as mp
+import os
+import pathlib
+import re
+import socket
+import time
+import traceback
+
+from ..util import close_inherited_h5files
+from . import core, pool
+
+
+#: version of the queue directory format
+QUEUE_VERSION = 1
+
+#: subdirectories for the job states
+STATES = ["todo", "claimed", "done", "failed"]
+
+
+class JobQueueError(BaseException):
+    pass
+
+
+class JobQueue(object):
+    def __init__(self, directory):
+        """File system job queue for batch filtering
+
+        Parameters
+        ----------
+        directory: str
+            Queue directory; must be accessible by all workers.
+        """
+        self.directory = pathlib.Path(directory)
+
+    def _path(self, state, name=""):
+        return self.directory / state / name
+
+    def claim(self, worker=None):
+        """Claim the next job
+
+        Parameters
+        ----------
+        worker: str or None
+            Identifier of the worker written to the claimed job;
+            defaults to "hostname:pid".
+
+        Returns
+        -------
+        job: dict or None
+            The job ("index" and "path" of the measurement) or
+            `None` if there are no jobs left.
+        """
+        if worker is None:
+            worker = get_worker_id()
+        for name in self._list("todo"):
+            job = {"index": _get_job_index(name), "worker": worker}
+            claimed = self._get_claimed_path(job)
+            try:
+                os.rename(str(self._path("todo", name)), str(claimed))
+            except OSError:
+                # claimed by another worker
+                continue
+            # The modification time is the time of the claim
+            # (see `requeue_stale`).
+            os.utime(str(claimed), None)
+            job = _read_json(claimed)
+            job["worker"] = worker
+            job["claimed"] = time.time()
+            return job
+        return None
+
+    def complete(self, job, head, row):
+        """Store the result of a job
+
+        Parameters
+        ----------
+        job: dict
+            The job returned by `claim`
+        head, row:
+            The result of `core.compute_statistics`
+
+        Returns
+        -------
+        completed: bool
+            `False` if the job was requeued in the meantime (see
+            `requeue_stale`); the result is then discarded and the
+            job is processed again.
+        """
+        claimed = self._get_claimed_path(job)
+        if not claimed.exists():
+            return False
+        result = dict(job)
+        result["head"] = head
+        result["title"] = row[1]
+        result["values"] = [float(v) for v in row[2:]]
+        _write_json(self._path("done", _get_job_name(job)), result)
+        _remove(claimed)
+        return True
+
+    def fail(self, job, message):
+        """Mark a job as failed
+
+        Parameters
+        ----------
+        job: dict
+            The job returned by `claim`
+        message: str
+            Error message (e.g. the traceback)
+
+        Returns
+        -------
+        failed: bool
+            `False` if the job was requeued in the meantime (see
+            `complete`)
+        """
+        claimed = self._get_claimed_path(job)
+        if not claimed.exists():
+            return False
+        result = dict(job)
+        result["error"] = message
+        _write_json(self._path("failed", _get_job_name(job)), result)
+        _remove(claimed)
+        return True
+
+    def get_run(self):
+        """Return the run definition written by `submit`"""
+        path = self.directory / "queue.json"
+        if not path.exists():
+            raise JobQueueError("No job queue in {}!".format(self.directory))
+        run = _read_json(path)
+        if run["version"] != QUEUE_VERSION:
+            raise JobQueueError("Unsupported job queue version: {}".format(
+                run["version"]))
+        return run
+
+    def merge(self, out_tsv):
+        """Merge the results of all jobs into a .tsv file
+
+        Raises `JobQueueError` if there are unfinished or failed jobs.
+        The rows are written in the order of the submitted files.
+        """
+        status = self.status()
+        if status["failed"]:
+            failed = [_read_json(self._path("failed", name))
+                      for name in self._list("failed")]
+            raise JobQueueError("Failed jobs:\n" + "\n".join(
+                ["{}: {}".format(ff["path"], ff["error"]) for ff in failed]))
+        if status["todo"] or status["claimed"]:
+            raise JobQueueError("There are unfinished jobs!")
+        head = None
+        with io.open(str(out_tsv), "wb") as fd:
+            for name in self._list("done"):
+                res = _read_json(self._path("done", name))
+                if head is None:
+                    head = res["head"]
+                    header = core.format_header(head)
+                    fd.write(header.encode("utf-8") + b"\n")
+                else:
+                    assert res["head"] == head, \
+                        "Problem with methods/features!"
+                row = [res["path"], res["title"]] + res["values"]
+                fd.write(core.format_row(row).encode("utf-8") + b"\n")
+
+    def requeue_stale(self, timeout):
+        """Move jobs claimed more than `timeout` seconds ago back to "todo"
+
+        Use this to recover jobs of workers that crashed. Returns
+        the number of requeued jobs.
+        """
+        count = 0
+        now = time.time()
+        for name in self._list("claimed"):
+            try:
+                mtime = self._path("claimed", name).stat().st_mtime
+            except OSError:
+                # completed or requeued in the meantime
+                continue
+            if now - mtime > timeout:
+                count += self._requeue(name)
+        return count
+
+    def requeue_worker(self, worker):
+        """Move the jobs claimed by `worker` back to "todo"
+
+        Use this to recover the jobs of a worker that is known to
+        have crashed. Returns the number of requeued jobs.
+        """
+        suffix = ".{}.json".format(_get_worker_name(worker))
+        count = 0
+        for name in self._list("claimed"):
+            if name.endswith(suffix):
+                count += self._requeue(name)
+        return count
+
+    def status(self):
+        """Return the number of jobs in each state as a dict"""
+        return dict([(st, len(self._list(st))) for st in STATES])
+
+    def submit(self, files, config, features, methods):
+        """Create the queue and submit one job for each measurement
+
+        Parameters
+        ----------
+        files: list of str
+            Measurement files; the paths must be valid for all workers.
+        config: dict-like
+            Configuration with the "filtering" section to apply
+        features, methods:
+            See `core.compute_statistics`
+
+        Notes
+        -----
+        The polygon filters referenced by `config` are stored in the
+        queue. An existing queue in the directory is replaced.
+        """
+        if (self.directory / "queue.json").exists():
+            _remove(self.directory / "queue.json")
+        for st in STATES:
+            path = self._path(st)
+            if path.exists():
+                for name in self._list(st):
+                    _remove(path / name)
+            else:
+                path.mkdir(parents=True)
+        for ii, path in enumerate(files):
+            job = {"index": ii, "path": "{}".format(path)}
+            _write_json(self._path("todo", _get_job_name(job)), job)
+        # The run definition is written last; workers do not start
+        # before the queue is complete.
+        run = {"version": QUEUE_VERSION,
+               "config": core._get_worker_config(config),
+               "polygons": pool.get_polygon_definitions(),
+               "features": list(features),
+               "methods": list(methods),
+               }
+        _write_json(self.directory / "queue.json", run)
+
+    def _get_claimed_path(self, job):
+        worker = _get_worker_name(job["worker"])
+        return self._path("claimed", "{:08d}.{}.json".format(job["index"],
+                                                             worker))
+
+    def _list(self, state):
+        path = self._path(state)
+        if not path.exists():
+            return []
+        return sorted([pp.name for pp in path.iterdir()
+                       if pp.suffix == ".json"])
+
+    def _requeue(self, name):
+        """Move the claimed job file `name` back to "todo"
+
+        Returns `False` if the job was completed or requeued
+        in the meantime.
+        """
+        todo = self._path("todo", _get_job_name(
+            {"index": _get_job_index(name)}))
+        try:
+            os.rename(str(self._path("claimed", name)), str(todo))
+        except OSError:
+            return False
+        return True
+
+
+def batch_filter_queue(files, config, features, methods, out_tsv,
+                       directory, processes=1, poll=1, stale=None,
+                       timeout=None):
+    """Batch filtering with workers on several machines
+
+    Parameters
+    ----------
+    files, config, features, methods, out_tsv:
+        See `core.batch_filter`
+    directory: str
+        Queue directory on a file system shared with the workers
+        (see `run_worker`)
+    processes: int
+        Number of local worker processes; if set to 0, all jobs
+        are processed by external workers.
+    poll: float
+        Interval for checking the queue [s]
+    stale: float or None
+        Requeue jobs claimed more than `stale` seconds ago
+        (e.g. by a crashed worker)
+    timeout: float or None
+        Raise `JobQueueError` if the jobs are not completed
+        within `timeout` seconds.
+
+    Notes
+    -----
+    If a local worker process crashes, its jobs are moved back
+    to "todo" and `JobQueueError` is raised.
+    """
+    if not files:
+        raise ValueError("No valid measurements with current selection!")
+    jq = JobQueue(directory)
+    jq.submit(files=files, config=config, features=features, methods=methods)
+    workers = []
+    for _ in range(processes):
+        proc = mp.Process(target=_run_local_worker, args=(directory,))
+        proc.daemon = True
+        proc.start()
+        workers.append(proc)
+    t0 = time.time()
+    try:
+        while True:
+            status = jq.status()
+            if not status["todo"] and not status["claimed"]:
+                break
+            if timeout is not None and time.time() - t0 > timeout:
+                raise JobQueueError("Timeout while waiting for workers!")
+            for proc in workers:
+                if proc.exitcode:
+                    worker = "{}:{}".format(socket.gethostname(), proc.pid)
+                    jq.requeue_worker(worker)
+                    raise JobQueueError("Local worker {} exited with code "
+                                        "{}!".format(worker, proc.exitcode))
+            if stale is not None:
+                jq.requeue_stale(stale)
+            time.sleep(poll)
+    finally:
+        for proc in workers:
+            proc.join(1)
+            if proc.is_alive():
+                proc.terminate()
+    jq.merge(out_tsv)
+
+
+def get_worker_id():
+    """Return an identifier of the current process ("hostname:pid")"""
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def run_worker(directory, worker=None, memory_limit=None, wait=0, poll=1):
+    """Process jobs of a queue until no jobs are left
+
+    Parameters
+    ----------
+    directory: str
+        Queue directory (see `batch_filter_queue`)
+    worker: str or None
+        Identifier of the worker; defaults to "hostname:pid"
+    memory_limit: int or None
+        Maximum memory of the worker process [MB]
+    wait: float
+        Keep polling the queue for new jobs for `wait` seconds
+        after the queue became empty.
+    poll: float
+        Interval for polling the queue [s]
+
+    Returns
+    -------
+    count: int
+        Number of processed jobs
+    """
+    jq = JobQueue(directory)
+    run = jq.get_run()
+    if memory_limit is not None:
+        pool.set_memory_limit(memory_limit)
+    pool.set_polygon_definitions(run["polygons"])
+    count = 0
+    idle = None
+    while True:
+        job = jq.claim(worker)
+        if job is None:
+            if idle is None:
+                idle = time.time()
+            if time.time() - idle >= wait:
+                break
+            time.sleep(poll)
+            continue
+        idle = None
+        try:
+            head, row = core.compute_statistics(job["path"],
+                                                run["config"],
+                                                run["features"],
+                                                run["methods"])
+        except BaseException as exc:
+            jq.fail(job, traceback.format_exc())
+            if isinstance(exc, (KeyboardInterrupt, SystemExit)):
+                raise
+        else:
+            jq.complete(job, head, row)
+        count += 1
+    return count
+
+
+def _get_job_index(name):
+    """Return the job index of a file name in the queue"""
+    return int(name.split(".")[0])
+
+
+def _get_job_name(job):
+    return "{:08d}.json".format(job["index"])
+
+
+def _get_worker_name(worker):
+    """Return the worker identifier as used in file names"""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", worker)
+
+
+def _read_json(path):
+    with io.open(str(path), "r", encoding="utf-8") as fd:
+        return json.load(fd)
+
+
+def _remove(path):
+    try:
+        path.unlink()
+    except OSError:
+        pass
+
+
+def _run_local_worker(directory):
+    """Run a worker in a process started by `batch_filter_queue`"""
+    close_inherited_h5files()
+    run_worker(directory)
+
+
+def _write_json(path, data):
+    """Atomically write `data` to `path` (readers never see partial files)"""
+    tmp = path.with_name(".{}.{}.{}.tmp".format(path.name,
+                                                socket.gethostname(),
+                                                os.getpid()))
+    with io.open(str(tmp), "w", encoding="utf-8") as fd:
+        fd.write("{}".format(json.dumps(data)))
+        fd.flush()
+        os.fsync(fd.fileno())
+    try:
+        os.rename(str(tmp), str(path))
+    except OSError:
+        # Windows does not replace existing files
+        _remove(path)
+        os.rename(str(tmp), str(path))
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - checkpoint journal for resumable batch runs"""
+from __future__ import division, print_function, unicode_literals
+
+import io
+import json
+import os
+import pathlib
+
+
+#: version of the journal file format
+JOURNAL_VERSION = 1
+
+
+class BatchResumeError(BaseException):
+    pass
+
+
+class BatchJournal(object):
+    def __init__(self, path, key, resume=False):
+        """Journal of the measurements completed in a batch run
+
+        The journal is a text file with one JSON object per line.
+        The first line identifies the batch run, each following
+        line records a completed measurement (path and hash) and
+        the size of the output file after its row was written.
+
+        Parameters
+        ----------
+        path: str
+            Path of the journal file
+        key: str
+            Identifier of the batch run (e.g. a hash of the filter
+            configuration, features, and statistical methods)
+        resume: bool
+            If set to `True`, continue the journal in `path`;
+            raises `BatchResumeError` if it belongs to a different
+            batch run. If set to `False`, a new journal is started.
+        """
+        self.path = pathlib.Path(path)
+        self.key = key
+        #: completed measurements {path: hash}
+        self.done = {}
+        #: size of the output file including all completed rows
+        self.offset = 0
+        if resume and self.path.exists():
+            self._load()
+        else:
+            self._write_line({"version": JOURNAL_VERSION, "key": key},
+                             mode="w")
+
+    def _load(self):
+        with io.open(str(self.path), "r", encoding="utf-8") as fd:
+            lines = fd.readlines()
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # incomplete line of an interrupted write
+                break
+        if not entries or entries[0].get("key") != self.key:
+            raise BatchResumeError("The journal {} belongs to a ".format(
+                self.path) + "different batch run!")
+        for entry in entries[1:]:
+            self.done[entry["path"]] = entry["hash"]
+            self.offset = entry["offset"]
+        # remove incomplete lines
+        with io.open(str(self.path), "w", encoding="utf-8") as fd:
+            for entry in entries:
+                fd.write(json.dumps(entry) + "\n")
+
+    def _write_line(self, entry, mode="a"):
+        with io.open(str(self.path), mode, encoding="utf-8") as fd:
+            fd.write(json.dumps(entry) + "\n")
+            fd.flush()
+            os.fsync(fd.fileno())
+
+    def add(self, path, dhash, offset):
+        """Record a completed measurement
+
+        Parameters
+        ----------
+        path: str
+            Path of the measurement file
+        dhash: str
+            Hash of the measurement
+        offset: int
+            Size of the output file after the row of the
+            measurement was written
+        """
+        path = "{}".format(path)
+        self._write_line({"path": path, "hash": dhash, "offset": offset})
+        self.done[path] = dhash
+        self.offset = offset
+
+    def remove(self):
+        """Delete the journal file (once the batch run is complete)"""
+        if self.path.exists():
+            self.path.unlink()
+
+    def is_done(self, path, dhash):
+        """Return `True` if the measurement was already completed
+
+        Raises `BatchResumeError` if the measurement was completed
+        but modified since.
+        """
+        path = "{}".format(path)
+        if path not in self.done:
+            return False
+        elif self.done[path] != dhash:
+            raise BatchResumeError("The measurement {} was ".format(path) +
+                                   "modified since the interrupted batch run!")
+        return True
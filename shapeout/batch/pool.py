@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - worker processes for batch filtering"""
+from __future__ import division, print_function, unicode_literals
+
+import warnings
+
+from dclab.polygon_filter import PolygonFilter
+
+from ..util import close_inherited_h5files
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+class MemoryLimitWarning(UserWarning):
+    pass
+
+
+def get_polygon_definitions():
+    """Return the registered polygon filters as a list of dicts
+
+    The definitions can be pickled and passed to worker processes
+    which do not inherit `PolygonFilter.instances` (e.g. on Windows).
+    """
+    defs = []
+    for pf in PolygonFilter.instances:
+        defs.append({"axes": list(pf.axes),
+                     "points": pf.points.tolist(),
+                     "inverted": pf.inverted,
+                     "name": pf.name,
+                     "unique_id": pf.unique_id,
+                     })
+    return defs
+
+
+def set_polygon_definitions(definitions):
+    """Replace the registered polygon filters with `definitions`
+
+    See Also
+    --------
+    get_polygon_definitions: the inverse of this function
+    """
+    PolygonFilter.clear_all_filters()
+    for kw in definitions:
+        PolygonFilter(**kw)
+
+
+def set_memory_limit(memory_limit):
+    """Limit the address space of the current process
+
+    Parameters
+    ----------
+    memory_limit: int or None
+        Maximum memory [MB]; `None` removes the limit.
+        Exceeding the limit raises a `MemoryError`.
+
+    Notes
+    -----
+    The limit can only be set on Unix systems. On other systems,
+    a `MemoryLimitWarning` is issued.
+    """
+    if resource is None:
+        warnings.warn("Cannot limit memory on this platform!",
+                      MemoryLimitWarning)
+        return
+    if memory_limit is None:
+        limit = resource.RLIM_INFINITY
+    else:
+        limit = int(memory_limit * 1024**2)
+    _soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY and (limit == resource.RLIM_INFINITY
+                                           or limit > hard):
+        limit = hard
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def init_worker(polygon_definitions, memory_limit):
+    """Initializer of batch worker processes"""
+    close_inherited_h5files()
+    set_memory_limit(memory_limit)
+    set_polygon_definitions(polygon_definitions)
@@ -0,0 +1,238 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - indexed key-value store for caches in the user cache dir"""
+from __future__ import division, print_function, unicode_literals
+
+import atexit
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+import appdirs
+
+
+#: number of access times kept in memory before they are written
+ACCESS_BATCH_SIZE = 100
+
+#: number of `CacheStore.set` calls between two checks of `max_entries`
+TRIM_INTERVAL = 100
+
+#: long-lived stores shared by all threads {(pid, name, dir): store}
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class CacheStore(object):
+    def __init__(self, name, directory=None, max_entries=None,
+                 trim_interval=TRIM_INTERVAL):
+        """Persistent key-value cache based on SQLite
+
+        Values are stored as JSON. Lookups use the primary key
+        index of the database, updates are atomic transactions, and
+        several processes may access the same cache. An instance
+        may be shared by threads (see `get_store`).
+
+        Parameters
+        ----------
+        name: str
+            File name of the database
+        directory: str or None
+            Directory of the database; defaults to the user
+            cache directory.
+        max_entries: int or None
+            Maximum number of entries; the least recently used
+            entries are removed every `trim_interval` calls of
+            `set` and when the store is closed.
+        trim_interval: int
+            Number of `set` calls between two checks of
+            `max_entries`
+
+        Notes
+        -----
+        Use `get_stat_key` for keys that become invalid when a file
+        is modified.
+
+        Lookups do not write to the database; the access times (for
+        removing the least recently used entries) are kept in memory
+        and written in batches of `ACCESS_BATCH_SIZE`, with `set`,
+        and when the store is closed.
+        """
+        if directory is None:
+            directory = appdirs.user_cache_dir()
+        directory = pathlib.Path(directory)
+        if not directory.exists():
+            directory.mkdir(parents=True)
+        self.path = directory / name
+        self.max_entries = max_entries
+        self.trim_interval = trim_interval
+        #: access times not yet written {key: time}
+        self._accessed = {}
+        #: number of `set` calls since the last trim
+        self._sets = 0
+        self._lock = threading.RLock()
+        self._con = sqlite3.connect(str(self.path), timeout=60,
+                                    check_same_thread=False)
+        exists = self._con.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND "
+            "name='entries'").fetchone()
+        if not exists:
+            with self._con:
+                self._con.execute("CREATE TABLE IF NOT EXISTS entries ("
+                                  "key TEXT PRIMARY KEY, "
+                                  "value TEXT, "
+                                  "accessed REAL)")
+                self._con.execute("CREATE INDEX IF NOT EXISTS "
+                                  "entries_accessed ON entries (accessed)")
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._con.execute("SELECT 1 FROM entries WHERE key=?",
+                                     (key,)).fetchone() is not None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute(
+                "SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self.max_entries is not None and self._sets:
+                self._trim()
+            self._con.close()
+
+    def delete(self, key):
+        """Remove an entry (does nothing if `key` is not in the cache)"""
+        with self._lock, self._con:
+            self._con.execute("DELETE FROM entries WHERE key=?", (key,))
+
+    def flush(self):
+        """Write the access times of the entries read with `get`"""
+        with self._lock:
+            if self._accessed:
+                with self._con:
+                    self._con.executemany(
+                        "UPDATE entries SET accessed=? WHERE key=?",
+                        [(tt, kk) for kk, tt in self._accessed.items()])
+                self._accessed.clear()
+
+    def get(self, key):
+        """Return the value of `key`
+
+        Raises `KeyError` if `key` is not in the cache.
+        """
+        with self._lock:
+            res = self._con.execute("SELECT value FROM entries WHERE key=?",
+                                    (key,)).fetchone()
+            if res is None:
+                raise KeyError("Cache key `{}` not set!".format(key))
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= ACCESS_BATCH_SIZE:
+                self.flush()
+        return json.loads(res[0])
+
+    def prune(self, max_age=None, max_entries=None):
+        """Remove cache entries
+
+        Parameters
+        ----------
+        max_age: float or None
+            Remove entries that have not been accessed for
+            `max_age` seconds.
+        max_entries: int or None
+            Remove the least recently used entries until at most
+            `max_entries` entries are left.
+
+        Returns
+        -------
+        removed: int
+            Number of removed entries
+        """
+        with self._lock:
+            self.flush()
+            size0 = len(self)
+            with self._con:
+                if max_age is not None:
+                    self._con.execute("DELETE FROM entries WHERE accessed<?",
+                                      (time.time() - max_age,))
+                if max_entries is not None:
+                    self._con.execute(
+                        "DELETE FROM entries WHERE key IN (SELECT key FROM "
+                        "entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                        (max_entries,))
+            return size0 - len(self)
+
+    def set(self, key, value):
+        """Set the value of `key` (must be JSON-serializable)"""
+        data = json.dumps(value)
+        with self._lock:
+            self._accessed.pop(key, None)
+            with self._con:
+                self._con.execute("INSERT OR REPLACE INTO entries VALUES "
+                                  "(?, ?, ?)", (key, data, time.time()))
+            self._sets += 1
+            if (self.max_entries is not None and
+                    self._sets >= self.trim_interval):
+                self._trim()
+
+    def _trim(self):
+        """Remove the least recently used entries (`max_entries`)"""
+        self._sets = 0
+        if len(self) > self.max_entries:
+            self.prune(max_entries=self.max_entries)
+
+
+def get_store(name, directory=None, max_entries=None):
+    """Return a long-lived `CacheStore` shared by all threads
+
+    Repeated calls with the same `name` and `directory` return the
+    same instance (`max_entries` of the first call applies), which
+    avoids opening the database for every lookup and enforces
+    `max_entries` across threads. The store must not be closed by
+    the caller; it is closed when the interpreter exits.
+    """
+    # child processes must not use the connections of their parent
+    key = (os.getpid(), name, str(directory))
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = CacheStore(name=name,
+                                      directory=directory,
+                                      max_entries=max_entries)
+        return _stores[key]
+
+
+@atexit.register
+def _close_stores():
+    """Close the stores of `get_store` (writes the access times)"""
+    with _stores_lock:
+        for key in list(_stores.keys()):
+            if key[0] == os.getpid():
+                try:
+                    _stores.pop(key).close()
+                except sqlite3.Error:
+                    # e.g. cache directory removed
+                    pass
+
+
+def get_stat_key(path):
+    """Return a cache key for a file
+
+    The key consists of the absolute path, the size, and the
+    modification time of the file and thus changes when the
+    file is modified. Only the file system meta data are read.
+    """
+    path = pathlib.Path(path).resolve()
+    stat = path.stat()
+    spath = str(path)
+    if isinstance(spath, bytes):
+        spath = spath.decode("utf-8")
+    return "{}|{}|{!r}".format(spath, stat.st_size, stat.st_mtime)
@@ -0,0 +1 @@
+from . import avi, chunks, manifest, parquet, rtdc, tsv  # noqa: F401
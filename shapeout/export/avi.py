@@ -0,0 +1,309 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - export of event images to .avi files
+
+Frames are decoded in batches in a worker thread while the main
+thread feeds the encoder (ffmpeg, running in a separate process).
+Several measurements are exported in parallel processes.
+"""
+from __future__ import division, print_function, unicode_literals
+
+import multiprocessing as mp
+import pathlib
+import sys
+import threading
+import traceback
+import warnings
+
+import imageio
+import numpy as np
+
+import dclab
+from dclab.rtdc_dataset.export import NoImageWarning
+from dclab.rtdc_dataset.fmt_hierarchy import (RTDC_Hierarchy,
+                                              map_indices_child2root)
+
+from ..util import close_inherited_h5files
+
+if sys.version_info[0] == 2:
+    import Queue as queue
+else:
+    import queue
+
+
+#: number of frames decoded at once
+BATCH_SIZE = 64
+
+#: number of decoded batches buffered for the encoder
+BATCH_BUFFER = 4
+
+#: RGB color of the contour overlay
+CONTOUR_COLOR = (255, 0, 0)
+
+
+class FrameDecodeError(BaseException):
+    """Decoding frames failed (contains the decoder traceback)"""
+    pass
+
+
+def export_avi(path, rtdc_ds, filtered=True, override=False, contour=False,
+               batch_size=BATCH_SIZE, fps=25):
+    """Export event images of a data set to an .avi file
+
+    Parameters
+    ----------
+    path: str
+        Path to the output file. The extension ".avi" is
+        added automatically.
+    rtdc_ds: dclab.rtdc_dataset.RTDCBase
+        The data set to export
+    filtered: bool
+        If set to `True`, only the images of filtered events
+        are exported.
+    override: bool
+        If set to `True`, an existing file `path` will be overridden.
+        If set to `False`, raises `OSError` if `path` exists.
+    contour: bool
+        If set to `True`, the event contours are drawn on top
+        of the images.
+    batch_size: int
+        Number of frames decoded at once by the worker thread
+    fps: int
+        Frame rate of the video
+
+    Returns
+    -------
+    path: pathlib.Path
+        The path of the exported file
+
+    Notes
+    -----
+    Raises `OSError` if the data set does not contain image data.
+    The video is encoded like `RTDCBase.export.avi`.
+    """
+    if filtered:
+        index = np.where(rtdc_ds.filter.all)[0]
+    else:
+        index = np.arange(len(rtdc_ds))
+    return _export_avi_index(path=path,
+                             rtdc_ds=rtdc_ds,
+                             index=index,
+                             override=override,
+                             contour=contour,
+                             batch_size=batch_size,
+                             fps=fps)
+
+
+def export_avi_many(directory, rtdc_list, filtered=True, override=False,
+                    contour=False, batch_size=BATCH_SIZE, fps=25,
+                    processes=None):
+    """Export event images of several data sets to .avi files
+
+    Parameters
+    ----------
+    directory: str
+        Output directory; the files are named after the data
+        set titles.
+    rtdc_list: list of dclab.rtdc_dataset.RTDCBase
+        The data sets to export
+    processes: int or None
+        Number of parallel processes; defaults to the number
+        of CPUs.
+
+    Other Parameters
+    ----------------
+    filtered, override, contour, batch_size, fps:
+        See `export_avi`
+
+    Returns
+    -------
+    paths: list of pathlib.Path
+        The paths of the exported files (same order as `rtdc_list`)
+
+    Notes
+    -----
+    Data sets stored on disk (including hierarchy children of such
+    data sets) are opened again in the worker processes. All other
+    data sets are exported in the current process.
+    """
+    directory = pathlib.Path(directory)
+    if processes is None:
+        processes = mp.cpu_count()
+    jobs = []
+    local = []
+    for ii, rtdc_ds in enumerate(rtdc_list):
+        path = directory / (rtdc_ds.title + ".avi")
+        if filtered:
+            index = np.where(rtdc_ds.filter.all)[0]
+        else:
+            index = np.arange(len(rtdc_ds))
+        source = _get_file_source(rtdc_ds, index)
+        if source is None:
+            local.append((ii, path, rtdc_ds, index))
+        else:
+            jobs.append((ii, (str(path), source[0], source[1], override,
+                              contour, batch_size, fps)))
+
+    paths = [None] * len(rtdc_list)
+    if jobs:
+        pool = mp.Pool(processes=max(1, min(processes, len(jobs))),
+                       initializer=close_inherited_h5files)
+        try:
+            results = pool.map_async(_export_avi_worker,
+                                     [jj[1] for jj in jobs])
+            # export the other data sets while the pool is busy
+            for ii, path, rtdc_ds, index in local:
+                paths[ii] = _export_avi_index(path=path,
+                                              rtdc_ds=rtdc_ds,
+                                              index=index,
+                                              override=override,
+                                              contour=contour,
+                                              batch_size=batch_size,
+                                              fps=fps)
+            # large timeout allows KeyboardInterrupt in Python 2
+            for (ii, _), res in zip(jobs, results.get(timeout=2**31)):
+                paths[ii] = pathlib.Path(res)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for ii, path, rtdc_ds, index in local:
+            paths[ii] = _export_avi_index(path=path,
+                                          rtdc_ds=rtdc_ds,
+                                          index=index,
+                                          override=override,
+                                          contour=contour,
+                                          batch_size=batch_size,
+                                          fps=fps)
+    return paths
+
+
+def _export_avi_index(path, rtdc_ds, index, override, contour, batch_size,
+                      fps):
+    """Export the images of the events `index` of `rtdc_ds`"""
+    path = pathlib.Path(path)
+    if path.suffix != ".avi":
+        path = path.with_name(path.name + ".avi")
+    if not override and path.exists():
+        raise OSError("File already exists: {}\n".format(
+            str(path).encode("ascii", "ignore")) +
+            "Please use the `override=True` option.")
+    if "image" not in rtdc_ds:
+        msg = "No image data to export: dataset {} !".format(rtdc_ds.title)
+        raise OSError(msg)
+    if contour and "contour" not in rtdc_ds:
+        contour = False
+
+    batches = queue.Queue(maxsize=BATCH_BUFFER)
+    stop = threading.Event()
+    decoder = threading.Thread(target=_decode_batches,
+                               args=(rtdc_ds, index, contour, batch_size,
+                                     batches, stop))
+    decoder.daemon = True
+    decoder.start()
+
+    vout = imageio.get_writer(uri=str(path),
+                              format="FFMPEG",
+                              fps=fps,
+                              codec="rawvideo",
+                              pixelformat="yuv420p",
+                              macro_block_size=None,
+                              ffmpeg_log_level="error")
+    try:
+        while True:
+            batch = batches.get()
+            if batch is None:
+                break
+            elif isinstance(batch, FrameDecodeError):
+                # exception in decoder thread
+                raise batch
+            for frame in batch:
+                vout.append_data(frame)
+    finally:
+        stop.set()
+        vout.close()
+        decoder.join()
+    return path
+
+
+def _decode_batches(rtdc_ds, index, contour, batch_size, batches, stop):
+    """Decode RGB frames in batches and put them in the queue `batches`
+
+    The batch `None` marks the end of the data; exceptions are
+    passed on as `FrameDecodeError` with the formatted traceback.
+    """
+    try:
+        image = rtdc_ds["image"]
+        for start in range(0, index.size, batch_size):
+            if stop.is_set():
+                return
+            stack = []
+            for evid in index[start:start + batch_size]:
+                try:
+                    frame = np.array(image[evid])
+                except BaseException:
+                    warnings.warn("Could not read image {}!".format(evid),
+                                  NoImageWarning)
+                    continue
+                if np.isnan(frame[0, 0]):
+                    # This is a nan-valued image
+                    frame = np.zeros_like(frame, dtype=np.uint8)
+                frame = np.repeat(frame.reshape(frame.shape[0],
+                                                frame.shape[1], 1),
+                                  3, axis=2).astype(np.uint8)
+                if contour:
+                    cont = np.asarray(rtdc_ds["contour"][evid], dtype=int)
+                    frame[cont[:, 1], cont[:, 0]] = CONTOUR_COLOR
+                stack.append(frame)
+            if stack:
+                _put(batches, np.array(stack), stop)
+    except BaseException:
+        msg = "Could not decode frames of {}:\n{}".format(
+            rtdc_ds.title, traceback.format_exc())
+        _put(batches, FrameDecodeError(msg), stop)
+    else:
+        _put(batches, None, stop)
+
+
+def _put(batches, item, stop):
+    """Put `item` in the queue unless the consumer stopped"""
+    while not stop.is_set():
+        try:
+            batches.put(item, timeout=.1)
+        except queue.Full:
+            pass
+        else:
+            break
+
+
+def _get_file_source(rtdc_ds, index):
+    """Return the file path and the event indices of the file data set
+
+    For hierarchy children, the root data set is used. Returns
+    `None` if the data are not stored in a file.
+    """
+    if isinstance(rtdc_ds, RTDC_Hierarchy):
+        root = rtdc_ds
+        while isinstance(root, RTDC_Hierarchy):
+            root = root.hparent
+        if index.size:
+            index = map_indices_child2root(rtdc_ds, index)
+    else:
+        root = rtdc_ds
+    if root.format not in ["hdf5", "tdms"]:
+        return None
+    return str(root.path), index
+
+
+def _export_avi_worker(args):
+    """Export an .avi file in a worker process (see `export_avi_many`)"""
+    path, source, index, override, contour, batch_size, fps = args
+    rtdc_ds = dclab.new_dataset(source)
+    path = _export_avi_index(path=path,
+                             rtdc_ds=rtdc_ds,
+                             index=index,
+                             override=override,
+                             contour=contour,
+                             batch_size=batch_size,
+                             fps=fps)
+    return str(path)
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - chunk-wise access to event data for export"""
+from __future__ import division, print_function, unicode_literals
+
+import numpy as np
+
+
+#: default number of events processed at once during export
+CHUNK_SIZE = 50000
+
+
+def get_feature_source(rtdc_ds, feature):
+    """Return a sliceable source of a scalar feature
+
+    For HDF5-based data sets, the h5py dataset is returned such
+    that only the requested slices are read from disk. For all
+    other data sets (and ancillary features), the in-memory
+    array of the data set is returned.
+    """
+    if rtdc_ds.format == "hdf5" and feature in rtdc_ds._events:
+        return rtdc_ds._events._h5["events"][feature]
+    else:
+        return rtdc_ds[feature]
+
+
+def iter_chunks(rtdc_ds, features, filtered=True, chunk_size=CHUNK_SIZE,
+                return_index=False):
+    """Iterate over the event data of a data set in chunks
+
+    Parameters
+    ----------
+    rtdc_ds: dclab.rtdc_dataset.RTDCBase
+        The data set from which to read the event data
+    features: list of str
+        Scalar features to read
+    filtered: bool
+        If set to `True`, only events that pass the filters
+        (``rtdc_ds.filter.all``) are returned.
+    chunk_size: int
+        Number of events (before filtering) in each chunk
+    return_index: bool
+        If set to `True`, the indices of the events in the chunk
+        are yielded as well.
+
+    Yields
+    ------
+    chunk: 2d ndarray of shape (N, len(features))
+        The event data of one chunk; N is at most `chunk_size`
+        (smaller if events were filtered out).
+    index: 1d ndarray of length N
+        The event indices of the chunk (only if `return_index`
+        is set); the tuple `(index, chunk)` is yielded.
+    """
+    size = len(rtdc_ds)
+    sources = [get_feature_source(rtdc_ds, ff) for ff in features]
+    if filtered:
+        filtarr = rtdc_ds.filter.all
+    for start in range(0, size, chunk_size):
+        stop = min(start + chunk_size, size)
+        chunk = np.zeros((stop - start, len(features)), dtype=float)
+        for ii, src in enumerate(sources):
+            chunk[:, ii] = src[start:stop]
+        index = np.arange(start, stop)
+        if filtered:
+            chunk = chunk[filtarr[start:stop]]
+            index = index[filtarr[start:stop]]
+        if chunk.shape[0]:
+            if return_index:
+                yield index, chunk
+            else:
+                yield chunk
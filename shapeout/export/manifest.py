@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - export manifest for incremental re-export
+
+The manifest is a JSON file stored next to the exported files. For
+each exported file it records the hash of the data set, the hash
+of the filter state (only for filtered exports), the exported
+features, and all other export options. A subsequent export only
+needs to rewrite files whose entries changed.
+"""
+from __future__ import division, print_function, unicode_literals
+
+import io
+import json
+import os
+import pathlib
+
+import numpy as np
+
+from dclab.rtdc_dataset.util import hashobj
+
+
+#: name of the manifest file in the export directory
+MANIFEST_NAME = "shapeout_export_manifest.json"
+
+#: manifest format version
+MANIFEST_VERSION = 1
+
+
+def filter_state_hash(rtdc_ds):
+    """Compute a hash of the current filter state of a data set
+
+    The hash is computed from the boolean array of events that pass
+    all filters (box, polygon, manual, hierarchy, event limit).
+    """
+    return hashobj(np.packbits(rtdc_ds.filter.all))
+
+
+class ExportManifest(object):
+    def __init__(self, directory):
+        """Manifest of exported files in a directory
+
+        Parameters
+        ----------
+        directory: str
+            The export directory; an existing manifest is loaded.
+        """
+        self.path = pathlib.Path(directory) / MANIFEST_NAME
+        self.files = {}
+        if self.path.exists():
+            try:
+                with io.open(str(self.path), "r", encoding="utf-8") as fd:
+                    data = json.load(fd)
+            except ValueError:
+                # broken manifest: export everything again
+                pass
+            else:
+                if data.get("version") == MANIFEST_VERSION:
+                    self.files = data["files"]
+
+    @staticmethod
+    def get_entry(rtdc_ds, features, filtered, options={}):
+        """Return the manifest entry for an export of a data set
+
+        Parameters
+        ----------
+        rtdc_ds: dclab.rtdc_dataset.RTDCBase
+            The exported data set
+        features: list of str
+            The exported features in the order of the exported
+            columns
+        filtered: bool
+            Whether only filtered events are exported; the filter
+            state is only part of the entry if this is `True`.
+        options: dict
+            Additional (format-specific) export options
+        """
+        entry = {"hash": rtdc_ds.hash,
+                 "features": list(features),
+                 "filtered": bool(filtered),
+                 "options": options,
+                 }
+        if filtered:
+            entry["filter hash"] = filter_state_hash(rtdc_ds)
+        # normalize (e.g. tuples vs. lists) for comparison
+        return json.loads(json.dumps(entry))
+
+    def is_current(self, name, entry):
+        """Check whether the file `name` is up-to-date with `entry`"""
+        return ((self.path.parent / name).exists() and
+                self.files.get(name) == entry)
+
+    def remove(self, name):
+        """Remove the entry of the file `name`"""
+        self.files.pop(name, None)
+
+    def save(self):
+        """Atomically write the manifest to disk"""
+        data = {"version": MANIFEST_VERSION,
+                "files": self.files}
+        text = json.dumps(data, indent=2, sort_keys=True)
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
+        temp = self.path.with_name(self.path.name + ".tmp")
+        with io.open(str(temp), "w", encoding="utf-8") as fd:
+            fd.write(text)
+        try:
+            os.rename(str(temp), str(self.path))
+        except OSError:
+            # Windows does not replace existing files
+            self.path.unlink()
+            os.rename(str(temp), str(self.path))
+
+    def update(self, name, entry):
+        """Set the entry of the file `name`"""
+        self.files[name] = entry
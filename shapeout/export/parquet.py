@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - columnar export of event data to Apache Parquet files"""
+from __future__ import division, print_function, unicode_literals
+
+import pathlib
+
+import numpy as np
+
+import dclab.definitions as dfn
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from .chunks import CHUNK_SIZE, iter_chunks
+
+
+#: default number of rows per Parquet row group
+ROW_GROUP_SIZE = 100000
+
+#: columns describing the measurement and filter state of each event
+META_COLUMNS = ["title", "hash", "event index", "filter"]
+
+
+def get_schema(features):
+    """Return the pyarrow schema for a list of scalar features"""
+    fields = [pa.field("title", pa.string()),
+              pa.field("hash", pa.string()),
+              pa.field("event index", pa.int64()),
+              pa.field("filter", pa.bool_()),
+              ]
+    for feat in features:
+        fields.append(pa.field(feat, pa.float64()))
+    return pa.schema(fields)
+
+
+def export_parquet(path, rtdc_list, features, filtered=True, override=False,
+                   chunk_size=CHUNK_SIZE, row_group_size=ROW_GROUP_SIZE,
+                   compression="snappy"):
+    """Export scalar event data of several data sets to a Parquet file
+
+    Parameters
+    ----------
+    path: str
+        Path to the output file. The extension ".parquet" is
+        added automatically.
+    rtdc_list: list of dclab.rtdc_dataset.RTDCBase
+        The data sets to export (all are written to the same file)
+    features: list of str
+        Scalar features to export, e.g. "area_um", "deform";
+        features not available in a data set are filled with NaN.
+    filtered: bool
+        If set to `True`, only the filtered events are exported.
+    override: bool
+        If set to `True`, an existing file `path` will be overridden.
+        If set to `False`, raises `OSError` if `path` exists.
+    chunk_size: int
+        Number of events read from a data set at once
+    row_group_size: int
+        Maximum number of rows in a Parquet row group; row groups
+        never span multiple data sets.
+    compression: str or None
+        Compression codec used by pyarrow, e.g. "snappy", "gzip",
+        "brotli", or None
+
+    Returns
+    -------
+    path: pathlib.Path
+        The path of the exported file
+
+    Notes
+    -----
+    Besides the features, the columns "title" and "hash" (identifying
+    the data set), "event index" (event index in the data set), and
+    "filter" (whether the event passes the filters of the data set)
+    are written. The name "event index" avoids a clash with the
+    dclab feature "index".
+    """
+    if pq is None:
+        raise ImportError("Parquet export requires the package `pyarrow`!")
+    features = [f.lower() for f in features]
+    for ff in features:
+        if ff not in dfn.scalar_feature_names:
+            raise ValueError("Unknown feature name {}".format(ff))
+        if ff in META_COLUMNS:
+            raise ValueError("Feature name {} is reserved".format(ff))
+    path = pathlib.Path(path)
+    if not path.name.endswith(".parquet"):
+        path = path.with_name(path.name + ".parquet")
+    if not override and path.exists():
+        raise OSError("File already exists: {}\n".format(
+            str(path).encode("ascii", "ignore")) +
+            "Please use the `override=True` option.")
+
+    schema = get_schema(features)
+    writer = pq.ParquetWriter(str(path), schema, compression=compression)
+    try:
+        for rtdc_ds in rtdc_list:
+            _write_dataset(writer=writer,
+                           schema=schema,
+                           rtdc_ds=rtdc_ds,
+                           features=features,
+                           filtered=filtered,
+                           chunk_size=chunk_size,
+                           row_group_size=row_group_size)
+    finally:
+        writer.close()
+    return path
+
+
+def _write_dataset(writer, schema, rtdc_ds, features, filtered, chunk_size,
+                   row_group_size):
+    """Write the events of one data set in row groups"""
+    avail = [f for f in features if f in rtdc_ds]
+    filtarr = rtdc_ds.filter.all
+    buf_index = []
+    buf_chunk = []
+    buf_size = 0
+    chunks = iter_chunks(rtdc_ds=rtdc_ds,
+                         features=avail,
+                         filtered=filtered,
+                         chunk_size=chunk_size,
+                         return_index=True)
+    for index, chunk in chunks:
+        buf_index.append(index)
+        buf_chunk.append(chunk)
+        buf_size += index.size
+        while buf_size >= row_group_size:
+            index = np.concatenate(buf_index)
+            chunk = np.concatenate(buf_chunk)
+            _write_rows(writer, schema, rtdc_ds, features, avail,
+                        index[:row_group_size],
+                        chunk[:row_group_size],
+                        filtarr)
+            buf_index = [index[row_group_size:]]
+            buf_chunk = [chunk[row_group_size:]]
+            buf_size -= row_group_size
+    if buf_size:
+        _write_rows(writer, schema, rtdc_ds, features, avail,
+                    np.concatenate(buf_index),
+                    np.concatenate(buf_chunk),
+                    filtarr)
+
+
+def _write_rows(writer, schema, rtdc_ds, features, avail, index, chunk,
+                filtarr):
+    """Write one row group"""
+    size = index.size
+    arrays = [pa.array([rtdc_ds.title] * size, type=pa.string()),
+              pa.array([rtdc_ds.hash] * size, type=pa.string()),
+              pa.array(index.astype(np.int64)),
+              pa.array(filtarr[index]),
+              ]
+    for feat in features:
+        if feat in avail:
+            data = chunk[:, avail.index(feat)]
+        else:
+            data = np.full(size, np.nan)
+        arrays.append(pa.array(data))
+    table = pa.Table.from_arrays(arrays, schema=schema)
+    writer.write_table(table, row_group_size=size)
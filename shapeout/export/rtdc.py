@@ -0,0 +1,304 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - export of event data to .rtdc (HDF5) files with a tunable
+storage layout (compression filter, level, and chunk shape)"""
+from __future__ import division, print_function, unicode_literals
+
+import pathlib
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+import dclab.definitions as dfn
+from dclab.rtdc_dataset.write_hdf5 import write
+
+
+#: compression filters supported by the exporter
+COMPRESSION_FILTERS = [None, "gzip", "lzf"]
+
+#: default number of events per chunk of non-scalar features
+CHUNK_EVENTS = 64
+
+#: default number of events per chunk of scalar features
+CHUNK_SCALAR = 100000
+
+#: storage layout presets (the keyword arguments of `export_rtdc`)
+PRESETS = {
+    # same layout as `RTDCBase.export.hdf5`
+    "default": {"compression": "gzip",
+                "compression_opts": None,
+                "shuffle": False,
+                "chunk_events": CHUNK_EVENTS},
+    # no compression, fastest write and read access
+    "none": {"compression": None,
+             "compression_opts": None,
+             "shuffle": False,
+             "chunk_events": CHUNK_EVENTS},
+    # fast compression, e.g. for exports on local disks
+    "fast": {"compression": "lzf",
+             "compression_opts": None,
+             "shuffle": True,
+             "chunk_events": CHUNK_EVENTS},
+    # smallest files, e.g. for copying across the network
+    "small": {"compression": "gzip",
+              "compression_opts": 9,
+              "shuffle": True,
+              "chunk_events": 256},
+    # one event per chunk, e.g. for browsing single events
+    "random access": {"compression": "gzip",
+                      "compression_opts": 1,
+                      "shuffle": False,
+                      "chunk_events": 1},
+}
+
+
+def export_rtdc(path, rtdc_ds, features, filtered=True, override=False,
+                compression="gzip", compression_opts=None, shuffle=False,
+                chunk_events=CHUNK_EVENTS, chunk_scalar=CHUNK_SCALAR):
+    """Export event data of a data set to an .rtdc file
+
+    Parameters
+    ----------
+    path: str
+        Path to the output file. The extension ".rtdc" is
+        added automatically.
+    rtdc_ds: dclab.rtdc_dataset.RTDCBase
+        The data set to export
+    features: list of str
+        Features to export, e.g. "area_um", "deform", "image",
+        "contour", "trace"; features not available in `rtdc_ds`
+        are ignored.
+    filtered: bool
+        If set to `True`, only the filtered events are exported.
+    override: bool
+        If set to `True`, an existing file `path` will be overridden.
+        If set to `False`, raises `OSError` if `path` exists.
+    compression: str or None
+        Compression filter; one of `COMPRESSION_FILTERS`
+    compression_opts: int or None
+        Compression level for "gzip" (0-9); `None` uses the
+        h5py default (4).
+    shuffle: bool
+        Enable the HDF5 byte-shuffle filter (improves compression
+        of numerical data).
+    chunk_events: int
+        Number of events per chunk of "image", "mask", and "trace"
+        data. Small values reduce the latency of reading single
+        events, large values improve compression.
+    chunk_scalar: int
+        Maximum number of events per chunk of scalar features
+
+    Returns
+    -------
+    path: pathlib.Path
+        The path of the exported file
+
+    Notes
+    -----
+    The resulting file has the same structure as the files written
+    by `RTDCBase.export.hdf5`; only the storage layout differs.
+    """
+    if compression not in COMPRESSION_FILTERS:
+        raise ValueError("`compression` must be one of {}".format(
+            COMPRESSION_FILTERS))
+    if compression_opts is not None and compression != "gzip":
+        raise ValueError("`compression_opts` is only supported for gzip")
+    if chunk_events < 1 or chunk_scalar < 1:
+        raise ValueError("Chunk sizes must be positive")
+    features = [f.lower() for f in features]
+    for ff in features:
+        if ff not in dfn.feature_names:
+            raise ValueError("Unknown feature name {}".format(ff))
+    path = pathlib.Path(path)
+    if path.suffix != ".rtdc":
+        path = path.with_name(path.name + ".rtdc")
+    if path.exists():
+        if not override:
+            raise OSError("File already exists: {}\n".format(
+                str(path).encode("ascii", "ignore")) +
+                "Please use the `override=True` option.")
+        path.unlink()
+
+    if filtered:
+        filtarr = rtdc_ds.filter.all
+    else:
+        filtarr = np.ones(len(rtdc_ds), dtype=bool)
+    index = np.where(filtarr)[0]
+
+    # same meta data as `RTDCBase.export.hdf5` (without keys unknown
+    # to dclab, which would be rejected by `write`)
+    meta = {}
+    for sec in dfn.CFG_METADATA:
+        if sec in ["fmt_tdms"]:
+            continue
+        if sec in rtdc_ds.config:
+            meta[sec] = {}
+            for key in rtdc_ds.config[sec]:
+                if key in dfn.config_keys[sec]:
+                    meta[sec][key] = rtdc_ds.config[sec][key]
+    meta.setdefault("experiment", {})["event count"] = index.size
+
+    kwargs = {"compression": compression,
+              "compression_opts": compression_opts,
+              "shuffle": shuffle,
+              "fletcher32": True}
+
+    h5obj = write(path_or_h5file=path, meta=meta, mode="append")
+    try:
+        events = h5obj["events"]
+        for feat in features:
+            if feat not in rtdc_ds:
+                continue
+            if feat == "contour":
+                _write_contour(events, rtdc_ds, index, kwargs)
+            elif feat in ["image", "mask"]:
+                _write_image(events, feat, rtdc_ds, index, chunk_events,
+                             kwargs)
+            elif feat == "trace":
+                _write_trace(events, rtdc_ds, index, chunk_events, kwargs)
+            else:
+                data = np.asarray(rtdc_ds[feat])[filtarr]
+                chunks = (max(1, min(chunk_scalar, data.size)),)
+                events.create_dataset(feat,
+                                      data=data,
+                                      maxshape=(None,),
+                                      chunks=chunks,
+                                      **kwargs)
+    finally:
+        h5obj.close()
+    return path
+
+
+def _write_contour(events, rtdc_ds, index, kwargs):
+    """Write contours (one HDF5 dataset per event)"""
+    grp = events.create_group("contour")
+    for jj, ii in enumerate(index):
+        grp.create_dataset("{}".format(jj),
+                           data=rtdc_ds["contour"][ii],
+                           **kwargs)
+
+
+def _write_image(events, feat, rtdc_ds, index, chunk_events, kwargs):
+    """Write image-like data with `chunk_events` images per chunk"""
+    im0 = np.asarray(rtdc_ds[feat][0])
+    shape = (index.size, im0.shape[0], im0.shape[1])
+    chunks = (max(1, min(chunk_events, index.size)),) + shape[1:]
+    dset = events.create_dataset(feat,
+                                 shape=shape,
+                                 dtype=np.uint8,
+                                 maxshape=(None,) + shape[1:],
+                                 chunks=chunks,
+                                 **kwargs)
+    # HDFView recognizes this as a series of images
+    dset.attrs.create('CLASS', b'IMAGE')
+    dset.attrs.create('IMAGE_VERSION', b'1.2')
+    dset.attrs.create('IMAGE_SUBCLASS', b'IMAGE_GRAYSCALE')
+    # write whole chunks at once (avoids partial chunk updates)
+    stack = np.zeros(chunks, dtype=np.uint8)
+    for start in range(0, index.size, chunks[0]):
+        stop = min(start + chunks[0], index.size)
+        for jj, ii in enumerate(index[start:stop]):
+            data = np.asarray(rtdc_ds[feat][ii])
+            if feat == "mask" and data.dtype == np.bool_:
+                # store binary masks visible in HDFView
+                data = data * 255
+            stack[jj] = data
+        dset[start:stop] = stack[:stop - start]
+
+
+def _write_trace(events, rtdc_ds, index, chunk_events, kwargs):
+    """Write fluorescence traces with `chunk_events` traces per chunk"""
+    grp = events.create_group("trace")
+    for tr in rtdc_ds["trace"].keys():
+        tr0 = np.asarray(rtdc_ds["trace"][tr][0])
+        trdat = np.zeros((index.size, tr0.size), dtype=tr0.dtype)
+        for jj, ii in enumerate(index):
+            trdat[jj] = rtdc_ds["trace"][tr][ii]
+        chunks = (max(1, min(chunk_events, index.size)), tr0.size)
+        grp.create_dataset(tr,
+                           data=trdat,
+                           maxshape=(None, tr0.size),
+                           chunks=chunks,
+                           **kwargs)
+
+
+def benchmark(rtdc_ds, features, presets=None, filtered=True, reads=100,
+              directory=None, seed=42):
+    """Benchmark the storage layout presets for a data set
+
+    Parameters
+    ----------
+    rtdc_ds: dclab.rtdc_dataset.RTDCBase
+        The data set to export
+    features: list of str
+        Features to export
+    presets: list of str or None
+        Names of the presets in `PRESETS` to benchmark;
+        defaults to all presets.
+    filtered: bool
+        If set to `True`, only the filtered events are exported.
+    reads: int
+        Number of random events read from the exported file
+    directory: str or None
+        Directory for the exported files; defaults to a new
+        temporary directory.
+    seed: int
+        Seed for choosing the random events
+
+    Returns
+    -------
+    results: dict of dicts
+        For each preset, the keys "write time" [s], "file size" [B],
+        and "read latency" [s] (mean time for reading all exported
+        non-scalar features of a single random event) and the
+        exported "path".
+    """
+    if presets is None:
+        presets = sorted(PRESETS.keys())
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix="shapeout_rtdc_benchmark_")
+    directory = pathlib.Path(directory)
+    results = {}
+    for name in presets:
+        path = directory / "{}.rtdc".format(name.replace(" ", "_"))
+        t0 = time.time()
+        export_rtdc(path=path,
+                    rtdc_ds=rtdc_ds,
+                    features=features,
+                    filtered=filtered,
+                    override=True,
+                    **PRESETS[name])
+        twrite = time.time() - t0
+        tread = _random_read_latency(path, reads=reads, seed=seed)
+        results[name] = {"write time": twrite,
+                         "file size": path.stat().st_size,
+                         "read latency": tread,
+                         "path": path,
+                         }
+    return results
+
+
+def _random_read_latency(path, reads, seed):
+    """Mean time for reading the non-scalar features of a random event"""
+    with h5py.File(str(path), "r") as h5:
+        events = h5["events"]
+        size = h5.attrs["experiment:event count"]
+        dsets = []
+        for key in ["image", "mask"]:
+            if key in events:
+                dsets.append(events[key])
+        if "trace" in events:
+            dsets += [events["trace"][tr] for tr in events["trace"]]
+        if not dsets or not size:
+            return np.nan
+        rs = np.random.RandomState(seed)
+        indices = rs.randint(0, size, reads)
+        t0 = time.time()
+        for ii in indices:
+            for ds in dsets:
+                ds[ii]
+            if "contour" in events:
+                events["contour"]["{}".format(ii)][:]
+        return (time.time() - t0) / reads
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - streaming export of event data to text files"""
+from __future__ import division, print_function, unicode_literals
+
+import gzip
+import io
+import pathlib
+
+import dclab.definitions as dfn
+
+from .chunks import CHUNK_SIZE, iter_chunks
+
+
+def export_tsv(path, rtdc_ds, features, filtered=True, override=False,
+               chunk_size=CHUNK_SIZE, compress=False, delimiter="\t"):
+    """Export scalar event data to a tab-separated values file
+
+    The data are read, formatted, and written in chunks of
+    `chunk_size` events, such that the memory footprint does
+    not depend on the size of the data set. The output is
+    identical to that of `RTDCBase.export.tsv`.
+
+    Parameters
+    ----------
+    path: str
+        Path to the output file. The extension ".tsv" (or
+        ".tsv.gz" if `compress` is set) is added automatically.
+    rtdc_ds: dclab.rtdc_dataset.RTDCBase
+        The data set to export
+    features: list of str
+        Scalar features to export, e.g. "area_um", "deform"
+    filtered: bool
+        If set to `True`, only the filtered events are exported.
+    override: bool
+        If set to `True`, an existing file `path` will be overridden.
+        If set to `False`, raises `OSError` if `path` exists.
+    chunk_size: int
+        Number of events processed at once
+    compress: bool
+        If set to `True`, the output is gzip-compressed.
+    delimiter: str
+        Column delimiter (e.g. "," for comma-separated values)
+
+    Returns
+    -------
+    path: pathlib.Path
+        The path of the exported file
+    """
+    features = [f.lower() for f in features]
+    for ff in features:
+        if ff not in dfn.scalar_feature_names:
+            raise ValueError("Unknown feature name {}".format(ff))
+    path = pathlib.Path(path)
+    # Make sure that path ends with .tsv (.tsv.gz)
+    name = path.name
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if not name.endswith(".tsv"):
+        name += ".tsv"
+    if compress:
+        name += ".gz"
+    path = path.with_name(name)
+    if not override and path.exists():
+        raise OSError("File already exists: {}\n".format(
+            str(path).encode("ascii", "ignore")) +
+            "Please use the `override=True` option.")
+
+    if compress:
+        fd = gzip.open(str(path), "wb")
+    else:
+        fd = io.open(str(path), "wb")
+
+    with fd:
+        header1 = delimiter.join(features)
+        header2 = delimiter.join([dfn.feature_name2label[f]
+                                  for f in features])
+        fd.write("# {}\n# {}\n".format(header1, header2).encode("utf-8"))
+        rowfmt = delimiter.join(["%.10e"] * len(features)) + "\n"
+        for chunk in iter_chunks(rtdc_ds=rtdc_ds,
+                                 features=features,
+                                 filtered=filtered,
+                                 chunk_size=chunk_size):
+            # format the entire chunk with a single string operation
+            text = (rowfmt * chunk.shape[0]) % tuple(chunk.ravel().tolist())
+            fd.write(text.encode("utf-8"))
+    return path
@@ -29,44 +29,77 @@ def mkdir_p(adir):
             mkdir_p(os.path.dirname(adir))
 
 
-def _autosave_consumer(delayedresult, parent):
-    if not hasattr(parent, "analysis"):
-        # nothing to do
-        pass
-    else:
-        parent.StatusBar.SetStatusText("Autosaving...")
-        tempname = autosave_file+".tmp"
-        mkdir_p(cache_dir)
+def _autosave_consumer(delayedresult, parent, interval):
+    """Take a snapshot of the session and pass it to the worker
+
+    This runs in the GUI thread; the snapshot only copies the
+    session data (see `session.rw.get_session_state`).
+    """
+    # raises exceptions of the worker
+    fingerprint = delayedresult.get()
+    state = None
+    if hasattr(parent, "analysis") and parent.analysis is not None:
         try:
-            session.rw.save(tempname, parent.analysis.measurements)
+            state = session.rw.get_session_state(
+                parent.analysis.measurements)
         except session.rw.UnsupportedDataClassSaveError:
             # dictionary data type not supported -> ignore
-            parent.StatusBar.SetStatusText("")
-        except BaseException:
-            raise
-            parent.StatusBar.SetStatusText("Autosaving failed!")
-        else:
-            if os.path.exists(autosave_file):
-                os.remove(autosave_file)
-            os.rename(tempname, autosave_file)
-            parent.StatusBar.SetStatusText("")
-        # cleanup when autosave failed
-        if os.path.exists(tempname):
-            os.remove(tempname)
-    autosave_run(parent)
-
-
-def _autosave_worker(parent, interval):
-    """Runs in the background and performs autosaving"""
+            pass
+    autosave_run(parent, interval, state=state, fingerprint=fingerprint)
+
+
+def _autosave_worker(parent, interval, state, fingerprint):
+    """Runs in the background and performs autosaving
+
+    The session is only saved if it changed since the last
+    autosave (see `session.rw.get_state_fingerprint`).
+
+    Returns the fingerprint of the saved session.
+    """
+    if state is not None:
+        new = session.rw.get_state_fingerprint(state)
+        if new != fingerprint:
+            wx.CallAfter(parent.StatusBar.SetStatusText, "Autosaving...")
+            tempname = autosave_file+".tmp"
+            mkdir_p(cache_dir)
+            try:
+                session.rw.save_state(tempname, state)
+            except BaseException:
+                wx.CallAfter(parent.StatusBar.SetStatusText,
+                             "Autosaving failed!")
+                raise
+            else:
+                if os.path.exists(autosave_file):
+                    os.remove(autosave_file)
+                os.rename(tempname, autosave_file)
+                fingerprint = new
+                wx.CallAfter(parent.StatusBar.SetStatusText, "")
+            finally:
+                # cleanup when autosave failed
+                if os.path.exists(tempname):
+                    os.remove(tempname)
     time.sleep(interval)
+    return fingerprint
 
 
-def autosave_run(parent, interval=5):
-    """Runs in the background and performs autosaving"""
+def autosave_run(parent, interval=5, state=None, fingerprint=None):
+    """Runs in the background and performs autosaving
+
+    Parameters
+    ----------
+    parent: wx.Frame
+        The main window with the `analysis` attribute
+    interval: float
+        Autosave interval [s]
+    state: dict or None
+        Session state to save (see `session.rw.get_session_state`)
+    fingerprint: str or None
+        Fingerprint of the last autosaved session
+    """
     delayedresult.startWorker(_autosave_consumer,
                               _autosave_worker,
-                              wargs=(parent, interval,),
-                              cargs=(parent,))
+                              wargs=(parent, interval, state, fingerprint),
+                              cargs=(parent, interval))
 
 
 def check_recover(parent):
@@ -5,13 +5,12 @@
 """
 from __future__ import division, print_function, unicode_literals
 
-import io
 import os
 import wx
 from wx.lib.scrolledpanel import ScrolledPanel
 
 import dclab
-from .. import analysis
+from .. import batch
 from .. import meta_tool
 
 
@@ -122,6 +121,12 @@ class BatchFilterFolder(wx.Frame):
         tsvSizer.AddSpacer(5)
         tsvSizer.Add(tsv2sizer, 0,
                      wx.EXPAND|wx.ALIGN_CENTER_VERTICAL|wx.ALL)
+        # Statistics of unchanged measurements are taken from the
+        # batch cache in the user cache directory.
+        self.WXcheck_cache = wx.CheckBox(panel,
+                                         label="Reuse cached statistics")
+        self.WXcheck_cache.SetValue(True)
+        tsvSizer.Add(self.WXcheck_cache, 0, wx.ALL, 5)
         self.topSizer.Add(tsvSizer, 0, wx.EXPAND)
 
         ## Batch button
@@ -166,9 +171,6 @@ class BatchFilterFolder(wx.Frame):
         if self.rbtnhere.GetValue():
             mhere = self.analysis.measurements[self.dropdown.GetSelection()] 
             f_config = mhere.config
-        # Compute statistics
-        head = None
-        rows = []
         # Determine which flow rates to use
         idflow = self.WXdropdown_flowrate.GetSelection() - 1
         if idflow < 0:
@@ -178,48 +180,24 @@ class BatchFilterFolder(wx.Frame):
         # Filter regions
         regid = self.WXdropdown_region.GetSelection()
         if regid > 0:
-            if regid == 1:
-                reg = "channel"
-            elif regid == 2:
-                reg = "reservoir"
-            newfiles = []
-            for tt in files:
-                if meta_tool.get_chip_region(tt) == reg:
-                    newfiles.append(tt)
-            files = newfiles
-        if not files:
-            raise ValueError("No valid measurements with current selection!")
-        
-        # Process each data file separately to reduce memory usage
-        for data in files:
-            # Make analysis from data file
-            anal = analysis.Analysis([data], config=f_config)
-            mm = anal.measurements[0]
-            # Apply filters
-            mm.apply_filter()
-            # Get statistics
-            h, v = dclab.statistics.get_statistics(rtdc_ds=mm,
-                                                   methods=methods,
-                                                   features=features)
-            if head is None:
-                head = h
-            else:
-                assert h==head, "Problem with available methods/features!"
-            
-            rows.append([mm.path, mm.title]+v)
-
-        head = ["data file", "Title"] + head
-        
-        with io.open(self.out_tsv_file, "w") as fd:
-            header = u"\t".join([ h for h in head ])
-            fd.write("# "+header+"\n")
-        
-        with open(self.out_tsv_file, "ab") as fd:
-            for row in rows:
-                fmt=["{:s}"]*2+["{:.10e}"]*len(v)
-                line="\t".join(fmt).format(*row)
-                fd.write(line+"\n")
-        wx.EndBusyCursor()
+            reg = batch.CHIP_REGIONS[regid - 1]
+            files = batch.filter_files(files, region=reg)
+        # Compute statistics
+        if self.WXcheck_cache.IsChecked():
+            bcache = batch.BatchCache()
+        else:
+            bcache = None
+        try:
+            batch.batch_filter(files=files,
+                               config=f_config,
+                               features=features,
+                               methods=methods,
+                               out_tsv=self.out_tsv_file,
+                               cache=bcache)
+        finally:
+            if bcache is not None:
+                bcache.close()
+            wx.EndBusyCursor()
 
 
     def OnBrowse(self, e=None):
@@ -243,8 +221,7 @@ class BatchFilterFolder(wx.Frame):
             self.WXfold_text1.SetLabel(thepath)
             self.parent.config.set_path(thepath, "BatchFD")
             # Search directory
-            tree, _cols = meta_tool.collect_data_tree(thepath)
-            self.data_files = [ t[1][1] for t in tree ]
+            self.data_files = batch.find_data_files(thepath, index=True)
             
             if self.out_tsv_file is not None:
                 self.btnbatch.Enable()
@@ -254,7 +231,7 @@ class BatchFilterFolder(wx.Frame):
         # Determine flow rates
         flow_dict = {}
         for tt in self.data_files:
-            fr = meta_tool.get_flow_rate(tt)
+            fr = meta_tool.get_metadata(tt).flow_rate
             if fr not in flow_dict:
                 flow_dict[fr] = []
             flow_dict[fr].append(tt)
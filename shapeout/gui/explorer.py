@@ -5,8 +5,10 @@
 """
 from __future__ import division, print_function
 
+import functools
 
 import numpy as np
+import pathlib
 import warnings
 import wx
 import wx.lib.agw.hypertreelist as HT
@@ -14,6 +16,7 @@ from wx.lib.scrolledpanel import ScrolledPanel
 
 
 from .. import meta_tool
+from .. import watcher
 
 class ExplorerPanel(ScrolledPanel):
     """"""
@@ -35,6 +38,8 @@ class ExplorerPanel(ScrolledPanel):
         self.col_width = col_width
 
         self.treelist = []
+        # watches the search paths for new measurements
+        self.watcher = None
         
         # Set up box
         box = wx.StaticBox(self, label="Measurement browser")
@@ -138,46 +143,42 @@ class ExplorerPanel(ScrolledPanel):
         else:
             raise ValueError("No data selected in Measurement Browser!")
 
+    def OnWatcherUpdate(self, added, modified, removed):
+        """Update the projects of measurements changed on disk
+
+        This is called by `self.watcher` (see `WatchDirectory`).
+        """
+        changed = set([str(ff) for ff in added + modified])
+        gone = set([str(ff) for ff in removed])
+        folders = set([str(ff.parent) for ff in added + modified + removed])
+        files = set()
+        for item in self.treelist:
+            if item[0][1] in folders:
+                files.update([meas[1] for meas in item[1:]])
+        files = sorted((files - gone) | changed)
+        data = meta_tool.get_data_tree([pathlib.Path(ff) for ff in files])
+        # remove projects without measurements
+        present = [item[0][1] for item in data[0]]
+        self.treelist = [item for item in self.treelist
+                         if item[0][1] not in folders
+                         or item[0][1] in present]
+        self.SetProjectTreeAdd(data)
+
     def OnSelectAll(self, e=None):
         r = self.htreectrl.GetRootItem()
         for c in r.GetChildren():
             self.htreectrl.CheckItem(c)
 
     def OnSelectFlow1(self, e=None):
-        self.OnSelectNone()
-        frate = self.flowrates[0]
-        r = self.htreectrl.GetRootItem()
-        for c in r.GetChildren():
-            for k in c.GetChildren():
-                f = k.GetData()
-                if ( not meta_tool.get_chip_region(f).lower() == "reservoir"
-                     and frate == meta_tool.get_flow_rate(f) ):
-
-                    self.htreectrl.CheckItem(k)
+        self.SelectFlowRate(self.flowrates[0])
 
 
     def OnSelectFlow2(self, e=None):
-        self.OnSelectNone()
-        frate = self.flowrates[1]
-        r = self.htreectrl.GetRootItem()
-        for c in r.GetChildren():
-            for k in c.GetChildren():
-                f = k.GetData()
-                if ( not meta_tool.get_chip_region(f).lower() == "reservoir"
-                     and frate == meta_tool.get_flow_rate(f) ):
-                    self.htreectrl.CheckItem(k)        
+        self.SelectFlowRate(self.flowrates[1])
 
 
     def OnSelectFlow3(self, e=None):
-        self.OnSelectNone()
-        frate = self.flowrates[2]
-        r = self.htreectrl.GetRootItem()
-        for c in r.GetChildren():
-            for k in c.GetChildren():
-                f = k.GetData()
-                if ( not meta_tool.get_chip_region(f).lower() == "reservoir"
-                     and frate == meta_tool.get_flow_rate(f) ):
-                    self.htreectrl.CheckItem(k)  
+        self.SelectFlowRate(self.flowrates[2])
 
 
     def OnSelectNone(self, e=None):
@@ -192,6 +193,18 @@ class ExplorerPanel(ScrolledPanel):
                 if k.GetData() in data:
                     self.htreectrl.CheckItem(k)
 
+    def SelectFlowRate(self, frate):
+        """Check all channel measurements with the flow rate `frate`"""
+        self.OnSelectNone()
+        r = self.htreectrl.GetRootItem()
+        for c in r.GetChildren():
+            for k in c.GetChildren():
+                # memoized by `meta_tool.collect_data_tree`
+                meta = meta_tool.get_metadata(k.GetData())
+                if (not meta.chip_region.lower() == "reservoir"
+                        and frate == meta.flow_rate):
+                    self.htreectrl.CheckItem(k)
+
     def SetProjectTree(self, data, add=False, marked=[]):
         """Update tree view with measurement data information
 
@@ -207,10 +220,12 @@ class ExplorerPanel(ScrolledPanel):
         
         if add:
             # update treelist
-            # check if already in tree
-            for item in self.treelist:
-                if not item in treelist:
-                    treelist.append(item)
+            # check if already in tree (projects are identified by
+            # their path, which allows incremental updates)
+            new = dict([(item[0][1], item) for item in treelist])
+            merged = [new.pop(item[0][1], item) for item in self.treelist]
+            treelist = merged + [item for item in treelist
+                                 if item[0][1] in new]
 
         # Any checked or bold items ?
         checked = []
@@ -279,6 +294,29 @@ class ExplorerPanel(ScrolledPanel):
         self.SetProjectTree(data, add=True)
 
 
+    def WatchDirectory(self, directories, add=True):
+        """Update the tree view when measurements change on disk
+
+        Parameters
+        ----------
+        directories: str or list of str
+            Directories to watch (recursively)
+        add: bool
+            If False, stop watching the previous directories.
+        """
+        if not isinstance(directories, list):
+            directories = [directories]
+        if not add and self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        if self.watcher is None:
+            update = functools.partial(wx.CallAfter, self.OnWatcherUpdate)
+            self.watcher = watcher.DataWatcher(callback=update)
+            self.watcher.start()
+        for directory in directories:
+            self.watcher.watch(directory)
+
+
     def Update(self, e=None):
         """ Updates this panel (e.g. dis-/enables buttons)
         
@@ -306,7 +344,7 @@ class ExplorerPanel(ScrolledPanel):
             for item in self.treelist:
                 # First tree item contains path to measurements
                 for meas in item[1:]:
-                    flr.append(meta_tool.get_flow_rate(meas[1]))
+                    flr.append(meta_tool.get_metadata(meas[1]).flow_rate)
             flr = np.unique(flr)
             flr.sort()
 
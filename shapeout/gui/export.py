@@ -13,6 +13,8 @@ import numpy as np
 import wx
 from wx.lib.scrolledpanel import ScrolledPanel
 
+from .. import export
+
 
 class ExportAnalysisEvents(wx.Frame):
     def __init__(self, parent, analysis, ext="ext", non_scalars=[]):
@@ -69,6 +71,7 @@ class ExportAnalysisEvents(wx.Frame):
             if c in self.analysis.GetPlotAxes():
                 cb.SetValue(True)
         self.topSizer.Add(self.sizerin)
+        self.SetupExportOptions()
         btnbrws = wx.Button(self.panel, wx.ID_ANY, "Save to directory")
         # Binds the button to the function - close the tool
         self.Bind(wx.EVT_BUTTON, self.OnBrowse, btnbrws)
@@ -122,10 +125,22 @@ class ExportAnalysisEvents(wx.Frame):
                     if name in names:
                         features.append(name)
             
-            # Call the export function of dclab.rtdc_dataset
-            # Check if the files already exist
+            # Only export measurements whose data, filters, or export
+            # options changed since the last export to this directory.
+            options = self.GetExportOptions()
+            manifest = export.manifest.ExportManifest(outdir)
+            outdated = []
+            entries = {}
             for m in self.analysis.measurements:
-                if os.path.exists(os.path.join(outdir, m.title+"."+self.ext)):
+                name = self.GetExportName(m)
+                entry = manifest.get_entry(m, features, filtered, options)
+                if not manifest.is_current(name, entry):
+                    outdated.append(m)
+                    entries[name] = entry
+
+            # Check if the files already exist
+            for m in outdated:
+                if os.path.exists(os.path.join(outdir, self.GetExportName(m))):
                     msg = "Override existing .{} files in '{}'?".format(
                                                            self.ext, outdir)
                     dlg3 = wx.MessageDialog(self,
@@ -138,7 +153,11 @@ class ExportAnalysisEvents(wx.Frame):
                         # do not continue
                         return
             wx.BeginBusyCursor()
-            self.export(out_dir=outdir, features=features, filtered=filtered)
+            self.export(out_dir=outdir, features=features, filtered=filtered,
+                        measurements=outdated)
+            for name in entries:
+                manifest.update(name, entries[name])
+            manifest.save()
             wx.EndBusyCursor()
             
     def OnToggleAllEventFeatures(self, e=None):
@@ -156,6 +175,24 @@ class ExportAnalysisEvents(wx.Frame):
         # Invert for next execution
         self.toggled_event_features = not self.toggled_event_features
 
+    def GetExportName(self, measurement):
+        """Return the file name of an exported measurement"""
+        return measurement.title + "." + self.ext
+
+    def GetExportOptions(self):
+        """Return format-specific export options (for the manifest)
+
+        Override this method in subclasses.
+        """
+        return {}
+
+    def SetupExportOptions(self):
+        """Add format-specific export options to `self.topSizer`
+
+        Override this method in subclasses.
+        """
+        pass
+
     @staticmethod
     def get_dataset_features(data_set, features):
         out_feat = []
@@ -164,7 +201,7 @@ class ExportAnalysisEvents(wx.Frame):
                 out_feat.append(feat)
         return out_feat
 
-    def export(self, out_dir, features, filtered):
+    def export(self, out_dir, features, filtered, measurements=None):
         raise NotImplementedError("Please subclass and rewrite this function.")
 
 
@@ -175,8 +212,10 @@ class ExportAnalysisEventsFCS(ExportAnalysisEvents):
                                                       analysis,
                                                       ext="fcs")
 
-    def export(self, out_dir, features, filtered):
-        for m in self.analysis.measurements:
+    def export(self, out_dir, features, filtered, measurements=None):
+        if measurements is None:
+            measurements = self.analysis.measurements
+        for m in measurements:
             mfeat = self.get_dataset_features(m, features)
             m.export.fcs(os.path.join(out_dir, m.title+".fcs"),
                          mfeat,
@@ -184,6 +223,52 @@ class ExportAnalysisEventsFCS(ExportAnalysisEvents):
                          override=True)
 
 
+class ExportAnalysisEventsParquet(ExportAnalysisEvents):
+    def __init__(self, parent, analysis):
+        super(ExportAnalysisEventsParquet, self).__init__(parent,
+                                                          analysis,
+                                                          ext="parquet")
+
+    def SetupExportOptions(self):
+        horsizer = wx.BoxSizer(wx.HORIZONTAL)
+        horsizer.Add(wx.StaticText(self.panel, label="Compression: "), 0,
+                     wx.ALIGN_CENTER_VERTICAL)
+        self.WXChoiceCompression = wx.Choice(self.panel,
+                                             choices=["snappy", "gzip",
+                                                      "none"])
+        self.WXChoiceCompression.SetSelection(0)
+        horsizer.Add(self.WXChoiceCompression)
+        horsizer.Add(wx.StaticText(self.panel, label="  Row group size: "),
+                     0, wx.ALIGN_CENTER_VERTICAL)
+        self.WXSpinRowGroup = wx.SpinCtrl(self.panel, min=1000,
+                                          max=10000000,
+                                          initial=export.parquet.ROW_GROUP_SIZE)
+        horsizer.Add(self.WXSpinRowGroup)
+        self.topSizer.Add(horsizer)
+
+    def GetExportOptions(self):
+        return {"compression": self.WXChoiceCompression.GetStringSelection(),
+                "row group size": self.WXSpinRowGroup.GetValue()}
+
+    def export(self, out_dir, features, filtered, measurements=None):
+        if measurements is None:
+            measurements = self.analysis.measurements
+        compression = self.WXChoiceCompression.GetStringSelection()
+        if compression == "none":
+            compression = None
+        # Use the same features for all measurements such that all
+        # files in `out_dir` share one schema.
+        for m in measurements:
+            export.parquet.export_parquet(
+                path=os.path.join(out_dir, m.title+".parquet"),
+                rtdc_list=[m],
+                features=features,
+                filtered=filtered,
+                override=True,
+                row_group_size=self.WXSpinRowGroup.GetValue(),
+                compression=compression)
+
+
 class ExportAnalysisEventsRTDC(ExportAnalysisEvents):
     def __init__(self, parent, analysis):
         super(ExportAnalysisEventsRTDC, self).__init__(parent,
@@ -193,13 +278,77 @@ class ExportAnalysisEventsRTDC(ExportAnalysisEvents):
                                                                     "image",
                                                                     "trace"])
 
-    def export(self, out_dir, features, filtered):
-        for m in self.analysis.measurements:
-            mfeat = self.get_dataset_features(m, features)
-            m.export.hdf5(os.path.join(out_dir, m.title+".rtdc"),
-                          mfeat,
-                          filtered=filtered,
-                          override=True)
+    def SetupExportOptions(self):
+        horsizer = wx.BoxSizer(wx.HORIZONTAL)
+        horsizer.Add(wx.StaticText(self.panel, label="Storage preset: "), 0,
+                     wx.ALIGN_CENTER_VERTICAL)
+        presets = sorted(export.rtdc.PRESETS.keys())
+        self.WXChoicePreset = wx.Choice(self.panel, choices=presets)
+        self.Bind(wx.EVT_CHOICE, self.OnSelectPreset, self.WXChoicePreset)
+        horsizer.Add(self.WXChoicePreset)
+        self.topSizer.Add(horsizer)
+        horsizer = wx.BoxSizer(wx.HORIZONTAL)
+        horsizer.Add(wx.StaticText(self.panel, label="Compression: "), 0,
+                     wx.ALIGN_CENTER_VERTICAL)
+        self.WXChoiceCompression = wx.Choice(self.panel,
+                                             choices=["gzip", "lzf", "none"])
+        horsizer.Add(self.WXChoiceCompression)
+        horsizer.Add(wx.StaticText(self.panel, label="  Level: "), 0,
+                     wx.ALIGN_CENTER_VERTICAL)
+        self.WXSpinLevel = wx.SpinCtrl(self.panel, min=0, max=9, initial=4)
+        horsizer.Add(self.WXSpinLevel)
+        self.WXCheckShuffle = wx.CheckBox(self.panel, label="shuffle")
+        horsizer.Add(self.WXCheckShuffle, 0, wx.ALIGN_CENTER_VERTICAL)
+        self.topSizer.Add(horsizer)
+        horsizer = wx.BoxSizer(wx.HORIZONTAL)
+        horsizer.Add(wx.StaticText(self.panel,
+                                   label="Events per image/trace chunk: "),
+                     0, wx.ALIGN_CENTER_VERTICAL)
+        self.WXSpinChunk = wx.SpinCtrl(self.panel, min=1, max=10000,
+                                       initial=export.rtdc.CHUNK_EVENTS)
+        horsizer.Add(self.WXSpinChunk)
+        self.topSizer.Add(horsizer)
+        self.WXChoicePreset.SetStringSelection("default")
+        self.OnSelectPreset()
+
+    def OnSelectPreset(self, e=None):
+        """Set the storage options according to the selected preset"""
+        preset = export.rtdc.PRESETS[self.WXChoicePreset.GetStringSelection()]
+        compression = preset["compression"]
+        if compression is None:
+            compression = "none"
+        self.WXChoiceCompression.SetStringSelection(compression)
+        level = preset["compression_opts"]
+        if level is None:
+            level = 4
+        self.WXSpinLevel.SetValue(level)
+        self.WXCheckShuffle.SetValue(preset["shuffle"])
+        self.WXSpinChunk.SetValue(preset["chunk_events"])
+
+    def GetExportOptions(self):
+        compression = self.WXChoiceCompression.GetStringSelection()
+        if compression == "none":
+            compression = None
+        if compression == "gzip":
+            level = self.WXSpinLevel.GetValue()
+        else:
+            level = None
+        return {"compression": compression,
+                "compression_opts": level,
+                "shuffle": self.WXCheckShuffle.IsChecked(),
+                "chunk_events": self.WXSpinChunk.GetValue()}
+
+    def export(self, out_dir, features, filtered, measurements=None):
+        if measurements is None:
+            measurements = self.analysis.measurements
+        options = self.GetExportOptions()
+        for m in measurements:
+            export.rtdc.export_rtdc(path=os.path.join(out_dir, m.title+".rtdc"),
+                                    rtdc_ds=m,
+                                    features=features,
+                                    filtered=filtered,
+                                    override=True,
+                                    **options)
 
 
 class ExportAnalysisEventsTSV(ExportAnalysisEvents):
@@ -208,13 +357,33 @@ class ExportAnalysisEventsTSV(ExportAnalysisEvents):
                                                       analysis,
                                                       ext="tsv")
 
-    def export(self, out_dir, features, filtered):
-        for m in self.analysis.measurements:
+    def SetupExportOptions(self):
+        self.WXCheckGzip = wx.CheckBox(self.panel,
+         label="compress with gzip (*.tsv.gz)")
+        self.WXCheckGzip.SetValue(False)
+        self.topSizer.Add(self.WXCheckGzip)
+
+    def GetExportName(self, measurement):
+        name = measurement.title + ".tsv"
+        if self.WXCheckGzip.IsChecked():
+            name += ".gz"
+        return name
+
+    def GetExportOptions(self):
+        return {"compress": self.WXCheckGzip.IsChecked()}
+
+    def export(self, out_dir, features, filtered, measurements=None):
+        if measurements is None:
+            measurements = self.analysis.measurements
+        compress = self.WXCheckGzip.IsChecked()
+        for m in measurements:
             mfeat = self.get_dataset_features(m, features)
-            m.export.tsv(os.path.join(out_dir, m.title+".tsv"),
-                         mfeat,
-                         filtered=filtered,
-                         override=True)
+            export.tsv.export_tsv(path=os.path.join(out_dir, m.title+".tsv"),
+                                  rtdc_ds=m,
+                                  features=mfeat,
+                                  filtered=filtered,
+                                  override=True,
+                                  compress=compress)
 
 
 
@@ -226,9 +395,20 @@ def export_event_images_avi(parent, analysis):
     if dlg.ShowModal() == wx.ID_OK:
         out_dir=dlg.GetPath().encode("utf-8")
         parent.config.set_path(out_dir, "ExportAVI")
-        for m in analysis.measurements:
-            m.export.avi(os.path.join(out_dir, m.title+".avi"),
-                         override=True)
+        choices = ["export filtered events only",
+                   "draw event contours"]
+        dlgopt = wx.MultiChoiceDialog(parent,
+                                      message="Video export options",
+                                      caption="Export event images",
+                                      choices=choices)
+        dlgopt.SetSelections([0])
+        if dlgopt.ShowModal() == wx.ID_OK:
+            selections = dlgopt.GetSelections()
+            export.avi.export_avi_many(directory=out_dir,
+                                       rtdc_list=analysis.measurements,
+                                       filtered=0 in selections,
+                                       override=True,
+                                       contour=1 in selections)
 
 
 def export_event_image_png(parent, image):
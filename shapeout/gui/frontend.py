@@ -3,6 +3,7 @@
 """ShapeOut - wx frontend components"""
 from __future__ import division, print_function, unicode_literals
 
+import functools
 import os
 import platform
 import pkg_resources
@@ -226,6 +227,9 @@ class Frame(gaugeframe.GaugeFrame):
         e2tsv = exportDataMenu.Append(wx.ID_ANY, "All &event data (*.tsv)", 
                 "Export all scalar event data as tab-separated values")
         self.Bind(wx.EVT_MENU, self.OnMenuExportEventsTSV, e2tsv)
+        e2pq = exportDataMenu.Append(wx.ID_ANY, "All &event data (*.parquet)", 
+                "Export all scalar event data as Apache Parquet files")
+        self.Bind(wx.EVT_MENU, self.OnMenuExportEventsParquet, e2pq)
         e2stat = exportDataMenu.Append(wx.ID_ANY, "Computed &statistics (*.tsv)", 
                        "Export the statistics data as tab-separated values")
         self.Bind(wx.EVT_MENU, self.OnMenuExportStatistics, e2stat)
@@ -457,6 +461,18 @@ class Frame(gaugeframe.GaugeFrame):
         export.ExportAnalysisEventsFCS(self, self.analysis)
 
 
+    def OnMenuExportEventsParquet(self, e=None):
+        """Export the event data of the entire analysis as parquet
+        
+        This will open a choice dialog for the user
+        - which data (filtered/unfiltered)
+        - which features (area_um, deform, etc)
+        - to which folder should be exported 
+        """
+        # Generate dialog
+        export.ExportAnalysisEventsParquet(self, self.analysis)
+
+
     def OnMenuExportEventsRTDC(self, e=None):
         """Export the event data of the entire analysis as rtdc
         
@@ -572,12 +588,17 @@ class Frame(gaugeframe.GaugeFrame):
             path = dlg.GetPath().encode("utf-8")
             self.config.set_path(path, name="MeasurementList")
             dlg.Destroy()
+            # show measurements while the search is running
+            update = functools.partial(wx.CallAfter,
+                                       self.PanelLeft.SetProjectTree)
             self.GaugeIndefiniteStart(
                                 func=meta_tool.collect_data_tree,
-                                func_args=(path,),
+                                func_args=(path, True, update),
                                 post_call=self.PanelLeft.SetProjectTree,
                                 msg="Searching for data files"
                                 )
+            # show new measurements while experiments are running
+            self.PanelLeft.WatchDirectory(path, add=False)
 
 
     def OnMenuSearchPathAdd(self, e=None, add=True, path=None,
@@ -592,13 +613,20 @@ class Frame(gaugeframe.GaugeFrame):
             dlg.Destroy()
             if answer != wx.ID_OK:
                 return
+        # show measurements while the search is running
+        update = functools.partial(wx.CallAfter,
+                                   self.PanelLeft.SetProjectTree,
+                                   add=add,
+                                   marked=marked)
         self.GaugeIndefiniteStart(
                         func=meta_tool.collect_data_tree,
-                        func_args=(path,),
+                        func_args=(path, True, update),
                         post_call=self.PanelLeft.SetProjectTree,
                         post_call_kwargs = {"add":add, "marked":marked},
                         msg="Searching for data files"
                         )
+        # show new measurements while experiments are running
+        self.PanelLeft.WatchDirectory(path, add=add)
 
     def OnMenuQuit(self, e=None):
         if hasattr(self, "analysis") and self.analysis is not None:
@@ -5,17 +5,15 @@ from __future__ import division, print_function, unicode_literals
 
 from distutils.version import LooseVersion
 import pathlib
-import shutil
-import tempfile
 import warnings
-import zipfile
 
 import wx
 
 
-from ..session.conversion import compatibilitize_session, \
-                                 search_hashed_measurement, \
-                                 update_session_hashes
+from ..session.archive import SessionArchive
+from ..session.conversion import compatibilitize_archive, \
+                                 update_archive_hashes
+from ..session.locator import MeasurementLocator
 
 from ..session import index, rw
 
@@ -62,28 +60,25 @@ def open_session_worker(path, parent):
         if hasattr(item, "analysis"):
             del item.analysis
     
-    Arc = zipfile.ZipFile(str(path), mode='r')
-    tempdir = tempfile.mkdtemp(prefix="ShapeOut-session_")
-    tempdir = pathlib.Path(tempdir)
-    Arc.extractall(str(tempdir))
-    Arc.close()
+    # The session is not extracted; all files are kept in memory.
+    arc = SessionArchive(path)
     
     # The ShapeOut version used to create the session is returned:
     # Do not perform hash update, because we do not know if all
     # measurement files are where they're supposed to be. 
-    version = compatibilitize_session(tempdir, hash_update=False)
+    version = compatibilitize_archive(arc, hash_update=False)
     
-    index_file = tempdir / "index.txt"
-    index_dict = index.index_load(index_file)
+    index_dict = arc.get_index()
 
     # check session integrity
     dirname = path.parent
-    messages = index.index_check(index_file, search_path=dirname)
+    messages = index.index_check_dict(index_dict, search_path=dirname)
+    # search directories are only traversed once
+    locator = MeasurementLocator()
     while messages["missing files"]:
         # There are missing files. We need to modify the extracted
         # index file with a folder.
         missing = messages["missing files"]
-        directories = [] # search directories
         updict = {}      # new dicts for individual measurements
         # Ask user for directory
         miss = missing[0][1].name
@@ -115,18 +110,14 @@ def open_session_worker(path, parent):
         if mod != wx.ID_OK:
             break
 
-        # Add search directory            
-        directories.insert(0, path)
-        
         # Try to find all measurements with that directory (also relative)
         wx.BeginBusyCursor()
+        # Add search directory
+        locator.add_directory(path)
         remlist = []
         for m in missing:
             key, mfile, index_item = m
-            newfile = search_hashed_measurement(mfile,
-                                                index_item,
-                                                directories,
-                                                version=version)
+            newfile = locator.find(mfile, index_item, version=version)
             if newfile is not None:
                 newdir = newfile.parent
                 # Store the original directory name. This is important
@@ -135,24 +126,26 @@ def open_session_worker(path, parent):
                 updict[key] = {"fdir": str(newdir),
                                "fdir_orig":index_dict[key]["fdir"],
                                }
-                directories.insert(0, newdir.parent)
-                directories.insert(0, newdir.parent.parent)
+                locator.add_directory(newdir.parent)
+                locator.add_directory(newdir.parent.parent)
                 remlist.append(m)
         for m in remlist:
             missing.remove(m)
         wx.EndBusyCursor()
 
-        # Update the extracted index file.
-        index.index_update(index_file, updict)
+        # Update the index of the session in memory.
+        for key in updict:
+            index_dict[key].update(updict[key])
+        arc.set_index(index_dict)
     
     # Update hash values of tdms and hierarchy children
     if version < LooseVersion("0.7.6"):
-        update_session_hashes(tempdir, search_path=dirname)
+        update_archive_hashes(arc, search_path=dirname)
     
     # Catch hash comparison warnings and display warning to the user
     with warnings.catch_warnings(record=True) as ww:
         warnings.simplefilter("always", category=rw.HashComparisonWarning)
-        rtdc_list = rw.load(tempdir, search_path=dirname)
+        rtdc_list = rw.load(arc, search_path=dirname)
         if len(ww):
             msg = "One or more files referred to in the chosen session "+\
                   "did not pass the hash check. Nevertheless, ShapeOut "+\
@@ -177,9 +170,6 @@ def open_session_worker(path, parent):
 
     parent.OnMenuSearchPathAdd(add=False, path=directories,
                                marked=bolddirs)
-    
-    # Remove all temporary files
-    shutil.rmtree(str(tempdir), ignore_errors=True)
 
 
 def save_session(parent):
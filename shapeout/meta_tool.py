@@ -3,76 +3,258 @@
 """ShapeOut - meta data functionalities"""
 from __future__ import division, unicode_literals
 
-import hashlib
+import collections
+import os
 import pathlib
-import warnings
+import sqlite3
+import time
+from multiprocessing.pool import ThreadPool
 
+import appdirs
 import h5py
 import imageio
 import nptdms
 
 from dclab.rtdc_dataset import config as rt_config
 from dclab.rtdc_dataset import fmt_tdms
+from dclab.rtdc_dataset.util import hashfile, hashobj
 
-from . import settings
+from . import cache_store, tdms_header
 
 
-def collect_data_tree(directories):
+#: meta data of a measurement file (see `get_metadata`)
+MetaData = collections.namedtuple("MetaData", ["path",
+                                               "sample",
+                                               "run_index",
+                                               "title",
+                                               "chip_region",
+                                               "flow_rate",
+                                               "event_count",
+                                               "date",
+                                               ])
+
+#: keys that must be present in .rtdc files
+RTDC_KEYS = ["experiment:event count",
+             "experiment:sample",
+             "experiment:run index",
+             "imaging:pixel size",
+             "setup:channel width",
+             "setup:chip region",
+             "setup:flow rate",
+             ]
+
+#: memoized meta data {path: ((mtime, size), MetaData)}
+_metadata_cache = {}
+
+#: name of the event count cache in the user cache directory
+EVENT_COUNT_CACHE = "shapeout_event_counts.db"
+
+#: maximum number of entries in the event count cache
+EVENT_COUNT_CACHE_SIZE = 100000
+
+#: default number of threads for reading meta data
+SCAN_WORKERS = 8
+
+#: default file name of the meta data index in the user cache directory
+INDEX_NAME = "shapeout_meta_index.db"
+
+#: number of index updates written in one transaction
+INDEX_BATCH_SIZE = 100
+
+def collect_data_tree(directories, index=None, callback=None,
+                      workers=SCAN_WORKERS, interval=.5):
     """Return projects (folders) and measurements therein
 
     This is a convenience function for the GUI
+
+    Parameters
+    ----------
+    directories: str or list of str
+        Directories to search (recursively)
+    index: MetaIndex, bool, or None
+        Meta data index; only new or modified measurements are
+        read from disk. If set to `True`, the default index in the
+        user cache directory is used.
+    callback: callable or None
+        Called with the incomplete return value of this function
+        at most every `interval` seconds while the search is running
+        (e.g. to update the GUI).
+    workers: int
+        Number of threads for reading meta data (see `iter_metadata`)
+    interval: float
+        Minimum interval between calls of `callback` [s]
     """
     if not isinstance(directories, list):
         directories = [directories]
 
     directories = list(set(directories))
 
+    if index is True:
+        index = MetaIndex()
+        close_index = True
+    else:
+        close_index = False
+
     pathdict = {}
     treelist = []
 
+    cols = ["Measurement"]
+
+    last_call = time.time()
+
     for directory in directories:
-        files = find_data(directory)
+        if index is None:
+            records = iter_metadata(find_data(directory), workers=workers)
+        else:
+            records = index.iter_scan(directory, workers=workers)
+
+        for meta in records:
+            _add_to_tree(treelist, pathdict, meta)
+            if callback is not None and time.time() - last_call > interval:
+                callback(([list(t) for t in treelist], cols))
+                last_call = time.time()
 
-        cols = ["Measurement"]
-
-        for ff in files:
-            if not verify_dataset(ff):
-                # Ignore broken measurements
-                continue
-            path = str(ff.parent)
-            # try to find the path in pathdict
-            if pathdict.has_key(path):
-                dirindex = pathdict[path]
-            else:
-                treelist.append([])
-                dirindex = len(treelist) - 1
-                pathdict[path] = dirindex
-                # The first element of a tree contains the measurement name
-                project = get_sample_name(ff)
-                treelist[dirindex].append((project, path))
-            # Get data from filename
-            mx = get_run_index(ff)
-            chip_region = get_chip_region(ff)
-            dn = u"M{} {}".format(mx, chip_region)
-            if not chip_region.lower() in ["reservoir"]:
-                # outlet (flow rate is not important)
-                dn += u"  {:.5f} µls⁻¹".format(get_flow_rate(ff))
-            dn += "  ({} events)".format(get_event_count(ff))
-
-            treelist[dirindex].append((dn, str(ff)))
+    if close_index:
+        index.close()
 
     return treelist, cols
 
 
-def find_data(path):
-    """Find tdms and rtdc data files in a directory"""
+def find_data(path, recursive=True):
+    """Find tdms and rtdc data files in a directory
+
+    The directory tree is traversed only once for all file formats.
+    If `recursive` is `False`, subdirectories are not searched.
+    """
     path = pathlib.Path(path)
-    tdmsfiles = sorted(fmt_tdms.get_tdms_files(path))
-    rtdcfiles = sorted([r for r in path.rglob("*.rtdc") if r.is_file()])
-    files = [pathlib.Path(ff) for ff in rtdcfiles + tdmsfiles]
+    # same paths as `fmt_tdms.get_tdms_files`
+    tdmsroot = path.resolve()
+    tdmsfiles = []
+    rtdcfiles = []
+    for root, _dirs, names in os.walk(str(path), followlinks=True):
+        for name in names:
+            if name.endswith(".rtdc"):
+                ff = pathlib.Path(root) / name
+                if ff.is_file():
+                    rtdcfiles.append(ff)
+            elif (name.endswith(".tdms") and
+                  not name.endswith("_traces.tdms")):
+                ff = pathlib.Path(root) / name
+                if ff.is_file():
+                    rel = ff.relative_to(path)
+                    tdmsfiles.append(tdmsroot / rel)
+        if not recursive:
+            break
+    files = sorted(rtdcfiles) + sorted(tdmsfiles)
     return files
 
 
+def get_data_tree(files, workers=SCAN_WORKERS):
+    """Return projects (folders) and the measurements in `files`
+
+    Same as `collect_data_tree`, but for a list of measurement
+    files (e.g. to update single projects in the GUI).
+    """
+    pathdict = {}
+    treelist = []
+    for meta in iter_metadata(files, workers=workers):
+        _add_to_tree(treelist, pathdict, meta)
+    return treelist, ["Measurement"]
+
+
+def iter_metadata(files, workers=SCAN_WORKERS):
+    """Yield the meta data of all complete measurements in `files`
+
+    Parameters
+    ----------
+    files: list of pathlib.Path
+        Measurement files
+    workers: int
+        Number of threads for verifying the files and reading
+        the meta data; on network file systems, the latency of
+        each file access is hidden by accessing several files
+        at once.
+
+    Yields
+    ------
+    meta: MetaData
+        Meta data in the order of `files`; broken measurements
+        (see `verify_dataset`) are skipped.
+    """
+    if not files:
+        return
+    pool = ThreadPool(max(1, min(workers, len(files))))
+    try:
+        for meta in pool.imap(_read_metadata, files):
+            if meta is not None:
+                yield meta
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _add_to_tree(treelist, pathdict, meta):
+    """Add a measurement to the project tree (see `collect_data_tree`)"""
+    ff = meta.path
+    path = str(ff.parent)
+    # try to find the path in pathdict
+    if pathdict.has_key(path):
+        dirindex = pathdict[path]
+    else:
+        treelist.append([])
+        dirindex = len(treelist) - 1
+        pathdict[path] = dirindex
+        # The first element of a tree contains the measurement name
+        treelist[dirindex].append((meta.sample, path))
+    dn = u"M{} {}".format(meta.run_index, meta.chip_region)
+    if not meta.chip_region.lower() in ["reservoir"]:
+        # outlet (flow rate is not important)
+        dn += u"  {:.5f} µls⁻¹".format(meta.flow_rate)
+    dn += "  ({} events)".format(meta.event_count)
+
+    treelist[dirindex].append((dn, str(ff)))
+
+
+def _read_metadata(fname):
+    """Return the meta data of a measurement or `None` if it is broken"""
+    if not verify_dataset(fname):
+        return None
+    # memoized in `verify_dataset`
+    return get_metadata(fname)._replace(path=fname)
+
+
+def get_dataset_hash(fname):
+    """Get the hash of a data set without loading it
+
+    Parameters
+    ----------
+    fname: str
+        Path to an experimental data file. The file format is
+        determined from the file extension (tdms or rtdc).
+
+    Returns
+    -------
+    hash: str
+        The hash of the data set (identical to `RTDCBase.hash`)
+    """
+    fname = pathlib.Path(fname)
+    ext = fname.suffix
+
+    if ext == ".rtdc":
+        tohash = [fname.name]
+    elif ext == ".tdms":
+        mx = fname.name.split("_")[0]
+        fsh = [fname.with_name(mx + "_camera.ini"),
+               fname.with_name(mx + "_para.ini")]
+        tohash = [hashfile(f) for f in fsh]
+        tohash.append(fname.name)
+    else:
+        raise ValueError("`fname` must be an .rtdc or .tdms file!")
+    # Hash a maximum of ~1MB of the data file
+    tohash.append(hashfile(fname, blocksize=65536, count=20))
+    return hashobj(tohash)
+
+
 def get_event_count(fname):
     """Get the number of events in a data set
 
@@ -102,36 +284,7 @@ def get_event_count(fname):
     --------
     get_event_count_cache: cached event counts from tdms/avi files
     """
-    fname = pathlib.Path(fname).resolve()
-    ext = fname.suffix
-
-    if ext == ".rtdc":
-        with h5py.File(str(fname), mode="r") as h5:
-            event_count = h5.attrs["experiment:event count"]
-    elif ext == ".tdms":
-        mdir = fname.parent
-        mid = fname.name.split("_")[0]
-        # possible data sources
-        logf = mdir / (mid + "_log.ini")
-        avif = mdir / (mid + "_imaq.avi")
-        if logf.exists():
-            # 1. The MX_log.ini file "Events" tag
-            with logf.open() as fd:
-                logd = fd.readlines()
-            for l in logd:
-                if l.strip().startswith("Events:"):
-                    event_count = int(l.split(":")[1])
-                    break
-        elif avif.exists():
-            # 2. The number of frames in the avi file
-            event_count = get_event_count_cache(avif)
-        else:
-            # 3. Open the tdms file
-            event_count = get_event_count_cache(fname)
-    else:
-        raise ValueError("`fname` must be an .rtdc or .tdms file!")
-
-    return event_count
+    return get_metadata(fname).event_count
 
 
 def get_event_count_cache(fname):
@@ -149,29 +302,34 @@ def get_event_count_cache(fname):
 
     Notes
     -----
-    The values for a file name are cached on disk using
-    the file name and the first 100kB of the file as a
-    key.
+    The values are cached on disk (see `EVENT_COUNT_CACHE`); the
+    cache key consists of the path, size, and modification time
+    of the file. For tdms files, only the segment meta data are
+    read (see `tdms_header.get_channel_length`).
     """
     fname = pathlib.Path(fname).resolve()
     ext = fname.suffix
-    # Generate key
-    with fname.open(mode="rb") as fd:
-        data = fd.read(100 * 1024)
-    fhash = hashlib.md5(data + fname.as_uri()).hexdigest()
-    cfgec = settings.SettingsFileCache(name="shapeout_tdms_event_counts.txt")
+    key = cache_store.get_stat_key(fname)
+    cache = cache_store.get_store(name=EVENT_COUNT_CACHE,
+                                  max_entries=EVENT_COUNT_CACHE_SIZE)
     try:
-        event_count = cfgec.get_int(fhash)
+        event_count = cache.get(key)
     except KeyError:
         if ext == ".avi":
             with imageio.get_reader(str(fname)) as video:
                 event_count = len(video)
         elif ext == ".tdms":
-            tdmsfd = nptdms.TdmsFile(str(fname))
-            event_count = len(tdmsfd.object("Cell Track", "time").data)
+            try:
+                event_count = tdms_header.get_channel_length(
+                    fname, "Cell Track", "time")
+            except (tdms_header.TdmsHeaderError, KeyError):
+                # e.g. DAQmx data; read the whole file
+                tdmsfd = nptdms.TdmsFile(str(fname))
+                event_count = len(
+                    tdmsfd.object("Cell Track", "time").data)
         else:
             raise ValueError("unsupported file extension: {}".format(ext))
-        cfgec.set_int(fhash, event_count)
+        cache.set(key, event_count)
     return event_count
 
 
@@ -189,29 +347,7 @@ def get_flow_rate(fname):
     flow_rate: float
         The flow rate [µL/s] of the data set
     """
-    fname = pathlib.Path(fname).resolve()
-    ext = fname.suffix
-
-    if ext == ".rtdc":
-        with h5py.File(str(fname), mode="r") as h5:
-            flow_rate = h5.attrs["setup:flow rate"]
-    elif ext == ".tdms":
-        name = fname.name
-        path = fname.parent
-        mx = name.split("_")[0]
-        para = path / (mx + "_para.ini")
-        if para.exists():
-            camcfg = rt_config.load_from_file(str(para))
-            flow_rate = camcfg["general"]["flow rate [ul/s]"]
-        else:
-            # analyze the filename
-            warnings.warn("{}: trying to manually find flow rate.".
-                          format(fname))
-            flow_rate = float(fname.split("ul_s")[0].split("_")[-1])
-    else:
-        raise ValueError("`fname` must be an .rtdc or .tdms file!")
-
-    return flow_rate
+    return get_metadata(fname).flow_rate
 
 
 def get_chip_region(fname):
@@ -228,45 +364,125 @@ def get_chip_region(fname):
     chip_region: str
         The chip region ("channel" or "reservoir")
     """
-    fname = pathlib.Path(fname).resolve()
-    ext = fname.suffix
+    return get_metadata(fname).chip_region
 
-    if ext == ".rtdc":
-        with h5py.File(str(fname), mode="r") as h5:
-            chip_region = h5.attrs["setup:chip region"]
-    elif ext == ".tdms":
-        name = fname.name
-        path = fname.parent
-        mx = name.split("_")[0]
-        para = path / (mx + "_para.ini")
-        if para.exists():
-            camcfg = rt_config.load_from_file(str(para))
-            chip_region = camcfg["General"]["Region"].lower()
 
-    return chip_region
+def get_metadata(fname):
+    """Get the meta data of a data set
 
+    Parameters
+    ----------
+    fname: str
+        Path to an experimental data file. The file format is
+        determined from the file extension (tdms or rtdc).
 
-def get_run_index(fname):
+    Returns
+    -------
+    meta: MetaData
+        Sample name, run index, title, chip region, flow rate,
+        event count, and date (`None` if not available) of the
+        data set
+
+    Notes
+    -----
+    All meta data are read at once (a single open of .rtdc files
+    and of the "_para.ini" file of tdms data sets). The result is
+    memoized until the modification time or the size of the data
+    file changes; relative paths and symbolic links share the
+    entry of the resolved path. Raises an exception if the data set
+    is incomplete (see `verify_dataset`).
+    """
     fname = pathlib.Path(fname).resolve()
-    ext = fname.suffix
-    if ext == ".rtdc":
-        with h5py.File(str(fname), mode="r") as h5:
-            run_index = h5.attrs["experiment:run index"]
-    elif ext == ".tdms":
-        name = fname.name
-        run_index = int(name.split("_")[0].strip("Mm "))
-    return run_index
+    stat = fname.stat()
+    key = (stat.st_mtime, stat.st_size)
+    cached = _metadata_cache.get(str(fname))
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    if fname.suffix == ".rtdc":
+        meta = _get_metadata_rtdc(fname)
+    elif fname.suffix == ".tdms":
+        meta = _get_metadata_tdms(fname)
+    else:
+        raise ValueError("`fname` must be an .rtdc or .tdms file!")
+    _metadata_cache[str(fname)] = (key, meta)
+    return meta
+
+
+def _get_metadata_rtdc(fname):
+    with h5py.File(str(fname), mode="r") as h5:
+        attrs = {}
+        for key in RTDC_KEYS:
+            attrs[key] = h5.attrs[key]
+        attrs["experiment:date"] = h5.attrs.get("experiment:date")
+    sample = attrs["experiment:sample"]
+    run_index = attrs["experiment:run index"]
+    return MetaData(path=fname,
+                    sample=sample,
+                    run_index=run_index,
+                    title="{} - M{}".format(sample, run_index),
+                    chip_region=attrs["setup:chip region"],
+                    flow_rate=attrs["setup:flow rate"],
+                    event_count=attrs["experiment:event count"],
+                    date=attrs["experiment:date"])
+
+
+def _get_metadata_tdms(fname):
+    mx = fname.name.split("_")[0]
+    para = fname.parent / (mx + "_para.ini")
+    camcfg = rt_config.load_from_file(str(para))
+    if "date [yyyy-mm-dd]" in camcfg["general"]:
+        date = camcfg["general"]["date [yyyy-mm-dd]"]
+    else:
+        date = None
+    return MetaData(path=fname,
+                    sample=fmt_tdms.get_project_name_from_path(fname),
+                    run_index=int(mx.strip("Mm ")),
+                    title=fmt_tdms.get_project_name_from_path(
+                        fname, append_mx=True),
+                    chip_region=camcfg["General"]["Region"].lower(),
+                    flow_rate=camcfg["general"]["flow rate [ul/s]"],
+                    event_count=_get_event_count_tdms(fname),
+                    date=date)
+
+
+def _get_event_count_tdms(fname):
+    """Get the number of events of a tdms data set
+
+    See `get_event_count` for the data sources.
+    """
+    mdir = fname.parent
+    mid = fname.name.split("_")[0]
+    # possible data sources
+    logf = mdir / (mid + "_log.ini")
+    avif = mdir / (mid + "_imaq.avi")
+    if logf.exists():
+        # 1. The MX_log.ini file "Events" tag
+        with logf.open() as fd:
+            logd = fd.readlines()
+        for l in logd:
+            if l.strip().startswith("Events:"):
+                event_count = int(l.split(":")[1])
+                break
+    elif avif.exists():
+        # 2. The number of frames in the avi file
+        event_count = get_event_count_cache(avif)
+    else:
+        # 3. Open the tdms file
+        event_count = get_event_count_cache(fname)
+    return event_count
+
+
+def get_run_index(fname):
+    return get_metadata(fname).run_index
 
 
 def get_sample_name(fname):
-    fname = pathlib.Path(fname).resolve()
-    ext = fname.suffix
-    if ext == ".rtdc":
-        with h5py.File(str(fname), mode="r") as h5:
-            sample = h5.attrs["experiment:sample"]
-    elif ext == ".tdms":
-        sample = fmt_tdms.get_project_name_from_path(fname)
-    return sample
+    return get_metadata(fname).sample
+
+
+def get_title(fname):
+    """Get the title of a data set (identical to `RTDCBase.title`)"""
+    return get_metadata(fname).title
 
 
 def verify_dataset(path, verbose=False):
@@ -288,39 +504,301 @@ def verify_dataset(path, verbose=False):
             is_ok = False
 
         # Check if we can perform all standard file operations
-        for test in [get_chip_region, get_flow_rate, get_event_count]:
+        if is_ok:
             try:
-                test(path)
-            except:
+                get_metadata(path)
+            except BaseException:
                 if verbose:
                     print("standard file operations failed")
                 is_ok = False
-                break
     elif path.suffix == ".rtdc":
         try:
-            with h5py.File(str(path), mode="r") as h5:
-                for key in ["experiment:event count",
-                            "experiment:sample",
-                            "experiment:run index",
-                            "imaging:pixel size",
-                            "setup:channel width",
-                            "setup:chip region",
-                            "setup:flow rate",
-                            ]:
-                    if key not in h5.attrs:
-                        if verbose:
-                            print("fmt_rtdc keys missing")
-                        is_ok = False
-                        break
-                else:
-                    is_ok = True
-        except IOError:
+            get_metadata(path)
+        except KeyError:
+            if verbose:
+                print("fmt_rtdc keys missing")
+            is_ok = False
+        except (IOError, OSError):
             if verbose:
                 print("data file broken")
             is_ok = False
+        else:
+            is_ok = True
     else:
         if verbose:
             print("unsupported format")
         is_ok = False
 
     return is_ok
+
+
+class MetaIndex(object):
+    def __init__(self, path=None):
+        """Persistent index of the meta data of measurement files
+
+        Entries are keyed by the file path and are only valid
+        as long as the size and the modification time of the
+        file do not change.
+
+        Parameters
+        ----------
+        path: str or None
+            Path of the SQLite database; defaults to `INDEX_NAME`
+            in the user cache directory.
+        """
+        if path is None:
+            directory = pathlib.Path(appdirs.user_cache_dir())
+            if not directory.exists():
+                directory.mkdir(parents=True)
+            path = directory / INDEX_NAME
+        self.path = pathlib.Path(path)
+        self._con = sqlite3.connect(str(self.path), timeout=60)
+        with self._con:
+            self._con.execute("CREATE TABLE IF NOT EXISTS measurements ("
+                              "path TEXT PRIMARY KEY, "
+                              "size INTEGER, "
+                              "mtime REAL, "
+                              "sample TEXT, "
+                              "run_index INTEGER, "
+                              "title TEXT, "
+                              "chip_region TEXT, "
+                              "flow_rate REAL, "
+                              "event_count INTEGER, "
+                              "date TEXT)")
+            for col in ["sample", "chip_region", "flow_rate", "date"]:
+                self._con.execute("CREATE INDEX IF NOT EXISTS "
+                                  "measurements_{0} ON measurements "
+                                  "({0})".format(col))
+
+    def __len__(self):
+        return self._con.execute(
+            "SELECT COUNT(*) FROM measurements").fetchone()[0]
+
+    def close(self):
+        self._con.close()
+
+    def get(self, fname):
+        """Return the meta data of a measurement file
+
+        The meta data are read from disk if the file is not
+        in the index or if it was modified.
+        """
+        meta = list(self._iter_update([pathlib.Path(fname)], workers=1))
+        if not meta:
+            raise ValueError("Broken measurement: {}".format(fname))
+        return meta[0]
+
+    def iter_scan(self, directory, workers=SCAN_WORKERS):
+        """Update the index with the measurements in a directory
+
+        Only new or modified files are read; entries of files
+        that were removed from `directory` are deleted.
+
+        Parameters
+        ----------
+        directory: str
+            Directory to search (recursively)
+        workers: int
+            Number of threads for reading the files
+
+        Yields
+        ------
+        meta: MetaData
+            Meta data of all complete measurements in `directory`
+            (see `verify_dataset`) in the order of `find_data`
+        """
+        # same path form as the stored paths (see `find_data`)
+        directory = pathlib.Path(directory).resolve()
+        files = find_data(directory)
+        for meta in self._iter_update(files, workers=workers):
+            yield meta
+        # remove entries of deleted files
+        prefix = _get_prefix(directory)
+        found = set([_to_text(ff) for ff in files])
+        rows = self._con.execute(
+            "SELECT path FROM measurements WHERE substr(path, 1, ?)=?",
+            (len(prefix), prefix)).fetchall()
+        with self._con:
+            self._con.executemany("DELETE FROM measurements WHERE path=?",
+                                  [row for row in rows
+                                   if row[0] not in found])
+
+    def query(self, sample=None, flow_rate=None, chip_region=None,
+              date=None, directory=None):
+        """Return the meta data of indexed measurements
+
+        Parameters
+        ----------
+        sample: str or None
+            Sample name
+        flow_rate: float or None
+            Flow rate [µL/s]
+        chip_region: str or None
+            Chip region ("channel" or "reservoir")
+        date: str, tuple of str, or None
+            Measurement date ("YYYY-MM-DD") or an inclusive
+            date range (start, end)
+        directory: str or None
+            Only return measurements in this directory (recursively)
+
+        Returns
+        -------
+        records: list of MetaData
+            Meta data of the matching measurements sorted by path;
+            the index is not updated.
+        """
+        conds = []
+        args = []
+        if sample is not None:
+            conds.append("sample=?")
+            args.append(_to_text(sample))
+        if flow_rate is not None:
+            conds.append("ABS(flow_rate-?)<1e-9")
+            args.append(flow_rate)
+        if chip_region is not None:
+            conds.append("LOWER(chip_region)=?")
+            args.append(_to_text(chip_region).lower())
+        if isinstance(date, (tuple, list)):
+            conds.append("date BETWEEN ? AND ?")
+            args += [_to_text(date[0]), _to_text(date[1])]
+        elif date is not None:
+            conds.append("date=?")
+            args.append(_to_text(date))
+        if directory is not None:
+            prefix = _get_prefix(directory)
+            conds.append("substr(path, 1, ?)=?")
+            args += [len(prefix), prefix]
+        sql = "SELECT * FROM measurements"
+        if conds:
+            sql += " WHERE " + " AND ".join(conds)
+        sql += " ORDER BY path"
+        return [_row_to_metadata(row)
+                for row in self._con.execute(sql, args)]
+
+    def scan(self, directory, workers=SCAN_WORKERS):
+        """Update the index with the measurements in a directory
+
+        Returns the meta data as a list, see `iter_scan`.
+        """
+        return list(self.iter_scan(directory, workers=workers))
+
+    def _iter_update(self, files, workers):
+        """Yield the meta data of `files` and update the index
+
+        The updates are written in transactions of `INDEX_BATCH_SIZE`
+        entries. No transaction is open while yielding, so other
+        connections (e.g. other ShapeOut instances) are not blocked
+        during long scans.
+        """
+        if not files:
+            return
+        pool = ThreadPool(max(1, min(workers, len(files))))
+        # pending updates [(sql, args), ...]
+        pending = []
+        try:
+            stats = pool.map(_stat, files)
+            fresh = {}
+            stale = []
+            for ii, (ff, stat) in enumerate(zip(files, stats)):
+                if stat is None:
+                    # removed in the meantime
+                    continue
+                row = self._con.execute(
+                    "SELECT * FROM measurements WHERE path=?",
+                    (_to_text(ff),)).fetchone()
+                if (row is not None and row[1] == stat.st_size and
+                        row[2] == stat.st_mtime):
+                    fresh[ii] = _row_to_metadata(row)
+                else:
+                    stale.append(ii)
+            # read new or modified files in the background
+            results = pool.imap(_read_metadata, [files[ii] for ii in stale])
+            stale = set(stale)
+            for ii, ff in enumerate(files):
+                stat = stats[ii]
+                if ii in fresh:
+                    meta = fresh[ii]
+                    # make the entry available to `get_metadata`
+                    _metadata_cache[str(ff.resolve())] = (
+                        (stat.st_mtime, stat.st_size), meta)
+                elif ii in stale:
+                    meta = next(results)
+                    if meta is None:
+                        # Ignore broken measurements
+                        pending.append(("DELETE FROM measurements "
+                                        "WHERE path=?", (_to_text(ff),)))
+                    else:
+                        pending.append((
+                            "INSERT OR REPLACE INTO measurements VALUES "
+                            "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (_to_text(ff), stat.st_size, stat.st_mtime,
+                             _to_text(meta.sample),
+                             int(meta.run_index),
+                             _to_text(meta.title),
+                             _to_text(meta.chip_region),
+                             float(meta.flow_rate),
+                             int(meta.event_count),
+                             _to_text(meta.date))))
+                    if len(pending) >= INDEX_BATCH_SIZE:
+                        self._write(pending)
+                    if meta is None:
+                        continue
+                else:
+                    continue
+                yield meta._replace(path=ff)
+        finally:
+            pool.terminate()
+            pool.join()
+            # also store the entries read before the caller stopped
+            self._write(pending)
+
+    def _write(self, pending):
+        """Execute and commit the updates in `pending` (cleared)"""
+        if pending:
+            with self._con:
+                for sql, args in pending:
+                    self._con.execute(sql, args)
+            del pending[:]
+
+
+def _get_prefix(directory):
+    """Return the text prefix of all indexed paths in `directory`
+
+    The directory is resolved like the paths returned by `find_data`
+    for a resolved directory (see `MetaIndex.iter_scan`); it does not
+    have to exist.
+    """
+    prefix = _to_text(os.path.realpath(str(directory)))
+    if not prefix.endswith(os.sep):
+        prefix += os.sep
+    return prefix
+
+
+def _row_to_metadata(row):
+    return MetaData(path=pathlib.Path(row[0]),
+                    sample=row[3],
+                    run_index=row[4],
+                    title=row[5],
+                    chip_region=row[6],
+                    flow_rate=row[7],
+                    event_count=row[8],
+                    date=row[9])
+
+
+def _stat(fname):
+    """Return the stat result of a file or `None` if it does not exist"""
+    try:
+        return fname.stat()
+    except OSError:
+        return None
+
+
+def _to_text(value):
+    """Convert paths and byte strings to text for the index"""
+    if value is None:
+        return None
+    elif isinstance(value, pathlib.Path):
+        value = str(value)
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    return value
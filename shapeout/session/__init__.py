@@ -1 +1 @@
-from . import index, conversion, rw  # noqa: F401
+from . import archive, index, conversion, locator, manual, rw  # noqa: F401
@@ -0,0 +1,377 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - in-memory access to session files
+
+The members of a session file (.zmso) are read into memory; the
+index, configurations, manual filters, and polygon filters are
+parsed without extracting the archive.
+
+Session format versions:
+
+1. (ShapeOut <0.8.7) "index.txt" and one "config.txt" per
+   measurement, polygon filters in "PolygonFilters.poly"
+2. (ShapeOut >=0.8.7) a single JSON manifest ("session.json")
+   containing the index, the configurations, and the polygon
+   filters; manual filters are stored in binary .npy members
+"""
+from __future__ import division, print_function, unicode_literals
+
+from distutils.version import LooseVersion
+import io
+import json
+import os
+import pathlib
+import posixpath
+import zipfile
+
+import numpy as np
+
+from dclab import definitions as dfn
+from dclab.rtdc_dataset.config import CaseInsensitiveDict, Configuration, \
+    keyval_str2typ
+
+from . import index, manual
+
+
+#: name of the session manifest (session format version 2)
+MANIFEST = "session.json"
+#: current session format version
+FORMAT_VERSION = 2
+
+
+class SessionArchive(object):
+    def __init__(self, path):
+        """Contents of a ShapeOut session in memory
+
+        Parameters
+        ----------
+        path: str
+            Path to a ShapeOut session file or a directory containing
+            the extracted file.
+
+        Notes
+        -----
+        Members are identified by their relative path with forward
+        slashes (e.g. "1_a1b2/config.txt"). Changes (see `write_text`
+        and `remove`) are only applied to the files on disk with
+        `save`.
+        """
+        self.path = pathlib.Path(path)
+        #: member data {name: bytes}
+        self.files = {}
+        if self.path.is_file():
+            with zipfile.ZipFile(str(self.path.resolve()), mode="r") as arc:
+                for info in arc.infolist():
+                    # sessions saved on Windows may contain backslashes
+                    name = info.filename.replace("\\", "/")
+                    if not name.endswith("/"):
+                        self.files[name] = arc.read(info)
+        else:
+            for root, _dirs, files in os.walk(str(self.path)):
+                for ff in files:
+                    fp = pathlib.Path(root) / ff
+                    name = fp.relative_to(self.path).as_posix()
+                    with io.open(str(fp), "rb") as fd:
+                        self.files[name] = fd.read()
+        #: names of members changed or removed since loading
+        self.modified = set()
+        #: session format version (see module docstring)
+        #: and ShapeOut version used to save the session
+        if self.exists(MANIFEST):
+            manifest = json.loads(self.read_text(MANIFEST))
+            self.format_version = manifest["format version"]
+            self.version = LooseVersion(manifest["software version"])
+        elif self.exists("index.txt"):
+            self.format_version = 1
+            self.version = index.index_version_loads(
+                self.read_text("index.txt"))
+        else:
+            self.format_version = None
+            self.version = None
+        #: set by `conversion.compatibilitize_archive`
+        self.converted = False
+
+    def exists(self, name):
+        return name in self.files
+
+    def extract(self, directory):
+        """Write all members to `directory`"""
+        directory = pathlib.Path(directory)
+        for name in self.files:
+            self._write_member(directory, name)
+
+    def get_array(self, name):
+        """Return a numpy array stored in a member (.npy file)"""
+        return manual.array_loads(self.read_bytes(name))
+
+    def get_config(self, name):
+        """Return the `Configuration` stored in a member"""
+        return Configuration(cfg=config_loads(self.read_text(name)))
+
+    def get_index(self):
+        """Return the index dictionary (see `index.index_load`)
+
+        For sessions in format version 2, the index is taken from
+        the manifest.
+        """
+        if self.format_version == 1:
+            return index.index_loads(self.read_text("index.txt"))
+        else:
+            return dict((me["key"], dict(me["index"]))
+                        for me in self.get_manifest()["measurements"])
+
+    def get_manifest(self):
+        """Return the session manifest
+
+        The manifest is a dictionary with the keys
+
+        - "format version": session format version
+        - "software version": ShapeOut version used to save the session
+        - "polygons": polygon filter definitions (keyword arguments
+          for `dclab.PolygonFilter`)
+        - "measurements": list of dictionaries with the keys "key"
+          (e.g. "1_mm-hdf5_a1b2"), "index" (see `index.index_load`),
+          "config" (configuration dictionary), and "filter" (session
+          members of the manual filters "manual" and "manual root")
+
+        For sessions in format version 1, the manifest is created
+        from the index and the configuration files.
+        """
+        if self.format_version == 1:
+            return self._get_manifest_v1()
+        else:
+            return json.loads(self.read_text(MANIFEST))
+
+    def get_polygon_definitions(self):
+        """Return the polygon filters of the session
+
+        The definitions are keyword arguments for
+        `dclab.PolygonFilter`; an empty list is returned if the
+        session does not contain polygon filters.
+        """
+        if self.format_version != 1:
+            return self.get_manifest()["polygons"]
+        elif not self.exists("PolygonFilters.poly"):
+            return []
+        return polygon_loads(self.read_text("PolygonFilters.poly"))
+
+    def names(self):
+        """Return the sorted names of all members"""
+        return sorted(self.files.keys())
+
+    def read_bytes(self, name):
+        return self.files[name]
+
+    def read_text(self, name):
+        """Return the text of a member with "\\n" line endings"""
+        data = self.read_bytes(name).decode("utf-8")
+        return data.replace("\r\n", "\n").replace("\r", "\n")
+
+    def remove(self, name):
+        self.files.pop(name)
+        self.modified.add(name)
+
+    def save(self, directory=None):
+        """Apply all modifications to the files in `directory`
+
+        Parameters
+        ----------
+        directory: str or None
+            Directory with the extracted session; defaults to
+            `self.path` (if it is a directory).
+        """
+        if directory is None:
+            directory = self.path
+        directory = pathlib.Path(directory)
+        for name in sorted(self.modified):
+            if name in self.files:
+                self._write_member(directory, name)
+            else:
+                path = directory / name
+                if path.exists():
+                    path.unlink()
+        self.modified.clear()
+
+    def set_index(self, index_dict):
+        """Replace the index (see `index.index_save`)
+
+        For sessions in format version 2, the index entries of the
+        manifest are replaced.
+        """
+        if self.format_version == 1:
+            self.write_text("index.txt", index.index_dumps(index_dict))
+        else:
+            manifest = self.get_manifest()
+            for me in manifest["measurements"]:
+                me["index"] = index_dict[me["key"]]
+            self.write_text(MANIFEST, manifest_dumps(manifest))
+
+    def write_bytes(self, name, data):
+        if self.files.get(name) != data:
+            self.files[name] = data
+            self.modified.add(name)
+
+    def write_text(self, name, data):
+        self.write_bytes(name, data.encode("utf-8"))
+
+    def _get_manifest_v1(self):
+        """Create the manifest of a session in format version 1"""
+        index_dict = self.get_index()
+        measurements = []
+        keys = sorted(index_dict, key=lambda x: int(x.split("_")[0]))
+        for key in keys:
+            item = dict(index_dict[key])
+            cfg_name = item.pop("config")
+            cfg = config_loads(self.read_text(cfg_name))
+            filters = {}
+            for name in manual.MANUAL_NAMES:
+                mname = get_member_name(cfg_name, name)
+                if self.exists(mname):
+                    filters["manual"] = mname
+                    break
+            rname = get_member_name(cfg_name, "_filter_manual_root.npy")
+            if self.exists(rname):
+                filters["manual root"] = rname
+            measurements.append({
+                "key": key,
+                "index": item,
+                "config": config_dict(cfg),
+                "filter": filters,
+            })
+        polygons = []
+        for kwargs in self.get_polygon_definitions():
+            kwargs["axes"] = list(kwargs["axes"])
+            kwargs["points"] = kwargs["points"].tolist()
+            polygons.append(kwargs)
+        return {"format version": FORMAT_VERSION,
+                "software version": str(self.version),
+                "polygons": polygons,
+                "measurements": measurements,
+                }
+
+    def _write_member(self, directory, name):
+        path = directory / name
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True)
+        with io.open(str(path), "wb") as fd:
+            fd.write(self.files[name])
+
+
+def config_loads(data):
+    """Parse a configuration string
+
+    This is the in-memory equivalent of
+    `dclab.rtdc_dataset.config.load_from_file` (dclab 0.5.2);
+    keep both in sync when updating dclab.
+    """
+    cfg = CaseInsensitiveDict()
+    for line in data.split("\n"):
+        # We deal with comments and empty lines
+        # We need to check line length first and then we look for
+        # a hash.
+        line = line.split("#")[0].strip()
+        if len(line) != 0:
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1].lower()
+                if section not in cfg:
+                    cfg[section] = CaseInsensitiveDict()
+                continue
+            var, val = line.split("=", 1)
+            var = var.strip().lower()
+            val = val.strip("' ").strip('" ').strip()
+            # convert parameter value to correct type
+            if (section in dfn.config_funcs and
+                    var in dfn.config_funcs[section]):
+                # standard parameter with known type
+                val = dfn.config_funcs[section][var](val)
+            else:
+                # unknown parameter (e.g. plotting in ShapeOut), guess type
+                var, val = keyval_str2typ(var, val)
+            if len(var) != 0 and len(str(val)) != 0:
+                cfg[section][var] = val
+    return cfg
+
+
+def config_dict(cfg):
+    """Return a configuration as a dictionary of dictionaries
+
+    Parameters
+    ----------
+    cfg: dclab.rtdc_dataset.config.Configuration or dict-like
+        Configuration (e.g. from `config_loads`)
+    """
+    return dict((sec, dict(cfg[sec])) for sec in cfg)
+
+
+def manifest_dumps(manifest):
+    """Return the JSON representation of a session manifest"""
+    return json.dumps(manifest, indent=1, sort_keys=True,
+                      default=_json_default)
+
+
+def get_member_name(config_name, name):
+    """Return the name of a file in the directory of a config member
+
+    E.g. ("1_a1b2/config.txt", "_filter_manual.npy") yields
+    "1_a1b2/_filter_manual.npy".
+    """
+    return posixpath.join(posixpath.dirname(config_name), name)
+
+
+def polygon_loads(data):
+    """Parse the polygon filters of a .poly string
+
+    This is the in-memory equivalent of
+    `dclab.PolygonFilter.import_all`; the returned keyword arguments
+    are used to create the `dclab.PolygonFilter` instances.
+    """
+    # separate the polygon sections
+    sections = []
+    for line in data.split("\n"):
+        line = line.strip()
+        if line.startswith("["):
+            sections.append((line, []))
+        elif line and sections:
+            sections[-1][1].append(line)
+
+    definitions = []
+    for head, lines in sections:
+        kwargs = {"unique_id": int(head.strip("Polygon []")),
+                  "inverted": False,
+                  "name": None,
+                  }
+        points = []
+        xaxis = yaxis = None
+        for line in lines:
+            var, val = [it.strip() for it in line.split("=", 1)]
+            if var.lower() == "x axis":
+                xaxis = val.lower()
+            elif var.lower() == "y axis":
+                yaxis = val.lower()
+            elif var.lower() == "name":
+                kwargs["name"] = val
+            elif var.lower() == "inverted":
+                kwargs["inverted"] = val == "True"
+            elif var.lower().startswith("point"):
+                val = np.array(val.strip("[]").split(), dtype=float)
+                points.append((int(var[5:]), val))
+            else:
+                raise KeyError("Unknown variable: {} = {}".format(var, val))
+        kwargs["axes"] = (xaxis, yaxis)
+        # sort points and only keep the coordinates
+        points.sort(key=lambda pp: pp[0])
+        kwargs["points"] = np.array([pp[1] for pp in points])
+        definitions.append(kwargs)
+    return definitions
+
+
+def _json_default(obj):
+    """Convert numpy and pathlib objects for `json.dumps`"""
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, pathlib.PurePath):
+        return str(obj)
+    raise TypeError("Object of type {} is not JSON serializable".format(
+        obj.__class__.__name__))
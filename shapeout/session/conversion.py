@@ -15,9 +15,10 @@ from __future__ import division, print_function, unicode_literals
 
 from distutils.version import LooseVersion
 import hashlib
-import os
+from multiprocessing.pool import ThreadPool
 import pathlib
 import re
+import shutil
 import sys
 import tempfile
 
@@ -27,6 +28,9 @@ import dclab
 from dclab.rtdc_dataset.config import Configuration
 
 from . import index
+from .archive import SessionArchive
+from .locator import HASH_WORKERS, MeasurementLocator, \
+    hashfile_sha  # noqa: F401
 
 if sys.version_info[0] == 2:
     str_classes = (str, unicode)
@@ -94,25 +98,25 @@ def ci_rm_row(data, ident):
     return "\n".join(newdata)
 
 
-def cleanup_old_config_sections(tempdir):
-    """Remove old read-only config sections
+def ci_rm_section(data, section):
+    """Case insensitive removal of a section contained in data
 
-    Remove read-only config.txt sections "framerate", "general",
-    "roi", and "image".
+    Parameters
+    ----------
+    section: str
+        Name of the section (without brackets); the section header
+        and all rows up to the next section header are removed
     """
-    tempdir = pathlib.Path(tempdir)
-    index_dict = index.index_load(tempdir)
-    for key in index_dict:
-        cfgfile = tempdir / index_dict[key]["config"]
-        cfg = Configuration(files=[cfgfile])
-        for section in ["framerate",
-                        "general",
-                        "roi",
-                        "image"
-                        ]:
-            if section in cfg:
-                cfg._cfg.pop(section)
-        cfg.save(cfgfile)
+    data = data.split("\n")
+    newdata = []
+    remove = False
+    for line in data:
+        sline = line.strip()
+        if sline.startswith("[") and sline.endswith("]"):
+            remove = sline[1:-1].lower() == section.lower()
+        if not remove:
+            newdata.append(line)
+    return "\n".join(newdata)
 
 
 def compatibilitize_polygon(pdata, version=None):
@@ -203,6 +207,11 @@ def compatibilitize_session(tempdir, hash_update=True, search_path="."):
         [online_contour]: "bin margin"
       - rename feature "ncells" to "nevents"
 
+    ShapeOut 0.8.7
+      - session format version 2 with a JSON manifest; sessions
+        in format version 1 are converted in memory on load
+        (see `archive.SessionArchive.get_manifest`)
+
 
     Parameters
     ----------
@@ -218,24 +227,58 @@ def compatibilitize_session(tempdir, hash_update=True, search_path="."):
     --------
     update_session_hashes: Update hashes for RT-DC datasets/hierarchies
     """
-    tempdir = pathlib.Path(tempdir)
+    archive = SessionArchive(tempdir)
+    version = compatibilitize_archive(archive,
+                                      hash_update=hash_update,
+                                      search_path=search_path)
+    archive.save(tempdir)
+    return version
+
+
+def compatibilitize_archive(archive, hash_update=True, search_path="."):
+    """Update the files of a session in memory to latest format
+
+    This is the in-memory equivalent of `compatibilitize_session`;
+    only modified members of `archive` are changed. An archive is
+    only converted once.
+
+    Parameters
+    ----------
+    archive: shapeout.session.archive.SessionArchive
+        The session
+    hash_update: bool
+        Update the session hashes for sessions from version <0.7.6
+    search_path: str
+        Search path for measurement files used when `hash_update`
+        is `True`.
+
+    Returns
+    -------
+    version: distutils.version.LooseVersion
+        The version of ShapeOut used to save the session
+    """
     search_path = pathlib.Path(search_path)
-    version = index.index_version(tempdir)
+    version = archive.version
+    if archive.converted or archive.format_version >= 2:
+        # Sessions in format version 2 (ShapeOut 0.8.7) do not need
+        # to be converted (yet).
+        archive.converted = True
+        return version
 
-    # Find all config.txt files and replace feature names
-    change_configs = [f for f in tempdir.rglob("*config.txt")]
+    index_dict = archive.get_index()
 
     # Add title to index
     if version < LooseVersion("0.5.7"):
-        index_dict = index.index_load(tempdir)
         for key in index_dict:
             if "title" not in index_dict[key]:
                 index_dict[key]["title"] = "no title"
-        index.index_save(tempdir, index_dict)
+
+    # Find all config.txt files and replace feature names
+    change_configs = [nn for nn in archive.names()
+                      if nn.endswith("config.txt")]
 
     for cc in change_configs:
-        with cc.open() as fd:
-            data = fd.read()
+        data = archive.read_text(cc)
 
         if version < LooseVersion("0.7.1"):
             data = ci_replace(data, "\nkde multivariate ", "\nkde accuracy ")
@@ -276,6 +319,15 @@ def compatibilitize_session(tempdir, hash_update=True, search_path="."):
                                   pattern.format(old),
                                   pattern.format(new))
 
+        if version < LooseVersion("0.8.1"):
+            # Cleanup redundant read-only configuration sections
+            for section in ["framerate",
+                            "general",
+                            "roi",
+                            "image"
+                            ]:
+                data = ci_rm_section(data, section)
+
         if version < LooseVersion("0.8.4"):
             data = ci_replace(data,
                               "\nisoelastics = True\n",
@@ -306,63 +358,53 @@ def compatibilitize_session(tempdir, hash_update=True, search_path="."):
                                   pattern.format(old),
                                   pattern.format(new))
 
-        with cc.open("w") as fd:
-            fd.write(data)
+        archive.write_text(cc, data)
 
     # Change polygon filters as well
-    pfile = tempdir / "PolygonFilters.poly"
-    if pfile.exists():
-        with pfile.open() as fd:
-            datap = fd.read()
-
-        if version < LooseVersion("0.7.6"):
-            datap = compatibilitize_polygon(pdata=datap,
-                                            version=version)
-
-        with pfile.open("w") as fd:
-            fd.write(datap)
+    if (archive.exists("PolygonFilters.poly") and
+            version < LooseVersion("0.7.6")):
+        datap = archive.read_text("PolygonFilters.poly")
+        datap = compatibilitize_polygon(pdata=datap, version=version)
+        archive.write_text("PolygonFilters.poly", datap)
 
     # Rewrite confix.txt path
     if version < LooseVersion("0.7.4"):
-        index_dict = index.index_load(tempdir)
         for key in index_dict:
             repl = index_dict[key]["config"].replace("\\config.txt",
                                                      "/config.txt")
             index_dict[key]["config"] = repl
-        index.index_save(tempdir, index_dict)
 
     # Remove _filter_manual.npy of hierarchy children
     # These were actually not supported but stored anyway and sometimes
     # with a wrong size.
     if version < LooseVersion("0.7.6"):
-        index_dict = index.index_load(tempdir)
         for key in index_dict:
             if "special type" in index_dict[key]:
-                filtman = tempdir / key / "_filter_manual.npy"
-                if filtman.exists():
-                    filtman.unlink()
+                filtman = "{}/_filter_manual.npy".format(key)
+                if archive.exists(filtman):
+                    archive.remove(filtman)
+
+    if index_dict != archive.get_index():
+        archive.set_index(index_dict)
 
     # Update file hashes
     # This only works if the absolute or relative paths in the index
     # are correct.
     if hash_update:
         if version < LooseVersion("0.7.6"):
-            update_session_hashes(tempdir, search_path=search_path)
+            update_archive_hashes(archive, search_path=search_path)
 
     # Add "identifier" and replace "parent id" with "parent key"
     if version < LooseVersion("0.7.8"):
-        index_dict = index.index_load(tempdir)
+        index_dict = archive.get_index()
         for key in index_dict:
             index_dict[key]["identifier"] = key
             if "parent id" in index_dict[key]:
                 pkey = index_dict[key].pop("parent id")
                 index_dict[key]["parent key"] = pkey
-        index.index_save(tempdir, index_dict)
-
-    # Cleanup redundant read-only configuration sections
-    if version < LooseVersion("0.8.1"):
-        cleanup_old_config_sections(tempdir)
+        archive.set_index(index_dict)
 
+    archive.converted = True
     return version
 
 
@@ -401,26 +443,6 @@ def convert_polygon(infile, outfile=None, version=None):
     return outfile
 
 
-def hashfile_sha(fname, blocksize=65536):
-    """Compute sha256 hex-hash of a file
-
-    Parameters
-    ----------
-    fname: str
-        path to the file
-    blocksize: int
-        block size read from the file
-    """
-    fname = pathlib.Path(fname)
-    hasher = hashlib.sha256()
-    with fname.open('rb') as fd:
-        buf = fd.read(blocksize)
-        while len(buf) > 0:
-            hasher.update(buf)
-            buf = fd.read(blocksize)
-    return hasher.hexdigest()
-
-
 def obj2str(obj):
     """String representation of an object for hashing"""
     if isinstance(obj, str_classes):
@@ -492,26 +514,33 @@ def search_hashed_measurement(mfile, index_item, directories, version):
     Notes
     -----
     This method only searches for filenames that match the basename
-    of the given `mfile`.
+    of the given `mfile`. Use `locator.MeasurementLocator` directly
+    to search for several measurement files.
+    """
+    locator = MeasurementLocator(directories)
+    return locator.find(mfile, index_item, version)
+
+
+def update_archive_hashes(archive, search_path="."):
+    """Update the hashes of a session in memory
+
+    The archive is extracted to a temporary directory for
+    `update_session_hashes` and the changes are read back.
+    Do not call this method for sessions saved with ShapeOut 0.7.6
+    or later.
     """
-    mfile = pathlib.Path(mfile)
-    for adir in directories:
-        for root, _ds, fs in os.walk(str(adir)):
-            root = pathlib.Path(root)
-            if mfile.name in fs:
-                this_file = root / mfile.name
-                if version < LooseVersion("0.7.6"):
-                    saved_hash = index_item["tdms hash"]
-                    check_hash = hashfile_sha(this_file)
-                    if saved_hash == check_hash:
-                        return this_file
-                else:
-                    datahash = dclab.new_dataset(this_file).hash
-                    if datahash == index_item["hash"]:
-                        return this_file
-
-
-def update_session_hashes(tempdir, search_path="."):
+    tempdir = pathlib.Path(tempfile.mkdtemp(prefix="ShapeOut-session-hash_"))
+    try:
+        archive.extract(tempdir)
+        update_session_hashes(tempdir, search_path=search_path)
+        changed = SessionArchive(tempdir)
+    finally:
+        shutil.rmtree(str(tempdir), ignore_errors=True)
+    for name in changed.names():
+        archive.write_bytes(name, changed.read_bytes(name))
+
+
+def update_session_hashes(tempdir, search_path=".", workers=HASH_WORKERS):
     """Find all hierarchy children and compute correct hash
 
     - Replace old hashes with new hashes
@@ -522,7 +551,8 @@ def update_session_hashes(tempdir, search_path="."):
 
     This method assumes that the paths to the measurement files
     are correct. It is therefore not included in the
-    `compatibilitize_session` method.
+    `compatibilitize_session` method. The measurement files are
+    opened and hashed in `workers` threads.
     """
     tempdir = pathlib.Path(tempdir)
     index_dict = index.index_load(tempdir)
@@ -534,20 +564,37 @@ def update_session_hashes(tempdir, search_path="."):
         else:
             parents.append(key)
 
-    datasets = {}
-    hashes = {}
-    # First compute old and new hashes of the parents
-    for pp in parents:
+    def open_parent(pp):
         item = index_dict[pp]
         path = index.find_data_path(item, search_path=search_path)
-        assert "tdms hash" in item
-        # We have two ways to check data hashes
-        old = old_tdms_saved_hash(item)
         cfgfile = tempdir / item["config"]
         cfg = Configuration(files=[cfgfile])
         mm = dclab.new_dataset(path)
         mm.config.update(cfg)
         mm.apply_filter()
+        # compute the hash in the worker thread
+        mm.hash
+        return path, mm
+
+    # The parent measurements are opened and hashed concurrently.
+    if workers > 1 and len(parents) > 1:
+        pool = ThreadPool(min(workers, len(parents)))
+        try:
+            opened = pool.map(open_parent, parents)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        opened = [open_parent(pp) for pp in parents]
+
+    datasets = {}
+    hashes = {}
+    # First compute old and new hashes of the parents
+    for pp, (path, mm) in zip(parents, opened):
+        item = index_dict[pp]
+        assert "tdms hash" in item
+        # We have two ways to check data hashes
+        old = old_tdms_saved_hash(item)
         datasets[pp] = mm
         # record parent hashes
         hashes[pp] = [old, mm.hash]
@@ -75,9 +75,18 @@ def index_check(index_file, search_path="./"):
     index_file = pathlib.Path(index_file)
     if index_file.is_dir():
         index_file = index_file / "index.txt"
+    return index_check_dict(index_load(index_file), search_path)
+
+
+def index_check_dict(index_dict, search_path="./"):
+    """Check an index dictionary for existence of all measurement files
+
+    See Also
+    --------
+    index_check: the same for index files
+    """
     missing_files = []
 
-    index_dict = index_load(index_file)
     keys = list(index_dict.keys())
     # The identifier (in brackets []) contains a number before the first
     # underscore "_" which determines the order of the plots:
@@ -108,14 +117,16 @@ def index_load(index_file):
         Dictionary containing all index information
     """
     index_file = pathlib.Path(index_file)
-    cfg = {}
-
     if index_file.is_dir():
         index_file = index_file / "index.txt"
     with index_file.open() as f:
-        code = f.readlines()
+        return index_loads(f.read())
 
-    for line in code:
+
+def index_loads(data):
+    """Load an index from a string (see `index_load`)"""
+    cfg = {}
+    for line in data.split("\n"):
         # We need to check line length first and then we look for
         # a hash.
         line = line.strip()
@@ -149,6 +160,12 @@ def index_save(index_file, index_dict, save_version=version):
     index_file = pathlib.Path(index_file)
     if index_file.is_dir():
         index_file = index_file / "index.txt"
+    with index_file.open("w") as f:
+        f.write(index_dumps(index_dict, save_version=save_version))
+
+
+def index_dumps(index_dict, save_version=version):
+    """Return the contents of an index file as a string"""
     out = ["# ShapeOut measurement index",
            "# Software version {}".format(save_version)
            ]
@@ -165,8 +182,7 @@ def index_save(index_file, index_dict, save_version=version):
 
     for i in range(len(out)):
         out[i] = out[i]+"\n"
-    with index_file.open("w") as f:
-        f.writelines(out)
+    return "".join(out)
 
 
 def index_update(index_file, index_dict):
@@ -201,9 +217,17 @@ def index_version(index_file):
         index_file = index_file / "index.txt"
     # Obtain version of session
     with index_file.open("r") as fd:
-        data = fd.readlines()
+        return index_version_loads(fd.read())
 
-    for line in data:
+
+def index_version_loads(data):
+    """Obtain the ShapeOut version from an index string
+
+    See Also
+    --------
+    index_version: the same for index files
+    """
+    for line in data.split("\n"):
         line = line.lower().strip()
         if (line.startswith("#") and
                 line.count("software version")):
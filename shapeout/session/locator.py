@@ -0,0 +1,287 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - locate missing measurement files of sessions
+
+The candidate directories are traversed only once and the hashes
+of the measurement files are computed concurrently (memory-mapped)
+and cached on disk (see `HASH_CACHE`).
+"""
+from __future__ import division, print_function, unicode_literals
+
+from distutils.version import LooseVersion
+import hashlib
+import mmap
+from multiprocessing.pool import ThreadPool
+import os
+import pathlib
+
+import dclab
+
+from .. import cache_store
+
+
+#: name of the hash cache in the user cache directory
+HASH_CACHE = "shapeout_session_hashes.db"
+
+#: maximum number of entries in the hash cache
+HASH_CACHE_SIZE = 100000
+
+#: default number of threads for hashing files
+HASH_WORKERS = 4
+
+#: file name extensions of measurement files
+MEASUREMENT_SUFFIXES = [".rtdc", ".tdms"]
+
+
+class MeasurementLocator(object):
+    def __init__(self, directories=[], cache_dir=None,
+                 workers=HASH_WORKERS):
+        """Find measurement files by name and hash
+
+        Parameters
+        ----------
+        directories: list of str
+            Directories to search recursively (in this order)
+        cache_dir: str or None
+            Directory of the hash cache; defaults to the user
+            cache directory.
+        workers: int
+            Number of threads for hashing candidate files
+            (see `hash_files`)
+
+        Notes
+        -----
+        All directories are traversed once and the paths of the
+        measurement files (see `MEASUREMENT_SUFFIXES`) are indexed
+        by their file name. Directories that are already contained
+        in a traversed directory are not traversed again.
+        """
+        self.cache_dir = cache_dir
+        self.workers = workers
+        #: search order
+        self.directories = []
+        #: traversed directories
+        self._walked = set()
+        #: measurement files {name: [path, ...]}
+        self._files = {}
+        for adir in directories:
+            self.add_directory(adir, first=False)
+
+    def add_directory(self, directory, first=True):
+        """Add a search directory
+
+        Parameters
+        ----------
+        directory: str
+            Directory to search recursively
+        first: bool
+            If `True`, the directory is searched before all other
+            directories, otherwise after all other directories.
+        """
+        directory = pathlib.Path(directory).resolve()
+        if directory in self.directories:
+            self.directories.remove(directory)
+        if first:
+            self.directories.insert(0, directory)
+        else:
+            self.directories.append(directory)
+        if not self._is_walked(directory):
+            self._walk(directory)
+
+    def find(self, mfile, index_item, version):
+        """Find a measurement file
+
+        Parameters
+        ----------
+        mfile: str
+            The original path of the measurement file.
+        index_item: dict
+            Dictionary of this measurement file obtained from the
+            index.txt file of a session (see `index` submodule).
+        version: distutils.version.LooseVersion
+            The version of ShapeOut used to save the session
+            (for backwards compatibility).
+
+        Returns
+        -------
+        ffile: pathlib.Path or None
+            Path to the found measurement file.
+        """
+        name = pathlib.Path(mfile).name
+        # candidates in search order
+        candidates = []
+        for adir in self.directories:
+            for path in self._files.get(name, []):
+                if (path not in candidates and
+                        _is_relative_to(path, adir)):
+                    candidates.append(path)
+        if version < LooseVersion("0.7.6"):
+            method = "sha256"
+            saved_hash = index_item["tdms hash"]
+        else:
+            method = "dataset"
+            saved_hash = index_item["hash"]
+        # hash `workers` candidates at a time
+        for ii in range(0, len(candidates), self.workers):
+            chunk = candidates[ii:ii+self.workers]
+            hashes = hash_files(chunk,
+                                method=method,
+                                workers=self.workers,
+                                cache_dir=self.cache_dir,
+                                ignore_errors=True)
+            for path, phash in zip(chunk, hashes):
+                if phash == saved_hash:
+                    return path
+
+    def _is_walked(self, directory):
+        for wdir in self._walked:
+            if _is_relative_to(directory, wdir):
+                return True
+        return False
+
+    def _walk(self, directory):
+        """Index the measurement files of a directory tree"""
+        for root, dirs, files in os.walk(str(directory)):
+            root = pathlib.Path(root)
+            # do not traverse directories twice
+            dirs[:] = [dd for dd in dirs if root / dd not in self._walked]
+            for ff in files:
+                if os.path.splitext(ff)[1] in MEASUREMENT_SUFFIXES:
+                    self._files.setdefault(ff, []).append(root / ff)
+        # remove contained directories
+        self._walked = set([wd for wd in self._walked
+                            if not _is_relative_to(wd, directory)])
+        self._walked.add(directory)
+
+
+def get_hash(path, method, cache_dir=None):
+    """Return the (cached) hash of a measurement file
+
+    Parameters
+    ----------
+    path: str
+        Path to the measurement file
+    method: str
+        "sha256" for the sha256 hash of the file (sessions from
+        ShapeOut <0.7.6) or "dataset" for the hash of the dataset
+        (`dclab.new_dataset(path).hash`)
+    cache_dir: str or None
+        Directory of the hash cache; defaults to the user cache
+        directory.
+
+    Notes
+    -----
+    The cache key consists of the method and the path, size, and
+    modification time of the file (for tdms files also of the
+    configuration files used for the dataset hash).
+    """
+    path = pathlib.Path(path)
+    paths = [path]
+    if method == "dataset" and path.suffix == ".tdms":
+        mx = path.name.split("_")[0]
+        paths += [path.parent / (mx + "_camera.ini"),
+                  path.parent / (mx + "_para.ini")]
+    keys = [method] + [cache_store.get_stat_key(pp) for pp in paths
+                       if pp.exists()]
+    key = "|".join(keys)
+    cache = cache_store.get_store(name=HASH_CACHE,
+                                  directory=cache_dir,
+                                  max_entries=HASH_CACHE_SIZE)
+    try:
+        value = cache.get(key)
+    except KeyError:
+        if method == "sha256":
+            value = hashfile_sha(path)
+        elif method == "dataset":
+            value = dclab.new_dataset(path).hash
+        else:
+            raise ValueError("Unknown hash method: {}".format(method))
+        cache.set(key, value)
+    return value
+
+
+def hash_files(paths, method="sha256", workers=HASH_WORKERS,
+               cache_dir=None, ignore_errors=False):
+    """Return the (cached) hashes of several files
+
+    The files are hashed concurrently in a thread pool; `hashlib`
+    releases the global interpreter lock while hashing and reading
+    from disk does not block the other threads.
+
+    Parameters
+    ----------
+    paths: list of str
+        Paths to the measurement files
+    method: str
+        Hash method (see `get_hash`)
+    workers: int
+        Number of threads
+    cache_dir: str or None
+        Directory of the hash cache (see `get_hash`)
+    ignore_errors: bool
+        If `True`, the hash of files that cannot be read or opened
+        (e.g. broken measurements) is `None`.
+
+    Returns
+    -------
+    hashes: list of str
+        The hashes of the files
+    """
+    def hash_file(path):
+        try:
+            return get_hash(path, method=method, cache_dir=cache_dir)
+        except Exception:
+            if ignore_errors:
+                return None
+            raise
+
+    if workers > 1 and len(paths) > 1:
+        pool = ThreadPool(min(workers, len(paths)))
+        try:
+            return pool.map(hash_file, paths)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        return [hash_file(pp) for pp in paths]
+
+
+def hashfile_sha(fname, blocksize=4*1024**2):
+    """Compute sha256 hex-hash of a file
+
+    Parameters
+    ----------
+    fname: str
+        path to the file
+    blocksize: int
+        block size read from the file if the file cannot be
+        memory-mapped (e.g. empty files or 32bit systems)
+    """
+    fname = pathlib.Path(fname)
+    hasher = hashlib.sha256()
+    with fname.open('rb') as fd:
+        try:
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OverflowError, EnvironmentError):
+            buf = bytearray(blocksize)
+            view = memoryview(buf)
+            size = fd.readinto(buf)
+            while size > 0:
+                hasher.update(view[:size])
+                size = fd.readinto(buf)
+        else:
+            try:
+                hasher.update(mm)
+            finally:
+                mm.close()
+    return hasher.hexdigest()
+
+
+def _is_relative_to(path, directory):
+    """Whether `path` is `directory` or contained in `directory`"""
+    try:
+        path.relative_to(directory)
+    except ValueError:
+        return False
+    else:
+        return True
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - compact storage of manual filters in sessions
+
+Manual filters are boolean arrays with one entry per event that
+are mostly `True`. Sessions store either the indices of the
+excluded events or the bit-packed array, whichever is smaller.
+Sessions saved prior to ShapeOut 0.8.7 contain the boolean array
+("_filter_manual.npy").
+"""
+from __future__ import division, print_function, unicode_literals
+
+import io
+import time
+
+import numpy as np
+
+
+#: session member names of manual filters (relative to the
+#: measurement directory); the first existing member is used
+MANUAL_EXCLUDED = "_filter_manual_excluded.npy"
+MANUAL_PACKED = "_filter_manual_packed.npy"
+MANUAL_LEGACY = "_filter_manual.npy"
+MANUAL_NAMES = [MANUAL_EXCLUDED, MANUAL_PACKED, MANUAL_LEGACY]
+
+
+def compress_indices(indices, size):
+    """Return event indices with the smallest sufficient integer type
+
+    Parameters
+    ----------
+    indices: list or 1d ndarray of int
+        Event indices
+    size: int
+        Number of events in the data set
+    """
+    return np.asarray(indices, dtype=np.min_scalar_type(max(size - 1, 0)))
+
+
+def compress_manual(manual):
+    """Compact representation of a manual filter
+
+    Parameters
+    ----------
+    manual: 1d boolean ndarray
+        The manual filter (`False` for excluded events)
+
+    Returns
+    -------
+    name: str
+        Session member name (`MANUAL_EXCLUDED` or `MANUAL_PACKED`)
+    data: 1d ndarray
+        Indices of the excluded events or the bit-packed filter
+    """
+    manual = np.asarray(manual, dtype=bool)
+    excluded = np.where(~manual)[0]
+    dtype = np.min_scalar_type(max(manual.size - 1, 0))
+    if excluded.size * dtype.itemsize <= (manual.size + 7) // 8:
+        return MANUAL_EXCLUDED, excluded.astype(dtype)
+    else:
+        return MANUAL_PACKED, np.packbits(manual)
+
+
+def decompress_manual(name, data, size):
+    """Restore a manual filter from its session representation
+
+    Parameters
+    ----------
+    name: str
+        Session member name (one of `MANUAL_NAMES`)
+    data: 1d ndarray
+        Data stored in the session member
+    size: int
+        Number of events in the data set
+
+    Returns
+    -------
+    manual: 1d boolean ndarray
+        The manual filter
+    """
+    if name == MANUAL_EXCLUDED:
+        manual = np.ones(size, dtype=bool)
+        manual[data] = False
+    elif name == MANUAL_PACKED:
+        if data.size != (size + 7) // 8:
+            raise ValueError("Packed manual filter does not match "
+                             + "{} events!".format(size))
+        manual = np.unpackbits(data)[:size].astype(bool)
+    elif name == MANUAL_LEGACY:
+        manual = np.asarray(data, dtype=bool)
+    else:
+        raise ValueError("Unknown manual filter member: {}".format(name))
+    return manual
+
+
+def benchmark(size=5000000, fractions=[0, 1e-5, 1e-3, .1, .5],
+              seed=42):
+    """Benchmark compact manual filter storage against `np.save`
+
+    Parameters
+    ----------
+    size: int
+        Number of events of the synthetic manual filters
+    fractions: list of float
+        Fractions of manually excluded events
+    seed: int
+        Seed for choosing the excluded events
+
+    Returns
+    -------
+    results: dict of dicts
+        For each fraction, the keys "legacy size" and "size" [B],
+        "legacy save time", "save time", "legacy load time", and
+        "load time" [s], as well as the chosen member "name".
+    """
+    rs = np.random.RandomState(seed)
+    results = {}
+    for frac in fractions:
+        manual = np.ones(size, dtype=bool)
+        manual[rs.choice(size, int(size*frac), replace=False)] = False
+        res = {}
+        # legacy: boolean array
+        t0 = time.time()
+        data = array_dumps(manual)
+        res["legacy save time"] = time.time() - t0
+        res["legacy size"] = len(data)
+        t0 = time.time()
+        assert np.all(array_loads(data) == manual)
+        res["legacy load time"] = time.time() - t0
+        # compact
+        t0 = time.time()
+        name, cdata = compress_manual(manual)
+        data = array_dumps(cdata)
+        res["save time"] = time.time() - t0
+        res["size"] = len(data)
+        res["name"] = name
+        t0 = time.time()
+        restored = decompress_manual(name, array_loads(data), size)
+        assert np.all(restored == manual)
+        res["load time"] = time.time() - t0
+        results[frac] = res
+    return results
+
+
+def array_dumps(array):
+    """Return the .npy file contents of an array"""
+    fd = io.BytesIO()
+    np.save(fd, array)
+    return fd.getvalue()
+
+
+def array_loads(data):
+    """Return the array stored in .npy file contents"""
+    return np.load(io.BytesIO(data))
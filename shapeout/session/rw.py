@@ -1,21 +1,30 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-"""ShapeOut - session saving"""
+"""ShapeOut - session loading and saving"""
 from __future__ import division, print_function, unicode_literals
 
-import os
 import pathlib
-import shutil
-import tempfile
+import posixpath
+import threading
 import warnings
 import zipfile
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 
 from dclab import new_dataset
 from dclab.polygon_filter import PolygonFilter
 from dclab.rtdc_dataset import Configuration
-from . import conversion, index
+from dclab.rtdc_dataset.util import hashobj
+
+from .._version import version
+from . import conversion, index, manual
+from .archive import FORMAT_VERSION, MANIFEST, SessionArchive, \
+    config_dict, manifest_dumps
+
+
+#: default number of threads for loading session measurements
+LOAD_WORKERS = 4
 
 
 class HashComparisonWarning(UserWarning):
@@ -26,21 +35,172 @@ class UnsupportedDataClassSaveError(BaseException):
     pass
 
 
+class SessionHierarchyError(BaseException):
+    pass
+
+
 class SessionIndexFileMissingError(BaseException):
     pass
 
 
-def load(path, search_path="."):
+class LazyMeasurement(object):
+    def __init__(self, entry, config, hparent, arc, search_path, opener):
+        """A session measurement that is opened on first access
+
+        The title, identifier, hash, and configuration are taken from
+        the session. Accessing any other attribute (e.g. `filter` or
+        `hparent`), a feature, or the length of the measurement opens
+        the measurement file and applies the filters (`attach`).
+
+        Parameters
+        ----------
+        entry: dict
+            Measurement entry of the session manifest
+            (see `archive.SessionArchive.get_manifest`)
+        config: dclab.rtdc_dataset.Configuration
+            Configuration of the measurement
+        hparent: LazyMeasurement or None
+            Hierarchy parent
+        arc: shapeout.session.archive.SessionArchive
+            The session
+        search_path: str
+            Search path for the measurement file (see `load`)
+        opener: callable
+            Opens and filters the measurement (used by `load`)
+        """
+        self._entry = entry
+        self._hparent = hparent
+        self._arc = arc
+        self._search_path = search_path
+        self._opener = opener
+        self._dataset = None
+        self._lock = threading.Lock()
+        mm_dict = entry["index"]
+        self._session = {"config": config,
+                         "hash": mm_dict.get("hash"),
+                         "identifier": mm_dict["identifier"],
+                         "title": mm_dict["title"],
+                         }
+
+    def __contains__(self, key):
+        return key in self.attach()
+
+    def __getattr__(self, name):
+        # only called for attributes not defined by this class
+        if self._dataset is None and name in self._session:
+            return self._session[name]
+        return getattr(self.attach(), name)
+
+    def __getitem__(self, key):
+        return self.attach()[key]
+
+    def __iter__(self):
+        return iter(self.attach())
+
+    def __len__(self):
+        return len(self.attach())
+
+    def __repr__(self):
+        if self._dataset is None:
+            return "<LazyMeasurement '{}' (not attached)>".format(
+                self._session["title"])
+        return "<LazyMeasurement {}>".format(repr(self._dataset))
+
+    def __setattr__(self, name, value):
+        if name.startswith("_"):
+            super(LazyMeasurement, self).__setattr__(name, value)
+        elif self._dataset is None and name == "title":
+            self._session[name] = value
+        else:
+            setattr(self.attach(), name, value)
+
+    @property
+    def attached(self):
+        """Whether the measurement was opened"""
+        return self._dataset is not None
+
+    def attach(self):
+        """Open and filter the measurement and return it
+
+        The hierarchy parents are attached first. Changes of the
+        title and configuration are applied to the measurement.
+        """
+        with self._lock:
+            if self._dataset is None:
+                if self._hparent is None:
+                    hparent = None
+                else:
+                    hparent = self._hparent.attach()
+                mm, tloc = self._opener(self._entry["key"],
+                                        hparent=hparent,
+                                        title=self._session["title"],
+                                        config=self._session["config"])
+                if tloc is not None:
+                    msg = "File hashes don't match for: {}".format(tloc)
+                    warnings.warn(msg, HashComparisonWarning)
+                self._dataset = mm
+        return self._dataset
+
+    def _get_state_entry(self, rtdc_list):
+        """Session state entry (see `get_session_state`) from the session
+
+        The measurement is not attached.
+        """
+        mm_dict = self._entry["index"]
+        filters = self._entry["filter"]
+        entry = {"title": self._session["title"],
+                 "hash": self._session["hash"],
+                 "identifier": self._session["identifier"],
+                 "config": self._session["config"].copy(),
+                 }
+        if self._hparent is None:
+            path = index.find_data_path(mm_dict, self._search_path)
+            entry["path"] = pathlib.Path(path)
+            if entry["path"].suffix == ".tdms":
+                entry["format"] = "tdms"
+            else:
+                entry["format"] = "hdf5"
+            if "manual" in filters:
+                name = posixpath.basename(filters["manual"])
+                data = self._arc.get_array(filters["manual"])
+                if name == manual.MANUAL_LEGACY:
+                    name, data = manual.compress_manual(data)
+            else:
+                name = manual.MANUAL_EXCLUDED
+                data = np.zeros(0, dtype=np.uint8)
+            entry["manual"] = (name, data)
+        else:
+            entry["format"] = "hierarchy"
+            entry["parent index"] = _get_list_index(rtdc_list,
+                                                    self._hparent) + 1
+            entry["parent identifier"] = self._hparent.identifier
+            entry["parent hash"] = self._hparent.hash
+            if "manual root" in filters:
+                entry["manual root"] = self._arc.get_array(
+                    filters["manual root"])
+            else:
+                entry["manual root"] = np.zeros(0, dtype=np.uint8)
+        return entry
+
+
+def load(path, search_path=".", workers=LOAD_WORKERS, lazy=False):
     """Open a ShapeOut session
 
     Parameters
     ----------
-    path: str
+    path: str or shapeout.session.archive.SessionArchive
         Path to a ShapeOut session file or a directory containing
         the extracted file.
     search_path : str
         Relative search path where to look for measurement files if
         the absolute path stored in index.txt cannot be found.
+    workers: int
+        Number of threads for loading measurements; hierarchy
+        children are loaded in the thread of their root measurement.
+    lazy: bool
+        If set to `True`, a list of `LazyMeasurement` is returned;
+        the measurement files are opened and filtered on first
+        access (`workers` is ignored).
 
     Notes
     -----
@@ -49,95 +209,249 @@ def load(path, search_path="."):
     and the `search_path` parameter. If this is not the case, please
     use `conversion.search_hashed_measurement`.
     """
-    path = pathlib.Path(path)
-    if path.is_file():
-        # extract it first
-        arc = zipfile.ZipFile(str(path.resolve()), mode='r')
-        tempdir = tempfile.mkdtemp(prefix="ShapeOut-session-load_")
-        tempdir = pathlib.Path(tempdir)
-        arc.extractall(str(tempdir))
-        arc.close()
-        cleanup = True
+    if isinstance(path, SessionArchive):
+        arc = path
     else:
-        tempdir = path
-        cleanup = False
-
-    # Support older measurement files
-    conversion.compatibilitize_session(str(tempdir),
-                                       search_path=str(search_path))
+        # The session is not extracted; all files are kept in memory.
+        arc = SessionArchive(path)
 
     # load index
-    index_file = tempdir / "index.txt"
-    if not index_file.exists():
-        msg = "Index file must be in {}!".format(tempdir)
+    if arc.format_version is None:
+        msg = "Index file must be in {}!".format(arc.path)
         raise SessionIndexFileMissingError(msg)
 
-    index_dict = index.index_load(index_file)
+    # Support older measurement files
+    conversion.compatibilitize_archive(arc, search_path=str(search_path))
+    if arc.path.is_dir():
+        # update the extracted files
+        arc.save()
+
+    manifest = arc.get_manifest()
+    entries = dict((me["key"], me) for me in manifest["measurements"])
 
     # Load polygons before importing any data
-    polygonfile = tempdir / "PolygonFilters.poly"
     PolygonFilter.clear_all_filters()
-    if polygonfile.exists():
-        PolygonFilter.import_all(polygonfile)
-
-    # get configurations
-    keys = list(index_dict.keys())
-    # The identifier (in brackets []) contains a number before the first
-    # underscore "_" which determines the order of the plots:
-    # keys.sort(key=lambda x: int(x.split("_")[0]))
-    rtdc_list = [None]*len(keys)
-    while rtdc_list.count(None):
-        for key in keys:
-            # The order in keys is not important to correctly reproduce
-            # a session. Important is the integer number before the
-            # underscore.
-            kidx = int(key.split("_")[0])-1
-            if rtdc_list[kidx] is not None:
-                # we have already imported that measurement
-                continue
-
-            mm_dict = index_dict[key]
-            config_file = tempdir / mm_dict["config"]
-            config_dir = config_file.parent
-            cfg = Configuration(files=[config_file])
-
-            # Start importing data
-            if ("special type" in mm_dict and
-                    mm_dict["special type"] == "hierarchy child"):
-                # check if parent is already here
-                pidx = int(mm_dict["parent key"].split("_")[0])-1
-                hparent = rtdc_list[pidx]
-                if hparent is not None:
-                    mm = new_dataset(hparent, identifier=mm_dict["identifier"])
-                    # apply manually excluded events
-                    root_idx_file = config_dir / "_filter_manual_root.npy"
-                    if root_idx_file.exists():
-                        root_idx = np.load(str(root_idx_file))
-                        mm.filter.apply_manual_indices(root_idx)
+    for kwargs in manifest["polygons"]:
+        PolygonFilter(**kwargs)
+
+    # Build the hierarchy tree (children of each measurement).
+    # The key contains a number before the first underscore "_"
+    # which determines the order of the plots.
+    children = dict([(key, []) for key in entries])
+    roots = []
+    for key in sorted(entries, key=_get_key_index):
+        mm_dict = entries[key]["index"]
+        if mm_dict.get("special type") == "hierarchy child":
+            pkey = mm_dict["parent key"]
+            if pkey not in children:
+                raise SessionHierarchyError(
+                    "Parent {} of {} not in session!".format(pkey, key))
+            children[pkey].append(key)
+        else:
+            roots.append(key)
+
+    # topological order: parents are loaded before their children
+    trees = []
+    for root in roots:
+        tree = [root]
+        for key in tree:
+            tree += children[key]
+        trees.append(tree)
+
+    loaded = sum(trees, [])
+    if len(loaded) != len(entries):
+        missing = sorted(set(entries) - set(loaded))
+        raise SessionHierarchyError(
+            "Circular hierarchy in session: {}".format(missing))
+
+    configs = {}
+    for key in entries:
+        configs[key] = Configuration(cfg=entries[key]["config"])
+
+    def open_measurement(key, hparent, title, config):
+        """Open and filter a measurement
+
+        Returns the measurement and the measurement file (`None` for
+        hierarchy children) if its hash does not match the session.
+        """
+        mm_dict = entries[key]["index"]
+        filters = entries[key]["filter"]
+        mismatch = None
+        if hparent is not None:
+            mm = new_dataset(hparent, identifier=mm_dict["identifier"])
+            # apply manually excluded events
+            if "manual root" in filters:
+                root_idx = arc.get_array(filters["manual root"])
+                mm.filter.apply_manual_indices(root_idx)
+        else:
+            tloc = index.find_data_path(mm_dict, search_path)
+            mm = new_dataset(tloc, identifier=mm_dict["identifier"])
+            # Only check for hashes when there is an experimental file
+            if mm.hash != mm_dict["hash"]:
+                mismatch = tloc
+
+        # Load manually excluded events
+        if "manual" in filters:
+            mm.filter.manual[:] = manual.decompress_manual(
+                name=posixpath.basename(filters["manual"]),
+                data=arc.get_array(filters["manual"]),
+                size=mm.filter.manual.size)
+
+        mm.title = title
+        mm.config.update(config)
+        mm.apply_filter()
+        return mm, mismatch
+
+    if lazy:
+        rtdc_list = [None]*len(entries)
+        for tree in trees:
+            for key in tree:
+                pkey = entries[key]["index"].get("parent key")
+                if pkey is None:
+                    hparent = None
                 else:
-                    # parent doesn't exist - try again in next loop
-                    continue
-            else:
-                tloc = index.find_data_path(mm_dict, search_path)
-                mm = new_dataset(tloc, identifier=mm_dict["identifier"])
-                # Only check for hashes when there is an experimental file
-                if mm.hash != mm_dict["hash"]:
-                    msg = "File hashes don't match for: {}".format(tloc)
-                    warnings.warn(msg, HashComparisonWarning)
+                    hparent = rtdc_list[_get_key_index(pkey)]
+                rtdc_list[_get_key_index(key)] = LazyMeasurement(
+                    entry=entries[key],
+                    config=configs[key],
+                    hparent=hparent,
+                    arc=arc,
+                    search_path=search_path,
+                    opener=open_measurement)
+        return rtdc_list
+
+    def load_tree(tree):
+        """Load a measurement and all its hierarchy children"""
+        datasets = {}
+        mismatch = []
+        for key in tree:
+            mm_dict = entries[key]["index"]
+            hparent = datasets.get(mm_dict.get("parent key"))
+            mm, tloc = open_measurement(key,
+                                        hparent=hparent,
+                                        title=mm_dict["title"],
+                                        config=configs[key])
+            if tloc is not None:
+                mismatch.append(tloc)
+            datasets[key] = mm
+        return datasets, mismatch
+
+    # The trees of the measurements are independent and are
+    # loaded concurrently (file access and hashing).
+    if workers > 1 and len(trees) > 1:
+        pool = ThreadPool(min(workers, len(trees)))
+        try:
+            results = pool.map(load_tree, trees)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        results = [load_tree(tree) for tree in trees]
+
+    rtdc_list = [None]*len(entries)
+    for datasets, mismatch in results:
+        # warnings are issued in the main thread (`warnings.catch_warnings`
+        # is used by the GUI)
+        for tloc in mismatch:
+            msg = "File hashes don't match for: {}".format(tloc)
+            warnings.warn(msg, HashComparisonWarning)
+        for key in datasets:
+            rtdc_list[_get_key_index(key)] = datasets[key]
+
+    return rtdc_list
 
-            # Load manually excluded events
-            filter_manual_file = config_dir / "_filter_manual.npy"
-            if filter_manual_file.exists():
-                mm.filter.manual[:] = np.load(str(filter_manual_file))
 
-            mm.title = mm_dict["title"]
-            mm.config.update(cfg)
-            mm.apply_filter()
-            rtdc_list[kidx] = mm
+def _get_key_index(key):
+    """Return the list index of a session index key (e.g. "2_a1b2")"""
+    return int(key.split("_")[0])-1
 
-    if cleanup:
-        shutil.rmtree(str(tempdir), ignore_errors=True)
-    return rtdc_list
+
+def _get_list_index(rtdc_list, mm):
+    """Return the index of a measurement in a list
+
+    Attached `LazyMeasurement` instances match their measurement.
+    """
+    for ii, item in enumerate(rtdc_list):
+        if item is mm or (isinstance(item, LazyMeasurement) and
+                          item._dataset is mm and mm is not None):
+            return ii
+    raise ValueError("Measurement not in list: {}".format(mm))
+
+
+def _get_root(mm):
+    """Return the root parent of a hierarchy child"""
+    while mm.format == "hierarchy":
+        mm = mm.hparent
+    return mm
+
+
+def get_session_state(rtdc_list):
+    """Return a snapshot of the data that `save` writes to a session
+
+    The snapshot consists of copies of the configurations, the
+    (compressed) manual filters, and the polygon filters; no files
+    are accessed. Use `save_state` to write the snapshot to a
+    session file (e.g. in a background thread while the measurements
+    are modified).
+
+    Parameters
+    ----------
+    rtdc_list: list of RTDCBase or LazyMeasurement instances
+        The measurements to save in the session; measurements
+        that are not attached are saved as loaded.
+    """
+    entries = []
+    for mm in rtdc_list:
+        if isinstance(mm, LazyMeasurement) and not mm.attached:
+            entries.append(mm._get_state_entry(rtdc_list))
+            continue
+        if mm.format not in ["hdf5", "hierarchy", "tdms"]:
+            msg = "RT-DC dataset must be from data file or hierarchy child!"
+            raise UnsupportedDataClassSaveError(msg)
+        entry = {"title": mm.title,
+                 "hash": mm.hash,
+                 "identifier": mm.identifier,
+                 "format": mm.format,
+                 "config": mm.config.copy(),
+                 }
+        if mm.format in ["tdms", "hdf5"]:
+            entry["path"] = pathlib.Path(mm.path)
+            entry["manual"] = manual.compress_manual(mm.filter.manual)
+        else:
+            entry["parent index"] = _get_list_index(rtdc_list,
+                                                    mm.hparent) + 1
+            entry["parent identifier"] = mm.hparent.identifier
+            entry["parent hash"] = mm.hparent.hash
+            # (possibly hidden) root filter indices
+            entry["manual root"] = manual.compress_indices(
+                mm.filter.retrieve_manual_indices(), len(_get_root(mm)))
+        entries.append(entry)
+    polygons = []
+    for pf in PolygonFilter.instances:
+        polygons.append({"axes": list(pf.axes),
+                         "points": pf.points.tolist(),
+                         "inverted": pf.inverted,
+                         "name": pf.name,
+                         "unique_id": pf.unique_id,
+                         })
+    return {"measurements": entries, "polygons": polygons}
+
+
+def get_state_fingerprint(state):
+    """Return a hash of a session state (see `get_session_state`)
+
+    The fingerprint changes when the titles, configurations,
+    manual filters, or polygon filters of the session change.
+    """
+    tohash = [manifest_dumps(state["polygons"])]
+    for entry in state["measurements"]:
+        for key in sorted(entry.keys()):
+            value = entry[key]
+            if key == "config":
+                # sorted string representation
+                value = repr(value)
+            tohash += [key, value]
+    return hashobj(tohash)
 
 
 def save(path, rtdc_list):
@@ -147,91 +461,81 @@ def save(path, rtdc_list):
     ----------
     path: str
         Path to a file where the session will be saved.
-    rtdc_list: list of RTDCBase instances
+    rtdc_list: list of RTDCBase or LazyMeasurement instances
         The measurements to save in the session
 
 
     Notes
     -----
-    The session file is a .zip file with an index and all
-    relevant configuration data to reproduce the list of
-    RTDCBase instances.
+    The session file is a .zip file with a manifest containing the
+    index, the configurations, and the polygon filters as well as
+    the manual filters of each measurement (session format version
+    2, see `archive`) to reproduce the list of RTDCBase instances.
+    """
+    save_state(path, get_session_state(rtdc_list))
+
+
+def save_state(path, state):
+    """Save a snapshot of a ShapeOut session
+
+    Parameters
+    ----------
+    path: str
+        Path to a file where the session will be saved.
+    state: dict
+        Session state returned by `get_session_state`
     """
     path = pathlib.Path(path)
-    tempdir = pathlib.Path(tempfile.mkdtemp(prefix="ShapeOut-session-save"))
-    # Dump data into the temporary directory
-    index_file = tempdir / "index.txt"
-    index_dict = {}
+    measurements = []
+    # binary session members {name: ndarray}
+    payloads = {}
 
-    i = 0
-    for mm in rtdc_list:
-        if mm.format not in ["hdf5", "hierarchy", "tdms"]:
-            msg = "RT-DC dataset must be from data file or hierarchy child!"
-            raise UnsupportedDataClassSaveError(msg)
-        i += 1
-        ident = "{}_{}".format(i, mm.identifier)
-        # the directory in the session zip file where all information
-        # will be stored:
-        mmdir = tempdir / ident
-        while True:
-            # If the directory already exists, append a number to that
-            # directory to distinguish different measurements.
-            g = 0
-            if mmdir.exists():
-                mmdir = mmdir.with_name(ident + str(g))
-                g += 1
-            else:
-                break
-        ident = mmdir.name
-        mmdir.mkdir()
+    for ii, entry in enumerate(state["measurements"]):
+        key = "{}_{}".format(ii + 1, entry["identifier"])
+        # Index values are strings (compatible to format version 1).
         mm_dict = {}
-        mm_dict["title"] = mm.title
-        mm_dict["hash"] = mm.hash
-        mm_dict["identifier"] = mm.identifier
-        if mm.format in ["tdms", "hdf5"]:
-            mm_dict["name"] = pathlib.Path(mm.path).name
-            mm_dict["fdir"] = pathlib.Path(mm.path).parent
+        mm_dict["title"] = "{}".format(entry["title"])
+        mm_dict["hash"] = "{}".format(entry["hash"])
+        mm_dict["identifier"] = "{}".format(entry["identifier"])
+        filters = {}
+        if entry["format"] in ["tdms", "hdf5"]:
+            mm_dict["name"] = "{}".format(entry["path"].name)
+            mm_dict["fdir"] = "{}".format(entry["path"].parent)
             try:
                 # On Windows we have multiple drive letters and
                 # relpath will complain about that if dirname(mm.path)
                 # and rel_path are not on the same drive.
-                rdir = str(pathlib.Path(mm.path).relative_to(path.parent))
+                rdir = str(entry["path"].relative_to(path.parent))
             except ValueError:
                 rdir = "."
             mm_dict["rdir"] = rdir
             # save manual filters file only for real data
-            np.save(str(mmdir / "_filter_manual.npy"), mm.filter.manual)
-        elif mm.format == "hierarchy":
-            pidx = rtdc_list.index(mm.hparent) + 1
-            p_ident = "{}_{}".format(pidx, mm.hparent.identifier)
+            name, data = entry["manual"]
+            filters["manual"] = "{}/{}".format(key, name)
+            payloads[filters["manual"]] = data
+        elif entry["format"] == "hierarchy":
+            p_ident = "{}_{}".format(entry["parent index"],
+                                     entry["parent identifier"])
             mm_dict["special type"] = "hierarchy child"
-            mm_dict["parent hash"] = mm.hparent.hash
+            mm_dict["parent hash"] = "{}".format(entry["parent hash"])
             mm_dict["parent key"] = p_ident
             # save (possibly hidden) root filter indices instead of
             # manual filter array.
-            root_idx = mm.filter.retrieve_manual_indices()
-            np.save(str(mmdir / "_filter_manual_root.npy"), root_idx)
-        # Use forward slash such that sessions saved on Windows
-        # can be opened on *nix as well.
-        mm_dict["config"] = "{}/config.txt".format(ident)
-        index_dict[ident] = mm_dict
-        # Save configurations
-        cfgfile = mmdir / "config.txt"
-        mm.config.save(cfgfile)
-
-    # Write index
-    index.index_save(index_file, index_dict)
-
-    # Dump polygons
-    if len(PolygonFilter.instances) > 0:
-        PolygonFilter.save_all(tempdir / "PolygonFilters.poly")
-
-    # Zip everything
+            filters["manual root"] = "{}/_filter_manual_root.npy".format(key)
+            payloads[filters["manual root"]] = entry["manual root"]
+        measurements.append({"key": key,
+                             "index": mm_dict,
+                             "config": config_dict(entry["config"]),
+                             "filter": filters,
+                             })
+
+    manifest = {"format version": FORMAT_VERSION,
+                "software version": version,
+                "polygons": state["polygons"],
+                "measurements": measurements,
+                }
+
     with zipfile.ZipFile(str(path), mode='w') as arc:
-        for root, _dirs, files in os.walk(str(tempdir)):
-            for f in files:
-                fp = pathlib.Path(root) / f
-                if fp.is_file():
-                    arc.write(str(fp), str(fp.relative_to(tempdir)))
-    # cleanup
-    shutil.rmtree(str(tempdir), ignore_errors=True)
+        arc.writestr(MANIFEST, manifest_dumps(manifest))
+        for name in sorted(payloads):
+            arc.writestr(name, manual.array_dumps(payloads[name]))
@@ -4,7 +4,10 @@
 from __future__ import division, print_function
 
 import copy
+import io
+import os
 import pathlib
+import threading
 
 import appdirs
 
@@ -20,6 +23,10 @@ DEFAULTS = {"autosave session": True,
 #: data features only visible in expert mode
 EXPERT_FEATURES = ["area_cvx", "area_msd", "frame"]
 
+#: parsed settings files shared by all instances {path: (stat, dict)}
+_cache = {}
+_cache_lock = threading.RLock()
+
 
 class SettingsFile(object):
     """Manages a settings file in the user's config dir"""
@@ -38,21 +45,36 @@ class SettingsFile(object):
         self.defaults = defaults
         self.working_directories = {}
 
+    def _get_dict(self):
+        """Return the parsed settings file (do not modify)
+
+        The settings are parsed only if the file was modified
+        (by another instance or process) since the last access.
+        If the file is missing, the cached settings are returned.
+        """
+        with _cache_lock:
+            key = str(self.cfgfile)
+            try:
+                stat = _get_stat(self.cfgfile)
+                if key not in _cache or _cache[key][0] != stat:
+                    with io.open(key, "r", encoding="utf-8") as fop:
+                        fc = fop.readlines()
+                    _cache[key] = (stat, _parse(fc))
+            except (IOError, OSError):
+                # briefly removed while another process saves
+                # on Windows (see `save`)
+                if key not in _cache:
+                    raise
+            return _cache[key][1]
+
     def load(self):
         """Loads the settings file returning a dictionary"""
-        with self.cfgfile.open() as fop:
-            fc = fop.readlines()
-        cdict = {}
-        for line in fc:
-            line = line.strip()
-            var, val = line.split("=", 1)
-            cdict[var.lower().strip()] = val.strip()
-        return cdict
+        return dict(self._get_dict())
 
     def get_bool(self, key):
         """Returns boolean configuration key"""
         key = key.lower()
-        cdict = self.load()
+        cdict = self._get_dict()
         if key in cdict:
             val = cdict[key]
             if val.lower() not in ["true", "false"]:
@@ -68,7 +90,7 @@ class SettingsFile(object):
     def get_int(self, key):
         """Returns integer configuration key"""
         key = key.lower()
-        cdict = self.load()
+        cdict = self._get_dict()
         if key in cdict:
             val = cdict[key]
             if not val.isdigit():
@@ -80,7 +102,7 @@ class SettingsFile(object):
 
     def get_path(self, name=""):
         """Returns the path for label `name`"""
-        cdict = self.load()
+        cdict = self._get_dict()
         wdkey = "path {}".format(name.lower())
 
         if wdkey in cdict:
@@ -91,7 +113,13 @@ class SettingsFile(object):
         return wd
 
     def save(self, cdict):
-        """Save a settings dictionary into a file"""
+        """Save a settings dictionary into a file
+
+        The file is replaced atomically; other processes never
+        read an incomplete settings file. On Windows, the file is
+        removed before it is replaced; other instances use their
+        cached settings in the meantime.
+        """
         if not self.cfgfile:
             raise SettingsFileError("Settings path not set!")
         skeys = list(cdict.keys())
@@ -105,27 +133,41 @@ class SettingsFile(object):
                 sval = str(sval).decode("utf-8")
             outlist.append(u"{} = {}\n".format(sk, sval))
 
-        with self.cfgfile.open('w') as fop:
-            fop.writelines(outlist)
+        with _cache_lock:
+            key = str(self.cfgfile)
+            tmp = self.cfgfile.with_name(".{}.{}.tmp".format(
+                self.cfgfile.name, os.getpid()))
+            with io.open(str(tmp), "w", encoding="utf-8") as fop:
+                fop.writelines(outlist)
+            try:
+                os.rename(str(tmp), key)
+            except OSError:
+                # Windows does not replace existing files
+                os.remove(key)
+                os.rename(str(tmp), key)
+            _cache[key] = (_get_stat(self.cfgfile), _parse(outlist))
 
     def set_bool(self, key, value):
         """Sets boolean key in the settings file"""
-        cdict = self.load()
-        cdict[key.lower()] = bool(value)
-        self.save(cdict)
+        with _cache_lock:
+            cdict = self.load()
+            cdict[key.lower()] = bool(value)
+            self.save(cdict)
 
     def set_int(self, key, value):
         """Sets integer key in the settings file"""
-        cdict = self.load()
-        cdict[key.lower()] = int(value)
-        self.save(cdict)
+        with _cache_lock:
+            cdict = self.load()
+            cdict[key.lower()] = int(value)
+            self.save(cdict)
 
     def set_path(self, wd, name=""):
         """Set the path in the settings file"""
-        cdict = self.load()
-        wdkey = "path {}".format(name.lower())
-        cdict[wdkey] = wd
-        self.save(cdict)
+        with _cache_lock:
+            cdict = self.load()
+            wdkey = "path {}".format(name.lower())
+            cdict[wdkey] = wd
+            self.save(cdict)
 
 
 class SettingsFileCache(SettingsFile):
@@ -153,3 +195,22 @@ def get_ignored_features():
         # Axes that should not be displayed  by ShapeOut
         ignored = copy.copy(EXPERT_FEATURES)
     return ignored
+
+
+def _get_stat(path):
+    """Return the file system meta data that change when `path` is written
+
+    The inode changes when the file is replaced by `SettingsFile.save`.
+    """
+    stat = os.stat(str(path))
+    return stat.st_mtime, stat.st_size, stat.st_ino
+
+
+def _parse(lines):
+    """Parse the lines of a settings file into a dictionary"""
+    cdict = {}
+    for line in lines:
+        line = line.strip()
+        var, val = line.split("=", 1)
+        cdict[var.lower().strip()] = val.strip()
+    return cdict
@@ -0,0 +1,271 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - channel lengths of tdms files from the segment meta data
+
+Only the lead-in and the meta data of each segment are read; the
+channel lengths are computed from the raw data indices and the
+segment sizes. This is much faster than loading the file with
+nptdms, which reads all channel data.
+
+See the `TDMS file format specification
+<http://www.ni.com/white-paper/5696/en/>`_ for details.
+"""
+from __future__ import division, print_function, unicode_literals
+
+import io
+import os
+import struct
+
+
+#: size of the lead-in of each segment [B]
+LEAD_IN_SIZE = 28
+
+#: table of contents flags
+TOC_METADATA = 1 << 1
+TOC_NEW_OBJ_LIST = 1 << 2
+TOC_INTERLEAVED = 1 << 5
+TOC_BIG_ENDIAN = 1 << 6
+
+#: size [B] of the tdms data types
+TYPE_SIZES = {0x00: 0,  # void
+              0x01: 1,  # int8
+              0x02: 2,  # int16
+              0x03: 4,  # int32
+              0x04: 8,  # int64
+              0x05: 1,  # uint8
+              0x06: 2,  # uint16
+              0x07: 4,  # uint32
+              0x08: 8,  # uint64
+              0x09: 4,  # float32
+              0x0A: 8,  # float64
+              0x0B: 16,  # extended float
+              0x19: 4,  # float32 with unit
+              0x1A: 8,  # float64 with unit
+              0x1B: 16,  # extended float with unit
+              0x21: 1,  # boolean
+              0x44: 16,  # time stamp
+              0x08000C: 8,  # complex float32
+              0x10000D: 16,  # complex float64
+              }
+
+#: tdms string data type
+TYPE_STRING = 0x20
+
+#: raw data index values with special meaning
+INDEX_NO_DATA = 0xFFFFFFFF
+INDEX_SAME_AS_BEFORE = 0x00000000
+INDEX_DAQMX = [0x69120000, 0x69130000]
+
+#: next segment offset of a segment that was not closed properly
+INCOMPLETE_SEGMENT = 0xFFFFFFFFFFFFFFFF
+
+
+class TdmsHeaderError(BaseException):
+    pass
+
+
+def get_channel_length(path, group, channel):
+    """Return the number of values of a tdms channel
+
+    Parameters
+    ----------
+    path: str
+        Path to a tdms file
+    group: str
+        Group name, e.g. "Cell Track"
+    channel: str
+        Channel name, e.g. "time"
+
+    Returns
+    -------
+    length: int
+        Number of values in the channel; raises `KeyError`
+        if the channel does not exist.
+    """
+    lengths = get_channel_lengths(path)
+    return lengths[get_object_path(group, channel)]
+
+
+def get_channel_lengths(path):
+    """Return the number of values of all channels of a tdms file
+
+    Parameters
+    ----------
+    path: str
+        Path to a tdms file
+
+    Returns
+    -------
+    lengths: dict
+        Object paths (see `get_object_path`) and the number
+        of values of all channels.
+
+    Notes
+    -----
+    Raises `TdmsHeaderError` if the file is not a tdms file, if
+    the meta data are corrupt, or if it contains DAQmx raw data,
+    which is not supported.
+    """
+    lengths = {}
+    # current object list [[object path, (values, size)], ...]
+    objects = []
+    # last raw data index of each object
+    last_index = {}
+    with io.open(str(path), "rb") as fd:
+        fsize = os.fstat(fd.fileno()).st_size
+        pos = 0
+        while pos + LEAD_IN_SIZE <= fsize:
+            fd.seek(pos)
+            lead_in = fd.read(LEAD_IN_SIZE)
+            if lead_in[:4] != b"TDSm":
+                raise TdmsHeaderError("Not a tdms segment at byte {} of "
+                                      "{}".format(pos, path))
+            toc = struct.unpack(b"<I", lead_in[4:8])[0]
+            endian = ">" if toc & TOC_BIG_ENDIAN else "<"
+            next_offset, raw_offset = struct.unpack(
+                str(endian + "QQ"), lead_in[12:28])
+            if next_offset == INCOMPLETE_SEGMENT:
+                # segment was not closed (e.g. LabVIEW crashed); its
+                # size is unknown and it is ignored (like nptdms does)
+                break
+            if toc & TOC_NEW_OBJ_LIST:
+                objects = []
+            if toc & TOC_METADATA:
+                metadata = fd.read(raw_offset)
+                try:
+                    parsed = list(_parse_metadata(metadata, endian,
+                                                  last_index))
+                except (struct.error, UnicodeDecodeError):
+                    raise TdmsHeaderError("Corrupt meta data at byte "
+                                          "{} of {}".format(pos, path))
+                for opath, index in parsed:
+                    last_index[opath] = index
+                    if opath.count("/'") == 2:
+                        # channels without data have zero length
+                        lengths.setdefault(opath, 0)
+                    for obj in objects:
+                        if obj[0] == opath:
+                            obj[1] = index
+                            break
+                    else:
+                        objects.append([opath, index])
+            with_data = [obj for obj in objects if obj[1] is not None]
+            chunk_size = sum([obj[1][1] for obj in with_data])
+            # a truncated file ends before the next segment
+            data_size = max(0, min(next_offset, fsize - pos - LEAD_IN_SIZE) -
+                            raw_offset)
+            if chunk_size:
+                # The last chunk may be incomplete (file is truncated
+                # or was not closed properly).
+                chunks, remainder = divmod(data_size, chunk_size)
+                partial = _get_partial_values(
+                    with_data, remainder, bool(toc & TOC_INTERLEAVED))
+                for (opath, (values, _size)), extra in zip(with_data,
+                                                           partial):
+                    lengths[opath] = (lengths.get(opath, 0) +
+                                      values * chunks + extra)
+            elif data_size:
+                raise TdmsHeaderError("Segment at byte {} of {} ".format(
+                    pos, path) + "contains data but no channels!")
+            pos += LEAD_IN_SIZE + next_offset
+    return lengths
+
+
+def get_object_path(group, channel):
+    """Return the tdms object path of a channel"""
+    return "/'{}'/'{}'".format(group.replace("'", "''"),
+                               channel.replace("'", "''"))
+
+
+def _get_partial_values(objects, size, interleaved):
+    """Return the number of values of each object in an incomplete chunk
+
+    Parameters
+    ----------
+    objects: list
+        Objects with raw data [[object path, (values, size)], ...]
+        in the order of the raw data
+    size: int
+        Size of the incomplete chunk [B]
+    interleaved: bool
+        Whether the values of the objects are interleaved
+
+    Returns
+    -------
+    partial: list of int
+        Number of complete values of each object
+    """
+    partial = []
+    offset = 0
+    if interleaved:
+        # all objects have the same number of values
+        row_size = sum([osize // values
+                        for _opath, (values, osize) in objects if values])
+        rows, rest = divmod(size, row_size)
+        for _opath, (values, osize) in objects:
+            vsize = osize // values if values else 0
+            partial.append(rows + int(offset + vsize <= rest))
+            offset += vsize
+    else:
+        for _opath, (values, osize) in objects:
+            if values:
+                vsize = osize // values
+                partial.append(max(0, min(values, (size - offset) // vsize)))
+            else:
+                partial.append(0)
+            offset += osize
+    return partial
+
+
+def _parse_metadata(metadata, endian, last_index):
+    """Yield object paths and raw data indices of a segment
+
+    The raw data indices are tuples (number of values, size [B])
+    or `None` for objects without raw data in the segment.
+    """
+    uint32 = str(endian + "I")
+    uint64 = str(endian + "Q")
+    offset = [0]
+
+    def read(fmt, size):
+        value = struct.unpack(fmt, metadata[offset[0]:offset[0] + size])[0]
+        offset[0] += size
+        return value
+
+    def read_string():
+        length = read(uint32, 4)
+        value = metadata[offset[0]:offset[0] + length].decode("utf-8")
+        offset[0] += length
+        return value
+
+    for _ in range(read(uint32, 4)):
+        opath = read_string()
+        raw_index = read(uint32, 4)
+        if raw_index == INDEX_NO_DATA:
+            index = None
+        elif raw_index == INDEX_SAME_AS_BEFORE:
+            index = last_index.get(opath)
+        elif raw_index in INDEX_DAQMX:
+            raise TdmsHeaderError("DAQmx raw data are not supported!")
+        else:
+            dtype = read(uint32, 4)
+            dimension = read(uint32, 4)
+            values = read(uint64, 8)
+            if dtype == TYPE_STRING:
+                size = read(uint64, 8)
+            elif dtype in TYPE_SIZES:
+                size = values * dimension * TYPE_SIZES[dtype]
+            else:
+                raise TdmsHeaderError("Unknown data type: {}".format(dtype))
+            index = (values, size)
+        # skip properties
+        for _ in range(read(uint32, 4)):
+            read_string()
+            ptype = read(uint32, 4)
+            if ptype == TYPE_STRING:
+                read_string()
+            elif ptype in TYPE_SIZES:
+                offset[0] += TYPE_SIZES[ptype]
+            else:
+                raise TdmsHeaderError("Unknown data type: {}".format(ptype))
+        yield opath, index
@@ -4,6 +4,7 @@ from __future__ import division, unicode_literals
 
 from pkg_resources import resource_filename  # @UnresolvedImport
 import os
+import h5py
 import numpy as np
 import sys
 
@@ -74,3 +75,22 @@ def rgb_to_hex(rgb, norm=255):
     """
     rgb = [ i*255/norm for i in list(rgb) ]
     return '#%02x%02x%02x' % tuple(rgb)
+
+
+def close_inherited_h5files():
+    """Close all HDF5 files of the current process
+
+    Call this in forked worker processes before opening HDF5 files.
+    Otherwise, the HDF5 library reuses the file handles inherited
+    from the parent process and concurrent workers interfere with
+    each other (shared file offset).
+    """
+    # same procedure as `h5py.File.close`
+    for fid in h5py.h5f.get_obj_ids(h5py.h5f.OBJ_ALL, h5py.h5f.OBJ_FILE):
+        if not fid.valid:
+            continue
+        ids = [x for x in h5py.h5f.get_obj_ids(fid, ~h5py.h5f.OBJ_FILE)
+               if h5py.h5i.get_file_id(x).id == fid.id]
+        for id_ in ids + [fid]:
+            while id_.valid:
+                h5py.h5i.dec_ref(id_)
@@ -0,0 +1,408 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ShapeOut - watch directories for new, modified, and removed measurements
+
+On Linux, the kernel notifies the watcher about changes in the
+watched directories (inotify); only directories with changes are
+searched again. On other systems (or if the inotify watch limit is
+reached), the watched directories are searched periodically (see
+`POLL_INTERVAL`).
+"""
+from __future__ import division, print_function, unicode_literals
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import pathlib
+import select
+import struct
+import sys
+import threading
+import time
+
+from . import meta_tool
+
+
+#: inotify event flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+#: events the watcher listens to
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+              IN_MOVE_SELF)
+
+#: size of the fixed part of an inotify event [B]
+EVENT_SIZE = struct.calcsize(b"iIII")
+
+#: default interval for searching the watched directories without
+#: inotify [s]; every file is accessed, which is slow on network shares
+POLL_INTERVAL = 60.
+
+
+class WatcherError(BaseException):
+    pass
+
+
+class WatchLimitError(WatcherError):
+    pass
+
+
+class DataWatcher(object):
+    def __init__(self, callback, interval=1., settle=2., inotify=None,
+                 poll_interval=POLL_INTERVAL):
+        """Watch directories for changes of measurement files
+
+        Parameters
+        ----------
+        callback: callable
+            Called with the lists `added`, `modified`, and `removed`
+            of measurement files (pathlib.Path) when files changed.
+            With `start`, the callback is called from the watcher
+            thread (use e.g. `wx.CallAfter` to update the GUI).
+        interval: float
+            Interval for checking for changes with inotify [s]
+        settle: float
+            A changed file is only reported if its size and
+            modification time did not change for `settle` seconds;
+            files that are still being written are not read.
+        inotify: bool or None
+            Use inotify (`True`), poll the directories (`False`),
+            or use inotify if available (`None`).
+        poll_interval: float
+            Interval for searching the directories without
+            inotify [s]
+
+        Notes
+        -----
+        Add directories with `watch`. Files that exist when a
+        directory is added are not reported. If the inotify watch
+        limit is reached, the watcher switches to polling.
+        """
+        self.callback = callback
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.directories = []
+        self._inotify = inotify
+        self._backend = None
+        # reported files {path: (signature, valid)}
+        self._known = {}
+        # changed files {path: (signature, time of change)}
+        self._pending = {}
+        # directories added with `watch`
+        self._new = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self, timeout=0):
+        """Check for changes once and call `callback`
+
+        Parameters
+        ----------
+        timeout: float
+            Time to wait for changes [s]
+
+        Returns
+        -------
+        added, modified, removed: lists of pathlib.Path
+            Changed measurement files
+        """
+        with self._lock:
+            if self._backend is None:
+                self._backend = _get_backend(self._inotify)
+            new = self._new
+            self._new = []
+        for directory in new:
+            # watch before the initial scan to not miss new files
+            try:
+                self._backend.add(directory)
+            except WatchLimitError:
+                self._use_polling()
+                self._backend.add(directory)
+            for path, sig in _scan(directory, recursive=True).items():
+                self._known[path] = (sig, True)
+            self.directories.append(directory)
+        if self.directories:
+            try:
+                changed = self._backend.wait(timeout)
+            except WatchLimitError:
+                # a new subdirectory could not be watched
+                changed = self._use_polling()
+        else:
+            self._stop.wait(timeout)
+            changed = []
+        now = time.time()
+        for directory, recursive in changed:
+            current = _scan(directory, recursive)
+            for path, sig in current.items():
+                if path in self._pending:
+                    if self._pending[path][0] != sig:
+                        self._pending[path] = (sig, now)
+                elif path not in self._known or self._known[path][0] != sig:
+                    self._pending[path] = (sig, now)
+            parents = _get_parents(directory)
+            for path in list(self._known) + list(self._pending):
+                if (path not in current and
+                    (path.parent in parents or
+                     recursive and parents.intersection(path.parents))):
+                    if path not in self._known:
+                        self._pending.pop(path, None)
+                    elif (path not in self._pending or
+                          self._pending[path][0] is not None):
+                        self._pending[path] = (None, now)
+        return self._report(now)
+
+    def _report(self, now):
+        """Report pending files that settled"""
+        added = []
+        modified = []
+        removed = []
+        for path in list(self._pending):
+            sig, since = self._pending[path]
+            cur = _get_signature(path)
+            if cur != sig:
+                self._pending[path] = (cur, now)
+                continue
+            elif now - since < self.settle:
+                continue
+            self._pending.pop(path)
+            was_valid = path in self._known and self._known[path][1]
+            if sig is None:
+                self._known.pop(path, None)
+                valid = False
+            else:
+                valid = meta_tool.verify_dataset(path)
+                self._known[path] = (sig, valid)
+            if valid and was_valid:
+                modified.append(path)
+            elif valid:
+                added.append(path)
+            elif was_valid:
+                removed.append(path)
+        if added or modified or removed:
+            self.callback(sorted(added), sorted(modified), sorted(removed))
+        return added, modified, removed
+
+    def _use_polling(self):
+        """Switch to polling, e.g. if the inotify watch limit is reached
+
+        Returns all watched directories for searching them again,
+        because changes might have been missed.
+        """
+        with self._lock:
+            self._backend.close()
+            self._backend = _PollingBackend()
+            for directory in self.directories:
+                self._backend.add(directory)
+        return [(dd, True) for dd in self.directories]
+
+    def run(self):
+        """Check for changes until `stop` is called"""
+        while not self._stop.is_set():
+            if isinstance(self._backend, _PollingBackend):
+                timeout = self.poll_interval
+            else:
+                timeout = self.interval
+            self.check(timeout=timeout)
+
+    def start(self):
+        """Check for changes in a daemon thread"""
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching and wait for the watcher thread"""
+        self._stop.set()
+        with self._lock:
+            if isinstance(self._backend, _PollingBackend):
+                # do not wait for the next search
+                self._backend.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._backend is not None:
+                self._backend.close()
+
+    def watch(self, directory):
+        """Watch a directory (recursively)
+
+        The directory is added by the next call to `check`.
+        """
+        with self._lock:
+            self._new.append(pathlib.Path(directory))
+
+
+class _InotifyBackend(object):
+    def __init__(self):
+        """Directory watching with inotify (Linux)"""
+        libname = ctypes.util.find_library("c")
+        if libname is None:
+            raise WatcherError("C library not found!")
+        libc = ctypes.CDLL(libname, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise WatcherError("inotify is not available!")
+        self._libc = libc
+        self._fd = libc.inotify_init1(os.O_NONBLOCK)
+        if self._fd < 0:
+            raise WatcherError("inotify_init1 failed: {}".format(
+                os.strerror(ctypes.get_errno())))
+        self._roots = []
+        # watched directories {watch descriptor: path}
+        self._watches = {}
+
+    def _add_watch(self, path):
+        wd = self._libc.inotify_add_watch(self._fd, _to_bytes(path),
+                                          WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOENT:
+                # removed in the meantime
+                return
+            elif err == errno.ENOSPC:
+                raise WatchLimitError("inotify watch limit reached; see "
+                                      "/proc/sys/fs/inotify/max_user_watches")
+            raise WatcherError("inotify_add_watch failed for {}: {}".format(
+                path, os.strerror(err)))
+        self._watches[wd] = path
+
+    def add(self, directory, root=True):
+        if root:
+            self._roots.append(directory)
+        for path, _dirs, _files in os.walk(str(directory), followlinks=True):
+            self._add_watch(pathlib.Path(path))
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def wait(self, timeout):
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self._fd, 65536)
+        except OSError:
+            return []
+        changed = set()
+        offset = 0
+        while offset + EVENT_SIZE <= len(data):
+            wd, mask, _cookie, length = struct.unpack_from(b"iIII", data,
+                                                           offset)
+            name = data[offset + EVENT_SIZE:offset + EVENT_SIZE + length]
+            offset += EVENT_SIZE + length
+            if mask & IN_Q_OVERFLOW:
+                # events were lost
+                changed.update([(rr, True) for rr in self._roots])
+                continue
+            elif mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            elif wd not in self._watches:
+                continue
+            directory = self._watches[wd]
+            name = name.rstrip(b"\0").decode(sys.getfilesystemencoding())
+            if mask & IN_ISDIR and name:
+                path = directory / name
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add(path, root=False)
+                changed.add((path, True))
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add((directory, True))
+            else:
+                changed.add((directory, False))
+        return sorted(changed)
+
+
+class _PollingBackend(object):
+    def __init__(self):
+        """Directory watching by searching all directories periodically"""
+        self._roots = []
+        self._closed = threading.Event()
+
+    def add(self, directory):
+        self._roots.append(directory)
+
+    def close(self):
+        self._closed.set()
+
+    def wait(self, timeout):
+        self._closed.wait(timeout)
+        return [(rr, True) for rr in self._roots]
+
+
+def _get_backend(inotify):
+    if inotify or inotify is None:
+        try:
+            return _InotifyBackend()
+        except WatcherError:
+            if inotify:
+                raise
+    return _PollingBackend()
+
+
+def _get_parents(directory):
+    """Return `directory` and its resolved path (see `meta_tool.find_data`)"""
+    parents = set([directory])
+    try:
+        parents.add(directory.resolve())
+    except OSError:
+        # directory was removed
+        pass
+    return parents
+
+
+def _get_signature(path):
+    """Return size and modification time of a measurement or `None`
+
+    For tdms files, the configuration files are included.
+    """
+    paths = [path]
+    if path.suffix == ".tdms":
+        mx = path.name.split("_")[0]
+        paths += [path.parent / (mx + "_para.ini"),
+                  path.parent / (mx + "_camera.ini")]
+    sig = []
+    for pp in paths:
+        try:
+            stat = os.stat(str(pp))
+        except OSError:
+            if pp is path:
+                return None
+            sig.append(None)
+        else:
+            sig.append((stat.st_size, stat.st_mtime))
+    return tuple(sig)
+
+
+def _scan(directory, recursive):
+    """Return the signatures of the measurements in `directory`"""
+    if not directory.is_dir():
+        return {}
+    sigs = {}
+    for path in meta_tool.find_data(directory, recursive=recursive):
+        sig = _get_signature(path)
+        if sig is not None:
+            sigs[path] = sig
+    return sigs
+
+
+def _to_bytes(path):
+    spath = str(path)
+    if not isinstance(spath, bytes):
+        spath = spath.encode(sys.getfilesystemencoding())
+    return spath
@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test headless batch filtering"""
+from __future__ import print_function
+
+import io
+import os
+import pathlib
+import shutil
+import tempfile
+
+import dclab
+from dclab.polygon_filter import PolygonFilter
+import numpy as np
+
+from shapeout import batch
+from shapeout.batch import cli, core, jobqueue
+
+from helper_methods import retrieve_data, example_data_sets, cleanup
+
+
+def read_tsv(path):
+    with io.open(str(path)) as fd:
+        data = fd.readlines()
+    header = [d.strip().lower() for d in data[0].strip("# ").split("\t")]
+    rows = [[d.strip() for d in line.strip().split("\t")]
+            for line in data[1:]]
+    return header, rows
+
+
+def test_batch_filter():
+    tdms_path = retrieve_data(example_data_sets[0])
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_batch_"))
+    out = tdir / "out.tsv"
+    # see test_gui_batch.py
+    config = {"filtering": {"remove invalid events": False}}
+    files = batch.find_data_files(pathlib.Path(tdms_path).parent)
+    assert len(files) == 1
+    batch.batch_filter(files=files,
+                       config=config,
+                       features=["deform", "area_um"],
+                       methods=["%-gated", "Events", "Flow rate", "Mean"],
+                       out_tsv=out)
+    header, rows = read_tsv(out)
+    assert header[:2] == ["data file", "title"]
+    soll = {"%-gated": 100,
+            "events": 156,
+            "flow rate": 0.12,
+            "mean deformation": 1.3096144795e-01}
+    for key in soll:
+        idx = header.index(key)
+        assert np.allclose(float(rows[0][idx]), soll[key])
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def test_cli():
+    tdms_path = retrieve_data(example_data_sets[0])
+    folder = pathlib.Path(tdms_path).parent
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_batch_"))
+    # filter configuration file
+    ds = dclab.new_dataset(tdms_path)
+    ds.config["filtering"]["remove invalid events"] = False
+    ds.config["filtering"]["deform max"] = .1
+    ds.config["filtering"]["enable filters"] = True
+    cfg_file = tdir / "config.txt"
+    ds.config.save(cfg_file)
+    out_cli = tdir / "cli.tsv"
+    cli.main([str(folder),
+              "-c", str(cfg_file),
+              "-o", str(out_cli),
+              "-f", "deform", "area_um",
+              "-s", "Events", "Mean"])
+    out_lib = tdir / "lib.tsv"
+    batch.batch_filter(files=batch.find_data_files(folder),
+                       config=batch.load_filter_config(cfg_file),
+                       features=["deform", "area_um"],
+                       methods=["Events", "Mean"],
+                       out_tsv=out_lib)
+    with io.open(str(out_cli), "rb") as fd:
+        dcli = fd.read()
+    with io.open(str(out_lib), "rb") as fd:
+        dlib = fd.read()
+    assert dcli == dlib
+    header, rows = read_tsv(out_cli)
+    assert 0 < float(rows[0][header.index("events")]) < 156
+    # region selection
+    assert batch.filter_files(batch.find_data_files(folder),
+                              region="reservoir") == []
+    # sweeping over all measurements requires a session
+    try:
+        cli.main([str(folder), "-c", str(cfg_file), "-m", "all",
+                  "-o", str(tdir / "all.tsv")])
+    except SystemExit as exc:
+        assert exc.code == 2
+    else:
+        assert False, "'-m all' requires a session"
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def test_batch_parallel():
+    tdms_path = pathlib.Path(retrieve_data(example_data_sets[0]))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_batch_"))
+    # three copies of the measurement
+    for name in ["a", "b", "c"]:
+        shutil.copytree(str(tdms_path.parent), str(tdir / "data" / name))
+    # polygon filter must be available in the worker processes
+    PolygonFilter.clear_all_filters()
+    pf = PolygonFilter(axes=["area_um", "deform"],
+                       points=[[0, 0], [0, .1], [1000, .1], [1000, 0]])
+    config = {"filtering": {"remove invalid events": False,
+                            "enable filters": True,
+                            "polygon filters": [pf.unique_id]}}
+    files = batch.find_data_files(tdir / "data")
+    assert len(files) == 3
+    kw = {"files": files,
+          "config": config,
+          "features": ["deform", "area_um"],
+          "methods": ["Events", "Mean"]}
+    batch.batch_filter(out_tsv=tdir / "serial.tsv", **kw)
+    batch.batch_filter(out_tsv=tdir / "parallel.tsv", processes=2,
+                       memory_limit=2048, **kw)
+    with io.open(str(tdir / "serial.tsv"), "rb") as fd:
+        dser = fd.read()
+    with io.open(str(tdir / "parallel.tsv"), "rb") as fd:
+        dpar = fd.read()
+    assert dser == dpar
+    header, rows = read_tsv(tdir / "parallel.tsv")
+    assert [r[0] for r in rows] == files
+    assert 0 < float(rows[0][header.index("events")]) < 156
+    PolygonFilter.clear_all_filters()
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def test_batch_parallel_calculation():
+    tdms_path = pathlib.Path(retrieve_data(example_data_sets[0]))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_batch_"))
+    for name in ["a", "b"]:
+        shutil.copytree(str(tdms_path.parent), str(tdir / "data" / name))
+    # non-default emodulus settings must be used by the workers
+    config = {"filtering": {"remove invalid events": False},
+              "calculation": {"emodulus medium": "Other",
+                              "emodulus model": "elastic sphere",
+                              "emodulus temperature": 23.0,
+                              "emodulus viscosity": 5.0}}
+    files = batch.find_data_files(tdir / "data")
+    kw = {"files": files,
+          "config": config,
+          "features": ["emodulus"],
+          "methods": ["Events", "Mean"]}
+    batch.batch_filter(out_tsv=tdir / "serial.tsv", **kw)
+    batch.batch_filter(out_tsv=tdir / "parallel.tsv", processes=2, **kw)
+    hser, rser = read_tsv(tdir / "serial.tsv")
+    hpar, rpar = read_tsv(tdir / "parallel.tsv")
+    assert hser == hpar
+    assert rser == rpar
+    col = "mean young's modulus [kpa]"
+    emod = float(rser[0][hser.index(col)])
+    assert np.isfinite(emod)
+    # other viscosity, other result
+    config["calculation"]["emodulus viscosity"] = 10.0
+    batch.batch_filter(out_tsv=tdir / "viscous.tsv", processes=2, **kw)
+    hvis, rvis = read_tsv(tdir / "viscous.tsv")
+    assert not np.allclose(float(rvis[0][hvis.index(col)]), emod)
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def test_batch_resume():
+    tdms_path = pathlib.Path(retrieve_data(example_data_sets[0]))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_batch_"))
+    for name in ["a", "b", "c"]:
+        shutil.copytree(str(tdms_path.parent), str(tdir / "data" / name))
+    files = batch.find_data_files(tdir / "data")
+    kw = {"config": {"filtering": {"remove invalid events": False}},
+          "features": ["deform", "area_um"],
+          "methods": ["Events", "Mean"]}
+    ref = tdir / "ref.tsv"
+    batch.batch_filter(files=files, out_tsv=ref, **kw)
+    with io.open(str(ref), "rb") as fd:
+        dref = fd.read()
+    # interrupted run: two files completed, partial writes of the third
+    out = tdir / "out.tsv"
+    compute_statistics = core.compute_statistics
+
+    def interrupted_compute_statistics(path, *args):
+        if path == files[2]:
+            raise KeyboardInterrupt
+        return compute_statistics(path, *args)
+
+    core.compute_statistics = interrupted_compute_statistics
+    try:
+        batch.batch_filter(files=files, out_tsv=out, **kw)
+    except KeyboardInterrupt:
+        pass
+    else:
+        assert False, "the batch run must be interrupted"
+    finally:
+        core.compute_statistics = compute_statistics
+    with io.open(str(out), "ab") as fd:
+        fd.write(b"/path/to/partial/row\t")
+    with io.open(str(core.get_journal_path(out)), "ab") as fd:
+        fd.write(b'{"path": "/partial')
+    # resume and count computations
+    computed = []
+
+    def counting_compute_statistics(path, *args):
+        computed.append(path)
+        return compute_statistics(path, *args)
+
+    core.compute_statistics = counting_compute_statistics
+    try:
+        batch.batch_filter(files=files, out_tsv=out, resume=True, **kw)
+        assert computed == files[2:]
+    finally:
+        core.compute_statistics = compute_statistics
+    with io.open(str(out), "rb") as fd:
+        dout = fd.read()
+    assert dout == dref
+    # the journal of completed runs is removed
+    assert not core.get_journal_path(ref).exists()
+    assert not core.get_journal_path(out).exists()
+    # resuming with different arguments is not possible
+    batch.BatchJournal(core.get_journal_path(out),
+                       key=core.get_run_hash(**kw))
+    kw["methods"] = ["Events"]
+    try:
+        batch.batch_filter(files=files, out_tsv=out, resume=True, **kw)
+    except batch.BatchResumeError:
+        pass
+    else:
+        assert False, "different batch runs must not be mixed"
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def test_batch_cache():
+    tdms_path = pathlib.Path(retrieve_data(example_data_sets[0]))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_batch_"))
+    for name in ["a", "b"]:
+        shutil.copytree(str(tdms_path.parent), str(tdir / "data" / name))
+    files = batch.find_data_files(tdir / "data")
+    PolygonFilter.clear_all_filters()
+    pf = PolygonFilter(axes=["area_um", "deform"],
+                       points=[[0, 0], [0, .1], [1000, .1], [1000, 0]])
+    config = {"filtering": {"remove invalid events": False,
+                            "enable filters": True,
+                            "polygon filters": [pf.unique_id]}}
+    kw = {"files": files,
+          "config": config,
+          "features": ["deform", "area_um"],
+          "methods": ["Events", "Mean"]}
+    bcache = batch.BatchCache(tdir / "cache.db")
+    computed = []
+    compute_statistics = core.compute_statistics
+
+    def counting_compute_statistics(path, *args):
+        computed.append(path)
+        return compute_statistics(path, *args)
+
+    core.compute_statistics = counting_compute_statistics
+    try:
+        batch.batch_filter(out_tsv=tdir / "ref.tsv", **kw)
+        batch.batch_filter(out_tsv=tdir / "out1.tsv", cache=bcache, **kw)
+        assert len(computed) == 4
+        batch.batch_filter(out_tsv=tdir / "out2.tsv", cache=bcache, **kw)
+        assert len(computed) == 4
+        # lookups do not write to the database
+        assert bcache._accessed
+        # changing the polygon filter invalidates the cache
+        pf.points[0, 1] = .01
+        batch.batch_filter(out_tsv=tdir / "out3.tsv", cache=bcache, **kw)
+        assert len(computed) == 6
+    finally:
+        core.compute_statistics = compute_statistics
+        PolygonFilter.clear_all_filters()
+    for name in ["out1.tsv", "out2.tsv"]:
+        with io.open(str(tdir / name), "rb") as fd:
+            dout = fd.read()
+        with io.open(str(tdir / "ref.tsv"), "rb") as fd:
+            assert fd.read() == dout
+    # other emodulus settings invalidate the cache
+    cfg1 = {"filtering": {"remove invalid events": False}}
+    cfg2 = {"filtering": {"remove invalid events": False},
+            "calculation": {"emodulus viscosity": 10.0}}
+    assert core.get_config_hash(cfg1) != core.get_config_hash(cfg2)
+    assert (core.get_run_hash(cfg1, ["deform"], ["Mean"]) !=
+            core.get_run_hash(cfg2, ["deform"], ["Mean"]))
+    # query and prune
+    assert len(bcache) == 2
+    entries = bcache.query(dataset_hash=dclab.new_dataset(files[0]).hash)
+    assert len(entries) == 2
+    assert entries[0]["methods"] == ["Events", "Mean"]
+    assert entries[0]["accessed"] > entries[0]["created"]
+    assert bcache.prune(max_age=3600) == 0
+    assert bcache.prune(max_size=bcache.size() - 1) == 1
+    assert bcache.prune(max_age=0) == 1
+    assert len(bcache) == 0
+    bcache.close()
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def test_batch_sweep():
+    tdms_path = pathlib.Path(retrieve_data(example_data_sets[0]))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_batch_"))
+    for name in ["a", "b"]:
+        shutil.copytree(str(tdms_path.parent), str(tdir / "data" / name))
+    files = batch.find_data_files(tdir / "data")
+    PolygonFilter.clear_all_filters()
+    pf = PolygonFilter(axes=["area_um", "deform"],
+                       points=[[0, 0], [0, .1], [1000, .1], [1000, 0]])
+    configs = [{"filtering": {"remove invalid events": False,
+                              "enable filters": True,
+                              "deform min": 0,
+                              "deform max": .1}},
+               {"filtering": {"remove invalid events": False,
+                              "enable filters": True,
+                              "polygon filters": [pf.unique_id]}},
+               {"filtering": {"remove invalid events": False}},
+               ]
+    kw = {"features": ["deform", "area_um"],
+          "methods": ["Events", "Mean"]}
+    # reference: separate batch runs
+    ref = []
+    for ii, cfg in enumerate(configs):
+        out = tdir / "ref{}.tsv".format(ii)
+        batch.batch_filter(files=files, config=cfg, out_tsv=out, **kw)
+        ref.append(read_tsv(out))
+    # sweep: each measurement is loaded once
+    loaded = []
+    Analysis = core.analysis.Analysis
+
+    def counting_analysis(data, *args, **kwargs):
+        loaded.extend(data)
+        return Analysis(data, *args, **kwargs)
+
+    core.analysis.Analysis = counting_analysis
+    try:
+        batch.batch_sweep(files=files, configs=configs,
+                          out_tsv=tdir / "sweep.tsv", names=["a", "b", "c"],
+                          **kw)
+    finally:
+        core.analysis.Analysis = Analysis
+    assert loaded == files
+    batch.batch_sweep(files=files, configs=configs,
+                      out_tsv=tdir / "parallel.tsv", processes=2, **kw)
+    PolygonFilter.clear_all_filters()
+    header, rows = read_tsv(tdir / "sweep.tsv")
+    assert header[:3] == ["data file", "title", "configuration"]
+    assert len(rows) == len(files) * len(configs)
+    for ii, row in enumerate(rows):
+        rheader, rrows = ref[ii % 3]
+        assert header[3:] == rheader[2:]
+        assert row[2] == "abc"[ii % 3]
+        assert row[:2] + row[3:] == rrows[ii // 3]
+    assert 0 < float(rows[0][header.index("events")]) < 156
+    assert float(rows[2][header.index("events")]) == 156
+    _, prows = read_tsv(tdir / "parallel.tsv")
+    assert [r[2] for r in prows[:3]] == ["1", "2", "3"]
+    assert [r[3:] for r in prows] == [r[3:] for r in rows]
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def test_sweep_hdf5():
+    path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
+    configs = [{"filtering": {"deform min": 0,
+                              "deform max": .05,
+                              "enable filters": True}},
+               {"filtering": {"area_um min": 0,
+                              "area_um max": 100,
+                              "enable filters": True}}]
+    kw = {"features": ["deform", "area_um"],
+          "methods": ["Events", "Mean"]}
+    results = batch.compute_statistics_sweep(path, configs, **kw)
+    for cfg, (head, row) in zip(configs, results):
+        rhead, rrow = batch.compute_statistics(path, cfg, **kw)
+        assert head == rhead
+        assert np.allclose(row[2:], rrow[2:], equal_nan=True)
+    assert results[0][1][2] != results[1][1][2]
+    cleanup()
+
+
+def test_batch_queue():
+    tdms_path = pathlib.Path(retrieve_data(example_data_sets[0]))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_batch_"))
+    for name in ["a", "b", "c"]:
+        shutil.copytree(str(tdms_path.parent), str(tdir / "data" / name))
+    files = batch.find_data_files(tdir / "data")
+    PolygonFilter.clear_all_filters()
+    pf = PolygonFilter(axes=["area_um", "deform"],
+                       points=[[0, 0], [0, .1], [1000, .1], [1000, 0]])
+    kw = {"files": files,
+          "config": {"filtering": {"remove invalid events": False,
+                                   "enable filters": True,
+                                   "polygon filters": [pf.unique_id]}},
+          "features": ["deform", "area_um"],
+          "methods": ["Events", "Mean"]}
+    batch.batch_filter(out_tsv=tdir / "ref.tsv", **kw)
+    # local worker processes
+    batch.batch_filter_queue(out_tsv=tdir / "queue.tsv",
+                             directory=tdir / "queue",
+                             processes=2,
+                             poll=.1,
+                             timeout=60,
+                             **kw)
+    with io.open(str(tdir / "ref.tsv"), "rb") as fd:
+        dref = fd.read()
+    with io.open(str(tdir / "queue.tsv"), "rb") as fd:
+        assert fd.read() == dref
+    # jobs are claimed only once
+    jq = batch.JobQueue(tdir / "queue2")
+    jq.submit(**kw)
+    PolygonFilter.clear_all_filters()
+    job1 = jq.claim("worker1")
+    job2 = jq.claim("worker2")
+    assert job1["index"] == 0
+    assert job2["index"] == 1
+    assert jq.status() == {"todo": 1, "claimed": 2, "done": 0, "failed": 0}
+    # recover the jobs of crashed workers
+    assert jq.requeue_stale(3600) == 0
+    assert jq.requeue_stale(-1) == 2
+    # slow workers do not remove the claims of other workers
+    job3 = jq.claim("worker3")
+    assert job3["index"] == 0
+    assert not jq.complete(job1, ["Events"], ["path", "title", 1])
+    assert jq.status() == {"todo": 2, "claimed": 1, "done": 0, "failed": 0}
+    assert jq.requeue_stale(-1) == 1
+    try:
+        jq.merge(tdir / "queue2.tsv")
+    except batch.JobQueueError:
+        pass
+    else:
+        assert False, "unfinished jobs must not be merged"
+    # external worker (os.rename does not replace files on Windows)
+    rename = jobqueue.os.rename
+
+    def windows_rename(src, dst):
+        if os.path.exists(dst):
+            raise OSError("File exists: {}".format(dst))
+        rename(src, dst)
+
+    try:
+        jobqueue.os.rename = windows_rename
+        cli.worker_main([str(tdir / "queue2")])
+    finally:
+        jobqueue.os.rename = rename
+    assert jq.status()["done"] == 3
+    jq.merge(tdir / "queue2.tsv")
+    with io.open(str(tdir / "queue2.tsv"), "rb") as fd:
+        assert fd.read() == dref
+    # failed jobs
+    kw["files"] = [str(tdir / "missing.rtdc")]
+    jq.submit(**kw)
+    assert batch.run_worker(tdir / "queue2") == 1
+    assert jq.status()["failed"] == 1
+    try:
+        jq.merge(tdir / "queue2.tsv")
+    except batch.JobQueueError as exc:
+        assert "missing.rtdc" in "{}".format(exc)
+    else:
+        assert False, "failed jobs must be reported"
+    PolygonFilter.clear_all_filters()
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def crashing_local_worker(directory):
+    jobqueue.JobQueue(directory).claim()
+    os._exit(1)
+
+
+def test_batch_queue_crash():
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_batch_"))
+    run_local_worker = jobqueue._run_local_worker
+    try:
+        jobqueue._run_local_worker = crashing_local_worker
+        batch.batch_filter_queue(files=["a.rtdc", "b.rtdc"],
+                                 config={"filtering": {}},
+                                 features=["deform"],
+                                 methods=["Mean"],
+                                 out_tsv=tdir / "queue.tsv",
+                                 directory=tdir / "queue",
+                                 poll=.1,
+                                 timeout=60)
+    except batch.JobQueueError as exc:
+        assert "exited with code 1" in "{}".format(exc)
+    else:
+        assert False, "crashed workers must be reported"
+    finally:
+        jobqueue._run_local_worker = run_local_worker
+    # the claimed job can be processed by another worker
+    jq = batch.JobQueue(tdir / "queue")
+    assert jq.status() == {"todo": 2, "claimed": 0, "done": 0, "failed": 0}
+    shutil.rmtree(str(tdir), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, unicode_literals
+
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+
+from multiprocessing.pool import ThreadPool
+
+from shapeout import cache_store
+from shapeout.cache_store import CacheStore, get_stat_key
+
+from helper_methods import retrieve_data, cleanup
+
+
+def test_get_set():
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_cache_store_")
+    with CacheStore("test.db", directory=tdir) as cache:
+        cache.set("a", 1)
+        cache.set("b", {"c": [1, 2]})
+        assert cache.get("a") == 1
+        assert cache.get("b") == {"c": [1, 2]}
+        assert "a" in cache
+        assert "c" not in cache
+        try:
+            cache.get("c")
+        except KeyError:
+            pass
+        else:
+            assert False, "missing keys must raise KeyError"
+        cache.delete("a")
+        assert len(cache) == 1
+    # persistent
+    with CacheStore("test.db", directory=tdir) as cache:
+        assert cache.get("b") == {"c": [1, 2]}
+    shutil.rmtree(tdir, ignore_errors=True)
+
+
+def test_eviction():
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_cache_store_")
+    with CacheStore("test.db", directory=tdir, max_entries=3,
+                    trim_interval=1) as cache:
+        for ii in range(3):
+            cache.set("{}".format(ii), ii)
+        # "0" is the least recently used entry after this
+        cache.get("1")
+        cache.get("2")
+        cache.set("3", 3)
+        assert len(cache) == 3
+        assert "0" not in cache
+        assert cache.prune(max_age=3600) == 0
+        assert cache.prune(max_entries=1) == 2
+        assert "3" in cache
+        assert cache.prune(max_age=-1) == 1
+    # trimmed occasionally and when closing
+    with CacheStore("test.db", directory=tdir, max_entries=3,
+                    trim_interval=4) as cache:
+        for ii in range(4):
+            cache.set("{}".format(ii), ii)
+        assert len(cache) == 3
+        cache.set("4", 4)
+        assert len(cache) == 4
+    with CacheStore("test.db", directory=tdir) as cache:
+        assert len(cache) == 3
+        assert "4" in cache
+    shutil.rmtree(tdir, ignore_errors=True)
+
+
+def test_read_only_get():
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_cache_store_")
+    with CacheStore("test.db", directory=tdir) as cache:
+        cache.set("a", 1)
+        changes = cache._con.total_changes
+        for _ in range(10):
+            assert cache.get("a") == 1
+        assert cache._con.total_changes == changes
+        accessed = cache._con.execute(
+            "SELECT accessed FROM entries WHERE key='a'").fetchone()[0]
+    # access times are written when closing
+    with CacheStore("test.db", directory=tdir) as cache:
+        assert cache._con.execute(
+            "SELECT accessed FROM entries WHERE key='a'").fetchone()[0] \
+            > accessed
+    shutil.rmtree(tdir, ignore_errors=True)
+
+
+def test_get_store():
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_cache_store_")
+    store = cache_store.get_store("test.db", directory=tdir)
+    assert cache_store.get_store("test.db", directory=tdir) is store
+    stores = []
+    th = threading.Thread(target=lambda: stores.append(
+        cache_store.get_store("test.db", directory=tdir)))
+    th.start()
+    th.join()
+    # all threads share one store
+    assert stores[0] is store
+    store.set("a", 1)
+    assert cache_store.get_store("test.db", directory=tdir).get("a") == 1
+    cache_store._close_stores()
+    shutil.rmtree(tdir, ignore_errors=True)
+
+
+def test_get_store_pools():
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_cache_store_")
+
+    def worker(key):
+        store = cache_store.get_store("test.db", directory=tdir,
+                                      max_entries=10)
+        for ii in range(10):
+            store.set("{}-{}".format(key, ii), ii)
+            store.get("{}-{}".format(key, ii))
+
+    # short-lived threads as in `meta_tool.iter_metadata`
+    for jj in range(30):
+        pool = ThreadPool(4)
+        pool.map(worker, ["{}-{}".format(jj, kk) for kk in range(4)])
+        pool.close()
+        pool.join()
+    store = cache_store.get_store("test.db", directory=tdir)
+    assert len(store) <= store.max_entries + store.trim_interval
+    # access times of all threads are written in batches
+    assert store._accessed
+    store.flush()
+    assert not store._accessed
+    cache_store._close_stores()
+    shutil.rmtree(tdir, ignore_errors=True)
+
+
+def test_threads():
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_cache_store_")
+    errors = []
+
+    def worker(jj):
+        try:
+            with CacheStore("test.db", directory=tdir) as cache:
+                for ii in range(20):
+                    cache.set("{}-{}".format(jj, ii), ii)
+                    assert cache.get("{}-{}".format(jj, ii)) == ii
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(jj,))
+               for jj in range(4)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert not errors
+    with CacheStore("test.db", directory=tdir) as cache:
+        assert len(cache) == 80
+    shutil.rmtree(tdir, ignore_errors=True)
+
+
+def test_stat_key():
+    path = pathlib.Path(retrieve_data("rtdc_data_minimal.zip"))
+    key = get_stat_key(path)
+    assert key == get_stat_key(path.parent / ".." / path.parent.name /
+                               path.name)
+    st = path.stat()
+    os.utime(str(path), (st.st_atime, st.st_mtime + 10))
+    assert key != get_stat_key(path)
+    cleanup()
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function
+
+import shutil
+import tempfile
+
+import imageio
+import numpy as np
+
+import dclab
+from dclab import new_dataset
+
+from shapeout.export.avi import CONTOUR_COLOR, FrameDecodeError, \
+    export_avi, export_avi_many
+
+from helper_methods import cleanup, retrieve_data
+
+
+def read_frames(path):
+    reader = imageio.get_reader(str(path))
+    frames = [np.array(reader.get_data(ii)) for ii in range(len(reader))]
+    reader.close()
+    return frames
+
+
+def test_avi_identical_to_dclab():
+    path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
+    ds = new_dataset(path)
+    ds.filter.manual[1] = False
+    ds.apply_filter()
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_avi_")
+    ref = tdir + "/ref.avi"
+    ds.export.avi(ref)
+    out = export_avi(tdir + "/out", ds, batch_size=2)
+    assert out.suffix == ".avi"
+    fref = read_frames(ref)
+    fout = read_frames(out)
+    assert len(fout) == len(ds) - 1
+    for a, b in zip(fref, fout):
+        assert np.all(a == b)
+    # unfiltered
+    out2 = export_avi(tdir + "/out2", ds, filtered=False)
+    assert len(read_frames(out2)) == len(ds)
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+def test_avi_contour():
+    path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
+    ds = new_dataset(path)
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_avi_")
+    out = export_avi(tdir + "/out", ds, contour=True, filtered=False)
+    frame = read_frames(out)[0]
+    cont = ds["contour"][0]
+    # rawvideo with yuv420p is not lossless for colors
+    pix = frame[cont[:, 1], cont[:, 0]].astype(int)
+    assert np.mean(pix[:, 0] - pix[:, 1]) > 100
+    assert CONTOUR_COLOR[0] > CONTOUR_COLOR[1]
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+def test_avi_many():
+    path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
+    ds = new_dataset(path)
+    ds.filter.manual[0] = False
+    ds.apply_filter()
+    child = new_dataset(ds)
+    child.title = "child"
+    child.filter.manual[0] = False
+    child.apply_filter()
+    data = {"area_um": np.linspace(10, 20, 5),
+            "deform": np.linspace(.1, .2, 5)}
+    ds_dict = dclab.new_dataset(data)
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_avi_")
+    paths = export_avi_many(tdir, [ds, child], processes=2)
+    assert len(read_frames(paths[0])) == len(ds) - 1
+    assert len(read_frames(paths[1])) == len(ds) - 2
+    # child frames are the root frames without the first two events
+    ref = read_frames(export_avi(tdir + "/ref", ds, filtered=False))
+    assert np.all(read_frames(paths[1])[0] == ref[2])
+    try:
+        export_avi_many(tdir, [ds_dict])
+    except OSError:
+        pass
+    else:
+        assert False, "data sets without images cannot be exported"
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+def test_avi_decoder_error():
+    ds = new_dataset(retrieve_data("rtdc_data_hdf5_contour_image_trace.zip"))
+
+    class BrokenContour(object):
+        """Data set whose contours cannot be decoded"""
+        title = ds.title
+
+        def __contains__(self, key):
+            return key in ds
+
+        def __getitem__(self, key):
+            if key == "contour":
+                # constructor with several arguments
+                raise UnicodeDecodeError(str("utf-8"), b"\xff", 0, 1,
+                                         str("invalid start byte"))
+            return ds[key]
+
+        def __len__(self):
+            return len(ds)
+
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_avi_")
+    try:
+        export_avi(tdir + "/out", BrokenContour(), filtered=False,
+                   contour=True)
+    except FrameDecodeError as exc:
+        msg = "{}".format(exc)
+        assert ds.title in msg
+        assert "Traceback" in msg
+        assert "UnicodeDecodeError" in msg
+    else:
+        assert False, "decoder errors must be raised"
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
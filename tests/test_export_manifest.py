@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function
+
+import shutil
+import tempfile
+
+from dclab import new_dataset
+
+from shapeout.export.manifest import ExportManifest
+
+from helper_methods import cleanup, retrieve_data
+
+
+def test_manifest_outdated():
+    ds1 = new_dataset(retrieve_data("rtdc_data_minimal.zip"))
+    ds2 = new_dataset(retrieve_data("rtdc_data_hdf5_contour_image_trace.zip"))
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_manifest_")
+    features = ["area_um", "deform"]
+
+    def get_outdated(manifest, dslist, features=features):
+        outdated = []
+        for ds in dslist:
+            entry = manifest.get_entry(ds, features, True)
+            if not manifest.is_current(ds.title + ".tsv", entry):
+                outdated.append(ds)
+        return outdated
+
+    man = ExportManifest(tdir)
+    assert get_outdated(man, [ds1, ds2]) == [ds1, ds2]
+    for ds in [ds1, ds2]:
+        man.update(ds.title + ".tsv", man.get_entry(ds, features, True))
+    # exported files do not exist yet
+    assert get_outdated(man, [ds1, ds2]) == [ds1, ds2]
+    for ds in [ds1, ds2]:
+        ds.export.tsv(tdir + "/" + ds.title, features)
+    assert get_outdated(man, [ds1, ds2]) == []
+    man.save()
+
+    # reload from disk
+    man2 = ExportManifest(tdir)
+    assert man2.files == man.files
+    assert get_outdated(man2, [ds1, ds2]) == []
+
+    # change the filters of one data set
+    ds1.config["filtering"]["deform max"] = .1
+    ds1.apply_filter()
+    assert get_outdated(man2, [ds1, ds2]) == [ds1]
+    # change the features
+    assert get_outdated(man2, [ds2], features=["deform"]) == [ds2]
+    # change the order of the features (columns)
+    assert get_outdated(man2, [ds2], features=features[::-1]) == [ds2]
+    # unfiltered exports do not depend on the filters
+    man2.update(ds1.title + ".tsv", man2.get_entry(ds1, features, False))
+    ds1.config["filtering"]["deform max"] = .2
+    ds1.apply_filter()
+    entry = man2.get_entry(ds1, features, False)
+    assert man2.is_current(ds1.title + ".tsv", entry)
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function
+
+import shutil
+import tempfile
+
+import numpy as np
+import pytest
+
+from dclab import new_dataset
+
+from shapeout.export.parquet import export_parquet
+
+from helper_methods import cleanup, retrieve_data
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+
+def test_parquet_basic():
+    ds1 = new_dataset(retrieve_data("rtdc_data_minimal.zip"))
+    ds1.config["filtering"]["deform max"] = .1
+    ds1.apply_filter()
+    ds2 = new_dataset(retrieve_data("rtdc_data_hdf5_contour_image_trace.zip"))
+    features = ["area_um", "deform", "time"]
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_parquet_")
+    out = export_parquet(tdir + "/events", [ds1, ds2], features,
+                         filtered=False, chunk_size=20, row_group_size=50)
+    assert out.name == "events.parquet"
+
+    pfile = pq.ParquetFile(str(out))
+    assert pfile.metadata.num_rows == len(ds1) + len(ds2)
+    # row groups are limited in size and do not span data sets
+    sizes = [pfile.metadata.row_group(ii).num_rows
+             for ii in range(pfile.num_row_groups)]
+    assert max(sizes) == 50
+    assert sizes[:4] == [50, 50, 50, 6]
+
+    table = pq.read_table(str(out))
+    data = table.to_pydict()
+    hashes = np.array(data["hash"])
+    assert np.all(np.array(data["title"])[hashes == ds1.hash] == ds1.title)
+    assert np.sum(hashes == ds2.hash) == len(ds2)
+    filt1 = np.array(data["filter"])[hashes == ds1.hash]
+    assert np.all(filt1 == ds1.filter.all)
+    deform = np.array(data["deform"])[hashes == ds1.hash]
+    assert np.allclose(deform, ds1["deform"])
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+def test_parquet_filtered():
+    ds = new_dataset(retrieve_data("rtdc_data_minimal.zip"))
+    ds.config["filtering"]["deform max"] = .1
+    ds.apply_filter()
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_parquet_")
+    out = export_parquet(tdir + "/events.parquet", [ds], ["deform"],
+                         compression="gzip")
+    data = pq.read_table(str(out)).to_pydict()
+    assert len(data["deform"]) == np.sum(ds.filter.all)
+    assert np.all(data["filter"])
+    assert np.allclose(data["event index"], np.where(ds.filter.all)[0])
+    with pytest.raises(OSError):
+        export_parquet(out, [ds], ["deform"])
+    # the feature "index" does not clash with the event index column
+    out = export_parquet(tdir + "/index.parquet", [ds], ["index"])
+    data = pq.read_table(str(out)).to_pydict()
+    assert np.allclose(data["index"], ds["index"][ds.filter.all])
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
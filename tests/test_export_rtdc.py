@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function
+
+import shutil
+import tempfile
+
+import h5py
+import numpy as np
+
+from dclab import new_dataset
+
+from shapeout.export.rtdc import PRESETS, benchmark, export_rtdc
+
+from helper_methods import cleanup, retrieve_data
+
+
+def test_rtdc_layout():
+    path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
+    ds = new_dataset(path)
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_rtdc_")
+    out = export_rtdc(tdir + "/out", ds,
+                      ["area_um", "deform", "image", "contour", "trace"],
+                      filtered=False,
+                      compression="gzip",
+                      compression_opts=9,
+                      shuffle=True,
+                      chunk_events=3)
+    assert out.suffix == ".rtdc"
+    with h5py.File(str(out), "r") as h5:
+        image = h5["events"]["image"]
+        assert image.chunks[0] == 3
+        assert image.compression == "gzip"
+        assert image.compression_opts == 9
+        assert image.shuffle
+        tr = list(h5["events"]["trace"].keys())[0]
+        assert h5["events"]["trace"][tr].chunks[0] == 3
+    ds2 = new_dataset(out)
+    assert len(ds2) == len(ds)
+    assert np.allclose(ds2["deform"], ds["deform"])
+    for ii in [0, len(ds) - 1]:
+        assert np.all(ds2["image"][ii] == ds["image"][ii])
+        assert np.all(ds2["contour"][ii] == ds["contour"][ii])
+        for tr in ds["trace"]:
+            assert np.all(ds2["trace"][tr][ii] == ds["trace"][tr][ii])
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+def test_rtdc_filtered_no_compression():
+    path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
+    ds = new_dataset(path)
+    ds.filter.manual[:2] = False
+    ds.apply_filter()
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_rtdc_")
+    out = export_rtdc(tdir + "/out.rtdc", ds, ["deform", "image"],
+                      compression=None)
+    with h5py.File(str(out), "r") as h5:
+        assert h5["events"]["image"].compression is None
+    ds2 = new_dataset(out)
+    assert len(ds2) == len(ds) - 2
+    assert np.all(ds2["image"][0] == ds["image"][2])
+    try:
+        export_rtdc(out, ds, ["deform"])
+    except OSError:
+        pass
+    else:
+        assert False, "existing file must not be overridden"
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+def test_rtdc_no_experiment_section():
+    ds = new_dataset({"deform": np.linspace(.01, .1, 10),
+                      "area_um": np.linspace(20, 40, 10)})
+    ds.config._cfg.pop("experiment", None)
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_rtdc_")
+    out = export_rtdc(tdir + "/out.rtdc", ds, ["deform"])
+    with h5py.File(str(out), "r") as h5:
+        assert h5.attrs["experiment:event count"] == 10
+        assert np.allclose(h5["events"]["deform"], ds["deform"])
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+def test_rtdc_benchmark():
+    path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
+    ds = new_dataset(path)
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_rtdc_")
+    res = benchmark(ds, ["deform", "image", "trace"], reads=10,
+                    directory=tdir)
+    assert sorted(res.keys()) == sorted(PRESETS.keys())
+    for name in res:
+        assert res[name]["file size"] > 0
+        assert res[name]["write time"] > 0
+        assert res[name]["read latency"] > 0
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
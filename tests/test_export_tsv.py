@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function
+
+import gzip
+import io
+import shutil
+import tempfile
+
+import numpy as np
+
+from dclab import new_dataset
+
+from shapeout.export.tsv import export_tsv
+
+from helper_methods import cleanup, retrieve_data
+
+
+def test_tsv_identical_to_dclab():
+    path = retrieve_data("rtdc_data_minimal.zip")
+    ds = new_dataset(path)
+    ds.config["filtering"]["deform max"] = .1
+    ds.apply_filter()
+    assert 0 < np.sum(ds.filter.all) < len(ds)
+    features = ["area_um", "deform", "time"]
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_tsv_")
+    for filtered in [True, False]:
+        ref = "{}/ref_{}.tsv".format(tdir, filtered)
+        ds.export.tsv(ref, features, filtered=filtered)
+        out = export_tsv("{}/out_{}".format(tdir, filtered), ds, features,
+                         filtered=filtered, chunk_size=17)
+        assert out.name.endswith(".tsv")
+        with io.open(ref, "rb") as fd:
+            dref = fd.read()
+        with io.open(str(out), "rb") as fd:
+            dout = fd.read()
+        assert dref == dout
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+def test_tsv_gzip():
+    path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
+    ds = new_dataset(path)
+    features = ["area_um", "deform"]
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_export_tsv_")
+    ref = "{}/ref.tsv".format(tdir)
+    ds.export.tsv(ref, features)
+    out = export_tsv("{}/out".format(tdir), ds, features,
+                     chunk_size=2, compress=True)
+    assert out.name == "out.tsv.gz"
+    with io.open(ref, "rb") as fd:
+        dref = fd.read()
+    with gzip.open(str(out), "rb") as fd:
+        dout = fd.read()
+    assert dref == dout
+    shutil.rmtree(tdir, ignore_errors=True)
+    cleanup()
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -2,8 +2,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import division, print_function, unicode_literals
 
+import os
 import pathlib
 import shutil
+import sqlite3
 import tempfile
 
 from dclab import new_dataset
@@ -43,6 +45,42 @@ def test_collect_data_tree():
     shutil.rmtree(str(edest), ignore_errors=True)
 
 
+def test_collect_data_tree_callback():
+    features = ["area_um", "deform", "time"]
+    edest = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test"))
+    (edest / "0").mkdir()
+    (edest / "1").mkdir()
+    for ii in range(1, 5):
+        dat = new_dataset(data=example_data_dict(ii + 10, keys=features))
+        cfg = {"experiment": {"sample": "test sample",
+                              "run index": ii},
+               "imaging": {"pixel size": 0.34},
+               "setup": {"channel width": 20,
+                         "chip region": "channel",
+                         "flow rate": 0.04}
+               }
+        dat.config.update(cfg)
+        dat.export.hdf5(path=edest / "{}".format(ii % 2) /
+                        "{}.rtdc".format(ii),
+                        features=features)
+    # broken measurement
+    (edest / "0" / "broken.rtdc").open("w").close()
+    calls = []
+    tree = meta_tool.collect_data_tree([edest],
+                                       callback=calls.append,
+                                       interval=-1)
+    # one call per measurement
+    assert len(calls) == 4
+    assert calls[-1] == tree
+    assert len(calls[0][0]) == 1
+    assert len(calls[0][0][0]) == 2
+    assert tree == meta_tool.collect_data_tree([edest], workers=1)
+    assert len(tree[0]) == 2
+    assert tree[0][0][0][1].endswith("0")
+    assert [it[1][-6:] for it in tree[0][0][1:]] == ["2.rtdc", "4.rtdc"]
+    shutil.rmtree(str(edest), ignore_errors=True)
+
+
 def test_collect_data_tree_unicode():
     features = ["area_um", "deform", "time"]
     edest = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_únícòdè".encode("utf-8")))
@@ -74,6 +112,16 @@ def test_event_count_cache_unicode():
     assert ec == 2
 
 
+def test_dataset_hash_title():
+    for name in ["rtdc_data_minimal.zip",
+                 "rtdc_data_hdf5_contour_image_trace.zip"]:
+        path = retrieve_data(name)
+        ds = new_dataset(path)
+        assert meta_tool.get_dataset_hash(path) == ds.hash
+        assert meta_tool.get_title(path) == ds.title
+    cleanup()
+
+
 def test_hdf5():
     path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
     assert meta_tool.get_chip_region(path) == "channel"
@@ -85,6 +133,127 @@ def test_hdf5():
     cleanup()
 
 
+def test_meta_index():
+    features = ["area_um", "deform", "time"]
+    edest = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test"))
+    for ii in range(1, 4):
+        dat = new_dataset(data=example_data_dict(ii + 10, keys=features))
+        cfg = {"experiment": {"sample": "sample {}".format(ii % 2),
+                              "run index": ii,
+                              "date": "2018-01-0{}".format(ii)},
+               "imaging": {"pixel size": 0.34},
+               "setup": {"channel width": 20,
+                         "chip region": "channel",
+                         "flow rate": 0.04 * ii}
+               }
+        dat.config.update(cfg)
+        dat.export.hdf5(path=edest / "{}.rtdc".format(ii),
+                        features=features)
+    index = meta_tool.MetaIndex(edest / "index.db")
+    opened = []
+    File = meta_tool.h5py.File
+
+    def counting_file(name, *args, **kwargs):
+        opened.append(name)
+        return File(name, *args, **kwargs)
+
+    meta_tool.h5py.File = counting_file
+    try:
+        records = index.scan(edest)
+        assert len(records) == 3
+        assert len(opened) == 3
+        # only modified files are read again
+        path = edest / "2.rtdc"
+        st = path.stat()
+        os.utime(str(path), (st.st_atime, st.st_mtime + 10))
+        tree = meta_tool.collect_data_tree([edest], index=index)
+        assert len(opened) == 4
+        assert tree == meta_tool.collect_data_tree([edest])
+        assert len(index.scan(edest)) == 3
+        assert len(opened) == 4
+    finally:
+        meta_tool.h5py.File = File
+    # queries
+    assert len(index.query(sample="sample 1")) == 2
+    assert len(index.query(flow_rate=.08)) == 1
+    assert index.query(flow_rate=.08)[0].run_index == 2
+    assert len(index.query(chip_region="Channel")) == 3
+    assert len(index.query(date="2018-01-03")) == 1
+    assert len(index.query(date=("2018-01-01", "2018-01-02"))) == 2
+    assert len(index.query(directory=edest / "other")) == 0
+    assert index.get(edest / "3.rtdc").flow_rate == .12
+    # the database is not locked while scanning
+    for ii in range(1, 4):
+        path = edest / "{}.rtdc".format(ii)
+        st = path.stat()
+        os.utime(str(path), (st.st_atime, st.st_mtime + 20))
+    scan = index.iter_scan(edest)
+    next(scan)
+    other = sqlite3.connect(str(edest / "index.db"), timeout=0)
+    with other:
+        other.execute("DELETE FROM measurements WHERE path=?",
+                      ("{}".format(edest / "3.rtdc"),))
+    other.close()
+    assert len(list(scan)) == 2
+    assert len(index) == 3
+    # deleted files are removed from the index
+    (edest / "3.rtdc").unlink()
+    assert len(index.scan(edest)) == 2
+    assert len(index) == 2
+    # relative directories
+    (edest / "2.rtdc").unlink()
+    cwd = os.getcwd()
+    try:
+        os.chdir(str(edest))
+        assert len(index.scan(".")) == 1
+        assert len(index.query(directory=".")) == 1
+    finally:
+        os.chdir(cwd)
+    assert len(index) == 1
+    index.close()
+    shutil.rmtree(str(edest), ignore_errors=True)
+
+
+def test_metadata_single_open():
+    path = retrieve_data("rtdc_data_hdf5_contour_image_trace.zip")
+    title = new_dataset(path).title
+    opened = []
+    File = meta_tool.h5py.File
+
+    def counting_file(name, *args, **kwargs):
+        opened.append(name)
+        return File(name, *args, **kwargs)
+
+    meta_tool.h5py.File = counting_file
+    try:
+        meta_tool.collect_data_tree([path.parent])
+        assert len(opened) == 1
+        # memoized
+        assert meta_tool.get_flow_rate(path) == .16
+        assert meta_tool.get_chip_region(path) == "channel"
+        assert len(opened) == 1
+        meta = meta_tool.get_metadata(path)
+        assert meta.title == title
+        assert meta.event_count == 5
+        # modified files are read again
+        st = path.stat()
+        os.utime(str(path), (st.st_atime, st.st_mtime + 10))
+        meta_tool.get_metadata(path)
+        assert len(opened) == 2
+        # relative paths share the entry of the resolved path
+        os.utime(str(path), (st.st_atime, st.st_mtime + 20))
+        cwd = os.getcwd()
+        try:
+            os.chdir(str(path.parent))
+            meta_tool.collect_data_tree(["."])
+        finally:
+            os.chdir(cwd)
+        assert len(opened) == 3
+    finally:
+        meta_tool.h5py.File = File
+    cleanup()
+
+
 def test_tdms():
     path = retrieve_data("rtdc_data_minimal.zip")
     assert meta_tool.get_chip_region(path) == "channel"
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function
+
+import os
+import pathlib
+import zipfile
+
+import numpy as np
+
+from dclab.polygon_filter import PolygonFilter
+from dclab.rtdc_dataset import Configuration
+
+from shapeout.session import archive, conversion, index, rw
+
+from helper_methods import cleanup, extract_session, retrieve_session
+
+
+SESSIONS = ["session_v0.6.0.zmso",
+            "session_v0.7.0_hierarchy2.zmso",
+            "session_v0.7.5_hierarchy1.zmso",
+            "session_v0.8.0.zmso",
+            "session_v0.8.4_hierarchy_filtman.zmso",
+            ]
+
+
+def test_config_loads():
+    for name in SESSIONS:
+        tempdir, _ = extract_session(name)
+        arc = archive.SessionArchive(retrieve_session(name))
+        for member in arc.names():
+            if member.endswith("config.txt"):
+                cfg = arc.get_config(member)
+                ref = Configuration(files=[os.path.join(tempdir, member)])
+                assert repr(cfg) == repr(ref)
+    cleanup()
+
+
+def test_conversion_in_memory():
+    name = "session_v0.7.5_hierarchy2.zmso"
+    path = retrieve_session(name)
+    arc = archive.SessionArchive(path)
+    version = conversion.compatibilitize_archive(arc, hash_update=False)
+    assert str(version) == "0.0.1"
+    assert arc.converted
+    # extracted and converted session
+    tempdir, _ = extract_session(name)
+    conversion.compatibilitize_session(tempdir, hash_update=False)
+    ref = archive.SessionArchive(tempdir)
+    assert arc.names() == ref.names()
+    assert arc.get_index() == index.index_load(tempdir)
+    for member in arc.names():
+        if member.endswith("config.txt"):
+            assert repr(arc.get_config(member)) == repr(ref.get_config(member))
+    # the session file is not changed
+    with zipfile.ZipFile(path) as zarc:
+        assert arc.read_bytes("index.txt") != zarc.read("index.txt")
+    assert archive.SessionArchive(path).modified == set()
+    cleanup()
+
+
+def test_load_without_extraction():
+    name = "session_v0.8.4_hierarchy_filtman.zmso"
+    path = retrieve_session(name)
+    extractall = zipfile.ZipFile.extractall
+    calls = []
+
+    def count_extractall(*args, **kwargs):
+        calls.append(args)
+        return extractall(*args, **kwargs)
+
+    try:
+        zipfile.ZipFile.extractall = count_extractall
+        mms = rw.load(path, search_path=os.path.dirname(path))
+    finally:
+        zipfile.ZipFile.extractall = extractall
+    assert not calls
+    assert mms[0].title == '0000_SessionTest - M1'
+    assert mms[1].title == '0000_SessionTest - M1_child'
+    assert len(mms[1]) == 37
+    assert not mms[1].filter.manual[26]
+    cleanup()
+
+
+def test_format_v2():
+    name = "session_v0.8.4_hierarchy_filtman.zmso"
+    path = retrieve_session(name)
+    arc = archive.SessionArchive(path)
+    assert arc.format_version == 1
+    mms = rw.load(arc, search_path=os.path.dirname(path))
+    tempdir, _ = extract_session(name)
+    fsave = os.path.join(tempdir, "converted.zmso")
+    rw.save(fsave, mms)
+    arc2 = archive.SessionArchive(fsave)
+    assert arc2.format_version == 2
+    assert not arc2.exists("index.txt")
+    assert sorted(arc2.get_index()) == sorted(arc.get_index())
+    mms2 = rw.load(arc2, search_path=os.path.dirname(path))
+    for mm, mm2 in zip(mms, mms2):
+        assert mm.title == mm2.title
+        assert mm.identifier == mm2.identifier
+        assert np.all(mm.filter.manual == mm2.filter.manual)
+        assert repr(mm.config) == repr(mm2.config)
+    assert len(mms2[1]) == 37
+    cleanup()
+
+
+def test_polygon_loads():
+    for name in SESSIONS:
+        tempdir, _ = extract_session(name)
+        pfile = pathlib.Path(tempdir) / "PolygonFilters.poly"
+        if not pfile.exists():
+            continue
+        arc = archive.SessionArchive(retrieve_session(name))
+        PolygonFilter.clear_all_filters()
+        PolygonFilter.import_all(pfile)
+        ref = PolygonFilter.instances
+        definitions = arc.get_polygon_definitions()
+        assert len(definitions) == len(ref)
+        for kwargs, pf in zip(definitions, ref):
+            assert kwargs["unique_id"] == pf.unique_id
+            assert kwargs["name"] == pf.name
+            assert kwargs["inverted"] == pf.inverted
+            assert tuple(kwargs["axes"]) == tuple(pf.axes)
+            assert np.all(kwargs["points"] == pf.points)
+    PolygonFilter.clear_all_filters()
+    cleanup()
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, unicode_literals
+
+from distutils.version import LooseVersion
+import hashlib
+import os
+import pathlib
+import shutil
+import tempfile
+
+import dclab
+
+from shapeout.session import conversion, locator
+
+from helper_methods import retrieve_data, cleanup
+
+
+def setup_tree():
+    """Copies of a measurement in a directory tree
+
+    The copy in "b" is modified and does not match the hash.
+    """
+    source = pathlib.Path(retrieve_data(
+        "rtdc_data_hdf5_contour_image_trace.zip"))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_locator_"))
+    for sub in ["a", "b", "c/d"]:
+        (tdir / sub).mkdir(parents=True)
+    shutil.copy(str(source), str(tdir / "a" / "M1_data.rtdc"))
+    shutil.copy(str(source), str(tdir / "b" / "M1_data.rtdc"))
+    shutil.copy(str(source), str(tdir / "c" / "d" / "M1_data.rtdc"))
+    with (tdir / "b" / "M1_data.rtdc").open("r+b") as fd:
+        fd.seek(1000)
+        fd.write(b"modified")
+    ref = tdir / "a" / "M1_data.rtdc"
+    index_item = {"hash": dclab.new_dataset(ref).hash,
+                  "tdms hash": conversion.hashfile_sha(ref)}
+    return tdir, index_item
+
+
+def test_find():
+    tdir, index_item = setup_tree()
+    cdir = tempfile.mkdtemp(prefix="shapeout_test_locator_cache_")
+    walk = os.walk
+    walked = []
+
+    def count_walk(top, *args, **kwargs):
+        walked.append(top)
+        return walk(top, *args, **kwargs)
+
+    try:
+        locator.os.walk = count_walk
+        loc = locator.MeasurementLocator([tdir / "b", tdir], cache_dir=cdir)
+        # directories are not traversed twice
+        loc.add_directory(tdir / "c")
+        assert len(walked) == len(set(walked)) == 5
+        for version in ["0.7.0", "0.8.0"]:
+            found = loc.find("/data/M1_data.rtdc", index_item,
+                             LooseVersion(version))
+            assert found == (tdir / "c" / "d" / "M1_data.rtdc").resolve()
+        assert loc.find("/data/M2_data.rtdc", index_item,
+                        LooseVersion("0.8.0")) is None
+        assert len(walked) == 5
+    finally:
+        locator.os.walk = walk
+    # compatibility
+    found = conversion.search_hashed_measurement(
+        "M1_data.rtdc", index_item, [tdir / "a"], LooseVersion("0.8.0"))
+    assert found == (tdir / "a" / "M1_data.rtdc").resolve()
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    shutil.rmtree(cdir, ignore_errors=True)
+    cleanup()
+
+
+def test_hash_files():
+    tdir, index_item = setup_tree()
+    cdir = tempfile.mkdtemp(prefix="shapeout_test_locator_cache_")
+    (tdir / "empty.rtdc").open("wb").close()
+    paths = [tdir / "a" / "M1_data.rtdc",
+             tdir / "b" / "M1_data.rtdc",
+             tdir / "empty.rtdc"]
+    ref = []
+    for pp in paths:
+        with pp.open("rb") as fd:
+            ref.append(hashlib.sha256(fd.read()).hexdigest())
+    assert [locator.hashfile_sha(pp) for pp in paths] == ref
+    # small blocks and no memory-mapping
+    mmap = locator.mmap.mmap
+
+    def no_mmap(*args, **kwargs):
+        raise EnvironmentError("mmap not available")
+
+    try:
+        locator.mmap.mmap = no_mmap
+        assert [locator.hashfile_sha(pp, blocksize=1000)
+                for pp in paths] == ref
+    finally:
+        locator.mmap.mmap = mmap
+    assert locator.hash_files(paths, workers=3, cache_dir=cdir) == ref
+    assert ref[0] == index_item["tdms hash"]
+    # broken measurements
+    hashes = locator.hash_files(paths[1:], method="dataset", workers=2,
+                                cache_dir=cdir, ignore_errors=True)
+    assert hashes == [None, None]
+    # cached
+    hashfile = locator.hashfile_sha
+    try:
+        locator.hashfile_sha = None
+        assert locator.hash_files(paths, workers=3, cache_dir=cdir) == ref
+    finally:
+        locator.hashfile_sha = hashfile
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    shutil.rmtree(cdir, ignore_errors=True)
+    cleanup()
+
+
+def test_hash_cache():
+    tdir, index_item = setup_tree()
+    cdir = tempfile.mkdtemp(prefix="shapeout_test_locator_cache_")
+    path = tdir / "a" / "M1_data.rtdc"
+    new_dataset = locator.dclab.new_dataset
+    opened = []
+
+    def count_new_dataset(*args, **kwargs):
+        opened.append(args)
+        return new_dataset(*args, **kwargs)
+
+    try:
+        locator.dclab.new_dataset = count_new_dataset
+        for _ in range(3):
+            assert (locator.get_hash(path, "dataset", cdir)
+                    == index_item["hash"])
+        assert len(opened) == 1
+        # modified files are hashed again
+        with path.open("r+b") as fd:
+            fd.seek(1000)
+            fd.write(b"modified")
+        os.utime(str(path), (0, 0))
+        assert (locator.get_hash(path, "dataset", cdir)
+                != index_item["hash"])
+        assert len(opened) == 2
+    finally:
+        locator.dclab.new_dataset = new_dataset
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    shutil.rmtree(cdir, ignore_errors=True)
+    cleanup()
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
@@ -5,8 +5,15 @@ from __future__ import division, print_function
 
 import os
 import tempfile
+import time
+import zipfile
 
-from shapeout.session import rw
+import numpy as np
+
+from dclab import new_dataset
+from dclab.polygon_filter import PolygonFilter
+
+from shapeout.session import archive, manual, rw
 from shapeout.analysis import Analysis
 
 from helper_methods import cleanup, retrieve_data
@@ -34,6 +41,220 @@ def test_rw_basic():
         pass
 
 
+def test_rw_hierarchy():
+    f1 = retrieve_data("rtdc_data_traces_video.zip")
+    f2 = retrieve_data("rtdc_data_minimal.zip")
+    an = Analysis([f1, f2])
+    mm1, mm2 = an.measurements
+    # deep and wide hierarchies; children are listed before their parents
+    ch1 = new_dataset(mm1)
+    ch1.config["filtering"]["deform max"] = .1
+    ch11 = new_dataset(ch1)
+    ch111 = new_dataset(ch11)
+    ch2 = new_dataset(mm2)
+    ch3 = new_dataset(mm2)
+    msave = [ch111, ch2, ch11, mm1, ch3, ch1, mm2]
+    _fd, fsave = tempfile.mkstemp(
+        suffix=".zsmo", prefix="shapeout_test_session_")
+    rw.save(path=fsave, rtdc_list=msave)
+    # count the created configurations
+    configuration = rw.Configuration
+    parsed = []
+
+    def count_configuration(*args, **kwargs):
+        parsed.append(kwargs["cfg"])
+        return configuration(*args, **kwargs)
+
+    try:
+        rw.Configuration = count_configuration
+        mload = rw.load(fsave)
+    finally:
+        rw.Configuration = configuration
+
+    assert len(parsed) == len(msave)
+    for ms, ml in zip(msave, mload):
+        assert ms.identifier == ml.identifier
+        assert ms.format == ml.format
+        if ms.format == "hierarchy":
+            assert msave.index(ms.hparent) == mload.index(ml.hparent)
+    assert mload[5].config["filtering"]["deform max"] == .1
+
+    # missing parent
+    arc = archive.SessionArchive(fsave)
+    manifest = arc.get_manifest()
+    manifest["measurements"] = [me for me in manifest["measurements"]
+                                if not me["key"].startswith("4_")]
+    arc.write_text(archive.MANIFEST, archive.manifest_dumps(manifest))
+    try:
+        rw.load(arc)
+    except rw.SessionHierarchyError:
+        pass
+    else:
+        assert False, "missing parents must raise SessionHierarchyError"
+
+    cleanup()
+    try:
+        os.remove(fsave)
+    except OSError:
+        pass
+
+
+def test_rw_lazy():
+    f1 = retrieve_data("rtdc_data_traces_video.zip")
+    f2 = retrieve_data("rtdc_data_minimal.zip")
+    an = Analysis([f1, f2])
+    mm1, mm2 = an.measurements
+    mm1.filter.manual[[1, 5]] = False
+    msave = [mm1, mm2]
+    for ii in range(48):
+        ch = new_dataset(msave[ii % 2])
+        ch.title = "child {}".format(ii)
+        msave.append(ch)
+    _fd, fsave = tempfile.mkstemp(
+        suffix=".zsmo", prefix="shapeout_test_session_")
+    rw.save(path=fsave, rtdc_list=msave)
+    # count the opened measurements
+    new_ds = rw.new_dataset
+    opened = []
+
+    def count_new_dataset(*args, **kwargs):
+        opened.append(args)
+        return new_ds(*args, **kwargs)
+
+    try:
+        rw.new_dataset = count_new_dataset
+        t0 = time.time()
+        mload = rw.load(fsave, lazy=True)
+        assert time.time() - t0 < 1
+        assert not opened
+        # session data are available without opening the measurements
+        assert mload[2].title == "child 0"
+        assert mload[2].identifier == msave[2].identifier
+        assert mload[1].config["filtering"]["enable filters"]
+        mload[3].title = "peter"
+        assert not opened
+        # features open the measurement and its parent
+        assert len(mload[2]) == len(msave[2])
+        assert len(opened) == 2
+        assert mload[0].attached and mload[2].attached
+        assert not mload[1].attached
+        assert mload[2].hparent is mload[0].attach()
+        assert np.all(mload[0].filter.manual == mm1.filter.manual)
+        # measurements that are not attached are saved as loaded
+        rw.save(path=fsave, rtdc_list=mload)
+        assert len(opened) == 2
+    finally:
+        rw.new_dataset = new_ds
+    mload2 = rw.load(fsave)
+    assert mload2[3].title == "peter"
+    assert mload2[3].hparent is mload2[1]
+    assert np.all(mload2[0].filter.manual == mm1.filter.manual)
+    for ms, ml in zip(msave, mload2):
+        assert ms.identifier == ml.identifier
+    cleanup()
+    try:
+        os.remove(fsave)
+    except OSError:
+        pass
+
+
+def test_rw_manual():
+    f1 = retrieve_data("rtdc_data_traces_video.zip")
+    f2 = retrieve_data("rtdc_data_minimal.zip")
+    an = Analysis([f1, f2])
+    mm1, mm2 = an.measurements
+    ch1 = new_dataset(mm1)
+    # few excluded events are stored as indices
+    mm1.filter.manual[[1, 5]] = False
+    # many excluded events are stored bit-packed
+    mm2.filter.manual[::2] = False
+    ch1.apply_filter()
+    ch1.filter.manual[3] = False
+    ch1.apply_filter()
+    ref1 = mm1.filter.manual.copy()
+    ref2 = mm2.filter.manual.copy()
+    refc = ch1.filter.manual.copy()
+    _fd, fsave = tempfile.mkstemp(
+        suffix=".zsmo", prefix="shapeout_test_session_")
+    rw.save(path=fsave, rtdc_list=[mm1, mm2, ch1])
+    with zipfile.ZipFile(fsave) as arc:
+        names = [nn.split("/")[-1] for nn in arc.namelist()]
+    assert manual.MANUAL_EXCLUDED in names
+    assert manual.MANUAL_PACKED in names
+    assert manual.MANUAL_LEGACY not in names
+    mload = rw.load(fsave)
+    assert np.all(mload[0].filter.manual == ref1)
+    assert np.all(mload[1].filter.manual == ref2)
+    assert np.all(mload[2].filter.manual == refc)
+    cleanup()
+    try:
+        os.remove(fsave)
+    except OSError:
+        pass
+
+
+def test_manual_compression():
+    for size in [0, 1, 7, 8, 9, 300, 70000]:
+        for frac in [0, .01, .5, 1]:
+            mm = np.ones(size, dtype=bool)
+            mm[:int(size*frac)] = False
+            np.random.RandomState(size).shuffle(mm)
+            name, data = manual.compress_manual(mm)
+            assert data.nbytes <= max(mm.size // 8 + 1, 1)
+            assert np.all(manual.decompress_manual(name, data, size) == mm)
+    res = manual.benchmark(size=10000, fractions=[0, .001, .5])
+    assert res[0]["name"] == manual.MANUAL_EXCLUDED
+    assert res[.5]["name"] == manual.MANUAL_PACKED
+    for frac in res:
+        assert res[frac]["size"] < res[frac]["legacy size"]
+
+
+def test_rw_state():
+    f1 = retrieve_data("rtdc_data_traces_video.zip")
+    f2 = retrieve_data("rtdc_data_minimal.zip")
+    an = Analysis([f1, f2])
+    mm1, mm2 = an.measurements
+    ch1 = new_dataset(mm1)
+    msave = [mm1, mm2, ch1]
+    PolygonFilter.clear_all_filters()
+    PolygonFilter(axes=["area_um", "deform"],
+                  points=[[0, 0], [1, 1], [0, 1]],
+                  name="peter")
+    state = rw.get_session_state(msave)
+    fp = rw.get_state_fingerprint(state)
+    assert rw.get_state_fingerprint(rw.get_session_state(msave)) == fp
+    # modifications change the fingerprint, but not the snapshot
+    mm1.title = "peter"
+    fp_title = rw.get_state_fingerprint(rw.get_session_state(msave))
+    assert fp_title != fp
+    mm2.config["filtering"]["deform max"] = .1
+    fp_config = rw.get_state_fingerprint(rw.get_session_state(msave))
+    assert fp_config not in [fp, fp_title]
+    mm2.filter.manual[0] = False
+    fp_manual = rw.get_state_fingerprint(rw.get_session_state(msave))
+    assert fp_manual not in [fp, fp_title, fp_config]
+    assert rw.get_state_fingerprint(state) == fp
+    # the snapshot is saved
+    _fd, fsave = tempfile.mkstemp(
+        suffix=".zsmo", prefix="shapeout_test_session_")
+    rw.save_state(fsave, state)
+    mload = rw.load(fsave)
+    assert mload[0].title != "peter"
+    assert mload[1].config["filtering"]["deform max"] != .1
+    assert mload[1].filter.manual[0]
+    assert mload[2].hparent is mload[0]
+    assert len(PolygonFilter.instances) == 1
+    assert PolygonFilter.instances[0].name == "peter"
+    assert np.allclose(PolygonFilter.instances[0].points,
+                       [[0, 0], [1, 1], [0, 1]])
+    PolygonFilter.clear_all_filters()
+    cleanup()
+    try:
+        os.remove(fsave)
+    except OSError:
+        pass
+
+
 if __name__ == "__main__":
     # Run all tests
     loc = locals()
@@ -2,7 +2,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import division, print_function
 
+import os
 import pathlib
+import shutil
+import tempfile
 
 from shapeout import settings
 
@@ -15,6 +18,48 @@ def test_cfg_basic():
     assert wd.parent == pathlib.Path(cfg.get_path("Peter")).resolve()
 
 
+def test_cfg_cache():
+    tdir = tempfile.mkdtemp(prefix="shapeout_test_settings_")
+    cfg1 = settings.SettingsFile(directory=tdir)
+    cfg2 = settings.SettingsFile(directory=tdir)
+    cfg1.set_bool("expert mode", True)
+    cfg1.set_int("peter", 12)
+    # other instances use the same cache
+    assert cfg2.get_bool("expert mode")
+    assert cfg2.get_int("peter") == 12
+    # no temporary files are left
+    assert os.listdir(tdir) == [settings.NAME]
+    # the file is not parsed if it did not change
+    parse = settings._parse
+    calls = []
+
+    def count_parse(lines):
+        calls.append(lines)
+        return parse(lines)
+
+    try:
+        settings._parse = count_parse
+        for _ in range(10):
+            assert cfg1.get_int("peter") == 12
+        assert not calls
+        # modification by another process
+        with open(str(cfg1.cfgfile), "w") as fd:
+            fd.write("peter = 13\n")
+        assert cfg1.get_int("peter") == 13
+        assert cfg2.get_int("peter") == 13
+        assert len(calls) == 1
+    finally:
+        settings._parse = parse
+    # `load` returns a copy
+    cdict = cfg1.load()
+    cdict["peter"] = "14"
+    assert cfg1.get_int("peter") == 13
+    # the file is missing while another process replaces it (Windows)
+    os.remove(str(cfg1.cfgfile))
+    assert cfg2.get_int("peter") == 13
+    shutil.rmtree(tdir, ignore_errors=True)
+
+
 if __name__ == "__main__":
     # Run all tests
     loc = locals()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, unicode_literals
+
+import io
+import pathlib
+import shutil
+import tempfile
+
+import nptdms
+import numpy as np
+
+from shapeout import meta_tool, tdms_header
+
+from helper_methods import retrieve_data, cleanup
+
+
+def get_nptdms_lengths(path):
+    tdmsfd = nptdms.TdmsFile(str(path))
+    lengths = {}
+    for opath, obj in tdmsfd.objects.items():
+        if opath.count("/'") == 2:
+            lengths[opath] = 0 if obj.data is None else len(obj.data)
+    return lengths
+
+
+def test_compare_nptdms():
+    # the other tdms files of the examples are truncated
+    path = retrieve_data("rtdc_data_traces_video.zip")
+    assert tdms_header.get_channel_lengths(path) == get_nptdms_lengths(path)
+    cleanup()
+
+
+def test_event_count():
+    tdms = retrieve_data("rtdc_data_minimal.zip")
+    tdmsfd = nptdms.TdmsFile(str(tdms))
+    length = len(tdmsfd.object("Cell Track", "time").data)
+    assert tdms_header.get_channel_length(tdms, "Cell Track",
+                                          "time") == length
+    assert meta_tool.get_event_count_cache(tdms) == length
+    try:
+        tdms_header.get_channel_length(tdms, "Cell Track", "peter")
+    except KeyError:
+        pass
+    else:
+        assert False, "missing channels must raise KeyError"
+    cleanup()
+
+
+def test_multiple_segments():
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_tdms_"))
+    path = tdir / "segments.tdms"
+    with nptdms.TdmsWriter(str(path)) as writer:
+        writer.write_segment([
+            nptdms.ChannelObject("Cell Track", "time", np.arange(10.)),
+            nptdms.ChannelObject("Cell Track", "area", np.arange(10)),
+        ])
+        # same channels, different lengths
+        writer.write_segment([
+            nptdms.ChannelObject("Cell Track", "time", np.arange(7.)),
+            nptdms.ChannelObject("Cell Track", "area", np.arange(3)),
+        ])
+        # only one channel
+        writer.write_segment([
+            nptdms.ChannelObject("Cell Track", "time", np.arange(5.)),
+        ])
+    lengths = tdms_header.get_channel_lengths(path)
+    assert lengths == get_nptdms_lengths(path)
+    assert lengths[tdms_header.get_object_path("Cell Track", "time")] == 22
+    assert lengths[tdms_header.get_object_path("Cell Track", "area")] == 13
+    shutil.rmtree(str(tdir), ignore_errors=True)
+
+
+def test_truncated():
+    tdms = pathlib.Path(retrieve_data("rtdc_data_minimal.zip"))
+    full = tdms_header.get_channel_lengths(tdms)
+    # The last segment of this file is truncated; nptdms pads the
+    # missing values of the last event with zeros.
+    nplengths = get_nptdms_lengths(tdms)
+    for channel in ["time", "x", "y"]:
+        opath = tdms_header.get_object_path("Cell Track", channel)
+        assert full[opath] == nplengths[opath]
+    for channel in ["ax1", "ax2", "circularity", "area", "raw area"]:
+        opath = tdms_header.get_object_path("Cell Track", channel)
+        assert full[opath] == nplengths[opath] - 1
+    traces = list(pathlib.Path(retrieve_data(
+        "rtdc_data_traces_video.zip")).parent.glob("*_traces.tdms"))[0]
+    lengths = tdms_header.get_channel_lengths(traces)
+    assert get_nptdms_lengths(traces)[
+        tdms_header.get_object_path("fluorescence traces", "FL1raw")] == 44000
+    assert lengths[
+        tdms_header.get_object_path("fluorescence traces", "FL1raw")] == 2563
+    assert lengths[
+        tdms_header.get_object_path("fluorescence traces", "FL1med")] == 2000
+    # truncated copy
+    with io.open(str(tdms), "rb") as fd:
+        data = fd.read()
+    path = tdms.with_name("truncated.tdms")
+    with io.open(str(path), "wb") as fd:
+        fd.write(data[:-100])
+    lengths = tdms_header.get_channel_lengths(path)
+    assert sorted(lengths.keys()) == sorted(full.keys())
+    assert all([lengths[kk] <= full[kk] for kk in full])
+    assert sum(lengths.values()) < sum(full.values())
+    # incomplete values are not counted
+    path = tdms.with_name("truncated2.tdms")
+    with nptdms.TdmsWriter(str(path)) as writer:
+        writer.write_segment([
+            nptdms.ChannelObject("Cell Track", "time", np.arange(10.)),
+        ])
+    with io.open(str(path), "rb") as fd:
+        data = fd.read()
+    with io.open(str(path), "wb") as fd:
+        fd.write(data[:-3 * 8 - 4])
+    lengths = tdms_header.get_channel_lengths(path)
+    assert lengths[tdms_header.get_object_path("Cell Track", "time")] == 6
+    cleanup()
+
+
+def test_not_tdms():
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_tdms_"))
+    path = tdir / "invalid.tdms"
+    with io.open(str(path), "wb") as fd:
+        fd.write(b"This is not a tdms file, but it is long enough.")
+    try:
+        tdms_header.get_channel_lengths(path)
+    except tdms_header.TdmsHeaderError:
+        pass
+    else:
+        assert False, "invalid files must raise TdmsHeaderError"
+    shutil.rmtree(str(tdir), ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()
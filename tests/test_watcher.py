@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function, unicode_literals
+
+import pathlib
+import shutil
+import tempfile
+import time
+
+from shapeout import watcher
+
+from helper_methods import retrieve_data, cleanup
+
+
+def check_watcher(inotify):
+    source = pathlib.Path(retrieve_data(
+        "rtdc_data_hdf5_contour_image_trace.zip"))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_watcher_"))
+    (tdir / "old").mkdir()
+    shutil.copy(str(source), str(tdir / "old" / "M1_data.rtdc"))
+    calls = []
+
+    def callback(added, modified, removed):
+        calls.append((added, modified, removed))
+
+    dw = watcher.DataWatcher(callback=callback, settle=.2, inotify=inotify)
+    dw.watch(tdir)
+    # existing files are not reported
+    assert dw.check(timeout=.1) == ([], [], [])
+    # new file in a new subdirectory
+    (tdir / "new").mkdir()
+    new = tdir / "new" / "M1_data.rtdc"
+    shutil.copy(str(source), str(new))
+    assert dw.check(timeout=.1) == ([], [], []), "file has not settled"
+    time.sleep(.3)
+    assert dw.check(timeout=.1) == ([new], [], [])
+    # incomplete files are not reported
+    broken = tdir / "new" / "M2_data.rtdc"
+    with broken.open("wb") as fd:
+        fd.write(b"incomplete")
+    dw.check(timeout=.1)
+    time.sleep(.3)
+    assert dw.check(timeout=.1) == ([], [], [])
+    # modified and removed files
+    new.touch()
+    (tdir / "old" / "M1_data.rtdc").unlink()
+    dw.check(timeout=.1)
+    time.sleep(.3)
+    assert dw.check(timeout=.1) == ([], [new],
+                                    [tdir / "old" / "M1_data.rtdc"])
+    assert len(calls) == 2
+    dw.stop()
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def test_inotify():
+    try:
+        watcher._InotifyBackend().close()
+    except watcher.WatcherError:
+        # inotify not available on this system
+        return
+    check_watcher(inotify=True)
+
+
+def test_polling():
+    check_watcher(inotify=False)
+
+
+def test_watch_limit():
+    try:
+        watcher._InotifyBackend().close()
+    except watcher.WatcherError:
+        # inotify not available on this system
+        return
+    source = pathlib.Path(retrieve_data(
+        "rtdc_data_hdf5_contour_image_trace.zip"))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_watcher_"))
+    add_watch = watcher._InotifyBackend._add_watch
+
+    def limited_add_watch(self, path):
+        if path.name == "new":
+            raise watcher.WatchLimitError("limit reached")
+        return add_watch(self, path)
+
+    dw = watcher.DataWatcher(callback=lambda *args: None, settle=.2,
+                             inotify=True)
+    dw.watch(tdir)
+    try:
+        watcher._InotifyBackend._add_watch = limited_add_watch
+        assert dw.check(timeout=.1) == ([], [], [])
+        # switch to polling when a new subdirectory cannot be watched
+        (tdir / "new").mkdir()
+        new = tdir / "new" / "M1_data.rtdc"
+        shutil.copy(str(source), str(new))
+        dw.check(timeout=.1)
+        assert isinstance(dw._backend, watcher._PollingBackend)
+    finally:
+        watcher._InotifyBackend._add_watch = add_watch
+    time.sleep(.3)
+    assert dw.check(timeout=.1) == ([new], [], [])
+    # stopping does not wait for the next search
+    dw.poll_interval = 60
+    dw.start()
+    t0 = time.time()
+    dw.stop()
+    assert time.time() - t0 < 5
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+def test_thread():
+    source = pathlib.Path(retrieve_data(
+        "rtdc_data_hdf5_contour_image_trace.zip"))
+    tdir = pathlib.Path(tempfile.mkdtemp(prefix="shapeout_test_watcher_"))
+    calls = []
+
+    def callback(added, modified, removed):
+        calls.append((added, modified, removed))
+
+    dw = watcher.DataWatcher(callback=callback, interval=.05, settle=.1,
+                             poll_interval=.05)
+    dw.watch(tdir)
+    dw.start()
+    time.sleep(.2)
+    shutil.copy(str(source), str(tdir / "M1_data.rtdc"))
+    for _ in range(100):
+        if calls:
+            break
+        time.sleep(.05)
+    dw.stop()
+    assert calls == [([tdir / "M1_data.rtdc"], [], [])]
+    shutil.rmtree(str(tdir), ignore_errors=True)
+    cleanup()
+
+
+if __name__ == "__main__":
+    # Run all tests
+    loc = locals()
+    for key in list(loc.keys()):
+        if key.startswith("test_") and hasattr(loc[key], "__call__"):
+            loc[key]()